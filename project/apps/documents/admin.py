@@ -1,8 +1,16 @@
 from django.contrib import admin
-from .models import DocumentUpload
+from .models import DocumentUpload, DispoliveSubmission
 
 @admin.register(DocumentUpload)
 class DocumentUploadAdmin(admin.ModelAdmin):
-    list_display = ('id', 'original_name', 'user', 'created_at')
+    list_display = ('id', 'original_name', 'user', 'created_at', 'processing_status', 'extraction_cache_status')
     search_fields = ('original_name', 'user__username', 'user__email')
-    list_filter = ('created_at',)
\ No newline at end of file
+    list_filter = ('created_at',)
+
+
+@admin.register(DispoliveSubmission)
+class DispoliveSubmissionAdmin(admin.ModelAdmin):
+    list_display = ('id', 'upload', 'status', 'attempts', 'next_attempt_at', 'created_at', 'sent_at')
+    list_filter = ('status',)
+    search_fields = ('upload__original_name', 'idempotency_key')
+
@@ -4,3 +4,8 @@ from django.apps import AppConfig
 class DocumentsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'apps.documents'
+
+    def ready(self):
+        # Schema prompt + OpenAI connection pool are built once per worker process
+        from .services import gpt_client
+        gpt_client.warm_up()
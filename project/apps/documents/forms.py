@@ -211,6 +211,30 @@ class DispoliveReportForm(forms.ModelForm):
         initial['begruendung_sonstiges'] = ''
 
         return cls(initial=initial)
+
+    # parsed_data field -> form field of the printed numbers cross-checked by local OCR
+    NUMERIC_FIELDS = {
+        'kostentraegerkennung': 'kostentraegerkennung',
+        'insurance_number': 'versichertennr',
+        'status_number': 'insurance_status',
+        'betriebsstaetten_nr': 'betriebsstaetten_nr',
+        'arzt_nr': 'arzt_nr',
+    }
+
+    def mark_numeric_checks(self, checks):
+        """Mark fields local OCR confirmed (is-valid) or contradicted (is-invalid, OCR value as tooltip)."""
+        for parsed_name, check in (checks or {}).items():
+            field = self.fields.get(self.NUMERIC_FIELDS.get(parsed_name, ''))
+            if field is None or check.get('status') not in ('agree', 'disagree'):
+                continue
+            classes = field.widget.attrs.get('class', '').split()
+            if check['status'] == 'agree':
+                classes.append('is-valid')
+                field.widget.attrs['title'] = 'Confirmed by OCR of the printed number'
+            else:
+                classes.append('is-invalid')
+                field.widget.attrs['title'] = f"OCR reads {check.get('ocr', '')} - please check"
+            field.widget.attrs['class'] = ' '.join(classes)
     
     def to_parsed_data(self):
         """Convert form data back to JSON structure for Dispolive."""
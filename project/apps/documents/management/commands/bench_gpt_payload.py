@@ -0,0 +1,124 @@
+"""
+Compare GPT image payload settings (services/image_payload.py) on sample pages.
+
+For every preset it reports the payload size, the estimated image tokens and
+the time to build the payload. With --call each fixture is also sent to GPT
+(OPENAI_API_KEY needed), and the request latency and field accuracy are added.
+Accuracy is measured against --expected/<fixture stem>.json ({"data": {...}},
+e.g. a reviewed result). Without that file it is measured against the
+"original" preset, i.e. how many fields stay the same as with today's full
+render.
+
+    python manage.py bench_gpt_payload --limit 5
+    python manage.py bench_gpt_payload --limit 10 --call --preset original --preset gray-jpeg
+"""
+import json
+import time
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.documents.services.gpt_client import parse_form_page_to_new_parser
+from apps.documents.services.image_payload import prepare_image
+from apps.documents.services.page_image import PageImage
+from apps.documents.services.pdf_utils import pdf_page_to_image
+
+
+_BASE = {"resize": True, "max_tiles": None, "grayscale": False, "format": "", "jpeg_quality": 85, "detail": "high"}
+
+PRESETS = {
+    "original": {**_BASE, "resize": False},
+    "native": _BASE,
+    "gray": {**_BASE, "grayscale": True},
+    "gray-jpeg": {**_BASE, "grayscale": True, "format": "JPEG"},
+    "gray-jpeg-q70": {**_BASE, "grayscale": True, "format": "JPEG", "jpeg_quality": 70},
+    "tiles-4": {**_BASE, "grayscale": True, "format": "JPEG", "max_tiles": 4},
+    "low": {**_BASE, "grayscale": True, "format": "JPEG", "detail": "low"},
+}
+
+
+def _field_accuracy(expected: dict, actual: dict) -> tuple[int, int]:
+    """(matching fields, compared fields) over expected['data']."""
+    exp = expected.get("data") if isinstance(expected.get("data"), dict) else {}
+    act = actual.get("data") if isinstance(actual.get("data"), dict) else {}
+
+    def norm(v):
+        return " ".join(str(v).split()).lower() if v not in (None, "") else ""
+
+    matches = sum(1 for k, v in exp.items() if norm(v) == norm(act.get(k)))
+    return matches, len(exp)
+
+
+class Command(BaseCommand):
+    help = "Payload size / tokens / latency / accuracy of the GPT image settings."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--limit", type=int, default=5, help="Fixtures per kind (PDF / photo).")
+        parser.add_argument("--media-root", default=str(settings.MEDIA_ROOT))
+        parser.add_argument("--preset", action="append", choices=list(PRESETS),
+                            help="Presets to run (default: all). Repeat the option for several.")
+        parser.add_argument("--call", action="store_true", help="Send every payload to GPT (costs tokens).")
+        parser.add_argument("--expected", help="Directory with <fixture stem>.json reference results.")
+
+    def _fixtures(self, media_root: Path, limit: int):
+        for path in sorted((media_root / "uploads" / "pdfs").glob("*.pdf"))[:limit]:
+            yield path, pdf_page_to_image(str(path))
+        for path in sorted((media_root / "document_photos").glob("*.jpg"))[:limit]:
+            yield path, PageImage.from_file(str(path))
+
+    def handle(self, *args, **options):
+        presets = options["preset"] or list(PRESETS)
+        if options["call"]:
+            # "original" runs first: it is the reference when there is no expected file
+            presets = ["original", *[p for p in presets if p != "original"]]
+        expected_dir = Path(options["expected"]) if options["expected"] else None
+
+        totals = {name: {"bytes": 0, "tokens": 0, "prepare_s": 0.0, "call_s": 0.0, "match": 0, "fields": 0}
+                  for name in presets}
+        count = 0
+        for path, page in self._fixtures(Path(options["media_root"]), options["limit"]):
+            count += 1
+            reference = None
+            if expected_dir and (expected_dir / f"{path.stem}.json").exists():
+                reference = json.loads((expected_dir / f"{path.stem}.json").read_text(encoding="utf-8"))
+
+            for name in presets:
+                t0 = time.perf_counter()
+                _, info = prepare_image(page, PRESETS[name])
+                totals[name]["prepare_s"] += time.perf_counter() - t0
+                totals[name]["bytes"] += info["bytes"]
+                totals[name]["tokens"] += info["est_tokens"]
+                if not options["call"]:
+                    continue
+
+                t0 = time.perf_counter()
+                try:
+                    result = parse_form_page_to_new_parser(page, image_options=PRESETS[name])
+                except Exception as e:
+                    self.stderr.write(f"{name}: {path.name}: {e}")
+                    result = {}
+                totals[name]["call_s"] += time.perf_counter() - t0
+                if reference is None and name == "original":
+                    reference = result
+                if reference is not None:
+                    match, fields = _field_accuracy(reference, result)
+                    totals[name]["match"] += match
+                    totals[name]["fields"] += fields
+
+        if not count:
+            raise CommandError("No fixtures found under MEDIA_ROOT (uploads/pdfs, document_photos).")
+
+        self.stdout.write(f"Fixtures: {count}")
+        header = f"{'preset':<16}{'KB':>9}{'est tokens':>12}{'prepare ms':>12}"
+        if options["call"]:
+            header += f"{'latency s':>11}{'accuracy':>10}"
+        self.stdout.write(header)
+        for name in presets:
+            t = totals[name]
+            line = (f"{name:<16}{t['bytes'] / 1024 / count:>9.0f}{t['tokens'] / count:>12.0f}"
+                    f"{t['prepare_s'] * 1000 / count:>12.1f}")
+            if options["call"]:
+                accuracy = f"{100 * t['match'] / t['fields']:.1f}%" if t["fields"] else "n/a"
+                line += f"{t['call_s'] / count:>11.2f}{accuracy:>10}"
+            self.stdout.write(line)
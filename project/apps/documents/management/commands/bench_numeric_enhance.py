@@ -0,0 +1,137 @@
+"""
+Micro-benchmark + pixel check for the NumPy image helpers in DocumentProcessingMixin.
+
+Runs the old per-pixel loop implementations and the vectorized ones on the
+Arzt-Nr. crop (5x upscaled, as in production) of sample PDFs/photos,
+fails if any output pixel differs and prints the timings.
+
+    python manage.py bench_numeric_enhance --limit 10
+"""
+import time
+from pathlib import Path
+
+import numpy as np
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from PIL import Image, ImageEnhance, ImageStat
+
+from apps.documents.mixins import DocumentProcessingMixin
+from apps.documents.services.page_image import PageImage
+from apps.documents.services.pdf_utils import pdf_page_to_image
+
+
+# --- Reference implementations (per-pixel loops, as before vectorization) ---
+
+def _legacy_remove_vertical_lines(img: Image.Image) -> Image.Image:
+    img = img.convert("L") if img.mode != "L" else img.copy()
+    w, h = img.size
+    pix = img.load()
+    dark_thresh = max(30, ImageStat.Stat(img).mean[0] - 40)
+    dark_cols = [x for x in range(w) if sum(1 for y in range(h) if pix[x, y] < dark_thresh) / h > 0.7]
+    for x in dark_cols:
+        for y in range(h):
+            pix[x, y] = 255
+    return img
+
+
+def _legacy_remove_horizontal_lines(img: Image.Image) -> Image.Image:
+    img = img.convert("L") if img.mode != "L" else img.copy()
+    w, h = img.size
+    pix = img.load()
+    dark_thresh = max(30, ImageStat.Stat(img).mean[0] - 40)
+    dark_rows = [y for y in range(h) if sum(1 for x in range(w) if pix[x, y] < dark_thresh) / w > 0.7]
+    for y in dark_rows:
+        for x in range(w):
+            pix[x, y] = 255
+    return img
+
+
+def _legacy_enhance_numeric(img: Image.Image) -> Image.Image:
+    if img.mode != "L":
+        img = img.convert("L")
+    img = ImageEnhance.Contrast(img).enhance(3.0)
+    img = ImageEnhance.Sharpness(img).enhance(3.0)
+    img = _legacy_remove_vertical_lines(img)
+    img = _legacy_remove_horizontal_lines(img)
+    pix = img.load()
+    w, h = img.size
+    thresh = max(90, ImageStat.Stat(img).mean[0] - 30)
+    for y in range(h):
+        for x in range(w):
+            pix[x, y] = 0 if pix[x, y] < thresh else 255
+    return img
+
+
+def _legacy_mark(box: Image.Image) -> bool:
+    box = box.convert("L")
+    thresh = max(25, ImageStat.Stat(box).mean[0] - 25)
+    pix = box.load()
+    dark = sum(1 for y in range(box.height) for x in range(box.width) if pix[x, y] < thresh)
+    return (dark / max(1, box.width * box.height)) > 0.015
+
+
+class Command(BaseCommand):
+    help = "Compare vectorized image helpers with the per-pixel reference (pixel-identical + timings)."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--limit", type=int, default=5, help="Fixtures per kind (PDF / photo).")
+        parser.add_argument("--media-root", default=str(settings.MEDIA_ROOT))
+
+    def _fixtures(self, media_root: Path, limit: int):
+        for path in sorted((media_root / "uploads" / "pdfs").glob("*.pdf"))[:limit]:
+            yield path.name, pdf_page_to_image(str(path))
+        for path in sorted((media_root / "document_photos").glob("*.jpg"))[:limit]:
+            yield path.name, PageImage.from_file(str(path))
+
+    def handle(self, *args, **options):
+        mixin = DocumentProcessingMixin()
+        cases = {
+            "remove_vertical_lines": (_legacy_remove_vertical_lines, mixin._remove_vertical_lines),
+            "remove_horizontal_lines": (_legacy_remove_horizontal_lines, mixin._remove_horizontal_lines),
+            "enhance_numeric": (_legacy_enhance_numeric, mixin._enhance_numeric),
+        }
+        timings = {name: [0.0, 0.0] for name in [*cases, "trip_direction_hints"]}
+        mismatches = []
+        count = 0
+
+        for name, page in self._fixtures(Path(options["media_root"]), options["limit"]):
+            count += 1
+            crop = mixin._crop_region(page, mixin._arzt_box(page), scale=5).convert("L")
+            for case, (legacy, vectorized) in cases.items():
+                t0 = time.perf_counter()
+                expected = legacy(crop)
+                t1 = time.perf_counter()
+                actual = vectorized(crop)
+                t2 = time.perf_counter()
+                timings[case][0] += t1 - t0
+                timings[case][1] += t2 - t1
+                if not np.array_equal(np.asarray(expected), np.asarray(actual)):
+                    mismatches.append(f"{case}: {name}")
+
+            mid = crop.width // 2
+            t0 = time.perf_counter()
+            expected_hints = {
+                "outbound": _legacy_mark(crop.crop((0, 0, mid, crop.height))),
+                "return": _legacy_mark(crop.crop((mid, 0, crop.width, crop.height))),
+            }
+            t1 = time.perf_counter()
+            actual_hints = mixin._trip_direction_hints(crop)
+            t2 = time.perf_counter()
+            timings["trip_direction_hints"][0] += t1 - t0
+            timings["trip_direction_hints"][1] += t2 - t1
+            if expected_hints != actual_hints:
+                mismatches.append(f"trip_direction_hints: {name}")
+
+        if not count:
+            raise CommandError("No fixtures found under MEDIA_ROOT (uploads/pdfs, document_photos).")
+
+        self.stdout.write(f"Fixtures: {count} (Arzt-Nr. crop, 5x)")
+        self.stdout.write(f"{'stage':<26}{'loops ms':>12}{'numpy ms':>12}{'speed-up':>10}")
+        for case, (legacy_s, numpy_s) in timings.items():
+            legacy_ms = legacy_s * 1000 / count
+            numpy_ms = numpy_s * 1000 / count
+            self.stdout.write(f"{case:<26}{legacy_ms:>12.1f}{numpy_ms:>12.2f}{legacy_ms / max(numpy_ms, 1e-6):>9.0f}x")
+
+        if mismatches:
+            raise CommandError("Output differs from the reference:\n" + "\n".join(mismatches))
+        self.stdout.write(self.style.SUCCESS("All outputs are pixel-identical."))
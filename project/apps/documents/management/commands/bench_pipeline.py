@@ -0,0 +1,334 @@
+"""
+Stage-by-stage benchmark of the documents pipeline, with a regression check.
+
+Each stage runs on sample pages (uploads/pdfs, document_photos under
+MEDIA_ROOT) or on GPT answers, the same way _parse_page / build_payload use it:
+- pdf_page_to_base64_png: render page 1 of a PDF (250 dpi);
+- pdf_region_crops: page 1 (250 dpi) plus every numeric_ocr field box
+  (Arzt-Nr. included, taken page-relative) at 5x that DPI, from one open
+  PdfDocument; only the boxes are rasterized at the high DPI;
+- photo_normalize: photo_geometry.normalize() of a decoded photo (sheet,
+  perspective, orientation);
+- crop_base64_region: Arzt-Nr. crop (placed on the registered form), 5x,
+  enhance + numeric_enhance;
+- ocr_digits_from_b64: Tesseract on that crop (skipped without tesseract);
+- read_numeric_fields: numeric_ocr.read_fields(), all printed numbers in one
+  Tesseract call, form registration included (skipped without tesseract);
+- trip_direction_hints: checkbox marks on that crop;
+- gpt_postprocess: json.loads + gpt_client.postprocess() of a GPT answer;
+- normalize_block13_doctor_contact: on the answer's ordering party fields;
+- build_payload: with an in-process Dispolive stand-in (no delay) and the
+  lookup cache off, so every call does its reference lookups.
+GPT answers are the recorded OpenAI fixtures (openai_fixtures) when there are
+any, otherwise the built-in SAMPLE_ANSWERS.
+
+Per stage it reports ms per call (wall and CPU, the best of --repeat runs)
+and the peak of Python/NumPy allocations (tracemalloc, one extra run; PIL and
+MuPDF buffers are not traced). CPU time is process-wide, so build_payload
+includes the lookup threads and the stand-in.
+
+With a baseline file (--save-baseline writes one) every stage is compared
+with it and the command fails when a stage got slower or uses more memory
+than the tolerance allows. Timings depend on the machine: save the baseline
+on the machine that runs the check.
+
+    python manage.py bench_pipeline --limit 5 --save-baseline
+    python manage.py bench_pipeline --limit 5              # fails on a regression
+"""
+import json
+import logging
+import platform
+import time
+import tracemalloc
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.test import override_settings
+
+from dispolive_de import api_client, cache, standin
+from dispolive_de.parser_new import build_payload
+
+from apps.documents.mixins import DocumentProcessingMixin
+from apps.documents.services import gpt_client, numeric_ocr, ocr_engine, openai_standin, photo_geometry
+from apps.documents.services.normalization import normalize_block13_doctor_contact
+from apps.documents.services.page_image import PageImage
+from apps.documents.services.pdf_utils import PdfDocument, pdf_page_to_base64_png
+
+
+STAGES = (
+    "pdf_page_to_base64_png",
+    "pdf_region_crops",
+    "photo_normalize",
+    "crop_base64_region",
+    "ocr_digits_from_b64",
+    "read_numeric_fields",
+    "trip_direction_hints",
+    "gpt_postprocess",
+    "normalize_block13_doctor_contact",
+    "build_payload",
+)
+
+# Synthetic answers (no real patient data) for trees without recorded fixtures
+SAMPLE_ANSWERS: List[Dict[str, Any]] = [
+    {"data": {
+        "insurance_name": "AOK Nordost", "patient_last_name": "Muster", "patient_first_name": "Erika",
+        "patient_birth_date": "12.03.1948", "patient_street": "Hauptstr. 5", "patient_zip": "10115",
+        "patient_city": "Berlin", "kostentraegerkennung": "109519005", "insurance_number": "2123456789",
+        "status_number": "5000 1", "betriebsstaetten_nr": "721234500", "arzt_nr": "12345678",
+        "prescription_date": "01.10.2026", "transport_outbound": True, "transport_return": True,
+        "reason_full_or_partial_inpatient": False, "reason_pre_post_inpatient": False,
+        "reason_ambulatory_with_marker": False, "reason_other": False, "reason_high_frequency": True,
+        "reason_mobility_impairment_6m": False, "reason_other_ktw": False, "treatment_date_from": "02.10.2026",
+        "treatment_frequency_per_week": "3", "treatment_until": "30.12.2026",
+        "treatment_location_name": "Dialysezentrum Mitte, Invalidenstr. 10, 10115 Berlin",
+        "treatment_location_city": "", "transport_taxi": False, "transport_ktw": True, "transport_rtw": False,
+        "transport_naw_nef": False, "transport_other": False, "equipment_wheelchair": False,
+        "equipment_transport_chair": True, "equipment_lying": True, "medical_reason_text": "Dialyse",
+        "ktw_reason_text": "", "treatment_location_street": "", "treatment_location_zip": "",
+        "ordering_party_name": "Dr. med. Hans Beispiel",
+        "ordering_party_info": "Praxis fuer Innere Medizin\nTorstr. 20\n10119 Berlin\nTel. 030 1234567 Fax 030 1234568",
+        "ordering_party_zip": "", "ordering_party_city": "", "ordering_party_phone": "",
+        "reason_accident": False, "reason_work_accident": False, "reason_care_condition": False,
+    }, "flags": []},
+    {"data": {
+        "insurance_name": "Techniker Krankenkasse", "patient_last_name": "Beispiel", "patient_first_name": "Max",
+        "patient_birth_date": "01.01.1950", "kostentraegerkennung": "IK 101575519", "insurance_number": "F123456789",
+        "status_number": "1000000", "betriebsstaetten_nr": "000000000", "arzt_nr": "987654321",
+        "prescription_date": "05.10.2026", "transport_outbound": False, "transport_return": True,
+        "reason_full_or_partial_inpatient": True, "reason_pre_post_inpatient": True,
+        "treatment_date_from": "06.10.2026", "treatment_location_name": "Charite Campus Virchow",
+        "treatment_location_street": "Augustenburger Platz 1", "treatment_location_zip": "13353",
+        "treatment_location_city": "Berlin", "transport_taxi": True,
+        "ordering_party_name": "", "ordering_party_info": "Gemeinschaftspraxis Nord\nMuellerstr. 1\n13353 Berlin",
+        "ordering_party_zip": "13353", "ordering_party_city": "Berlin", "ordering_party_phone": "Telefon: 030 7654321",
+        "reason_accident": True, "reason_work_accident": True,
+    }, "flags": []},
+]
+
+
+def _measure(calls: List[Callable[[], Any]], repeat: int) -> Dict[str, float]:
+    """ms per call (wall, CPU: best run of `repeat`) and the traced peak in MB."""
+    best_wall = best_cpu = float("inf")
+    for _ in range(repeat):
+        w0, c0 = time.perf_counter(), time.process_time()
+        for call in calls:
+            call()
+        best_wall = min(best_wall, time.perf_counter() - w0)
+        best_cpu = min(best_cpu, time.process_time() - c0)
+
+    peak = 0
+    tracemalloc.start()
+    try:
+        for call in calls:
+            tracemalloc.reset_peak()
+            call()
+            peak = max(peak, tracemalloc.get_traced_memory()[1])
+    finally:
+        tracemalloc.stop()
+    return {
+        "calls": len(calls),
+        "wall_ms": round(best_wall * 1000 / len(calls), 3),
+        "cpu_ms": round(best_cpu * 1000 / len(calls), 3),
+        "peak_mb": round(peak / (1024 * 1024), 2),
+    }
+
+
+def _render_with_crops(pdf_path: str) -> list:
+    """Page 1 and its field boxes at 5x, as _parse_page renders them for a PDF upload."""
+    boxes = [spec["box"] for spec in numeric_ocr.MUSTER4_NUMBER_FIELDS.values()]
+    with PdfDocument(pdf_path) as pdf:
+        page = pdf.render(1)
+        return [page] + [page.render_region(box, 5) for box in boxes]
+
+
+def _ordering_party(answer: Dict[str, Any]) -> Dict[str, Any]:
+    """block13_doctor_contact in the shape normalize_block13_doctor_contact expects (as in build_payload)."""
+    d = answer.get("data") if isinstance(answer.get("data"), dict) else {}
+    return {"block13_doctor_contact": {
+        "auftraggeberName": d.get("ordering_party_name", ""),
+        "auftraggeberInfo": d.get("ordering_party_info", ""),
+        "auftraggeberZip": d.get("ordering_party_zip", ""),
+        "auftraggeberCity": d.get("ordering_party_city", ""),
+        "auftraggeberTelefon": d.get("ordering_party_phone", ""),
+    }}
+
+
+class Command(BaseCommand):
+    help = "Time every pipeline stage (wall / CPU / peak memory) and fail on regressions against a baseline."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--limit", type=int, default=5, help="Fixtures per kind (PDF / photo / GPT answer).")
+        parser.add_argument("--media-root", default=str(settings.MEDIA_ROOT))
+        parser.add_argument("--repeat", type=int, default=3, help="Timed runs per stage (the best one counts).")
+        parser.add_argument("--stage", action="append", choices=STAGES, help="Stages to run (default: all).")
+        parser.add_argument("--baseline", default=str(Path(settings.BASE_DIR) / "benchmarks" / "pipeline_baseline.json"))
+        parser.add_argument("--save-baseline", action="store_true", help="Write the results as the new baseline.")
+        parser.add_argument("--tolerance", type=float, default=25.0, help="Allowed slow-down in %% (wall and CPU).")
+        parser.add_argument("--memory-tolerance", type=float, default=20.0, help="Allowed peak memory growth in %%.")
+        parser.add_argument("--min-delta-ms", type=float, default=1.0,
+                            help="Ignore slow-downs below this many ms per call (timer noise).")
+        parser.add_argument("--verbose", action="store_true", help="Keep the pipeline's own log output.")
+
+    def _pages(self, media_root: Path, limit: int) -> List[Tuple[str, Optional[Callable[[], str]], str]]:
+        """(name, render call or None, base64 page) per fixture."""
+        mixin = DocumentProcessingMixin()
+        pages = []
+        for path in sorted((media_root / "uploads" / "pdfs").glob("*.pdf"))[:limit]:
+            pages.append((path.name, lambda p=str(path): pdf_page_to_base64_png(p), pdf_page_to_base64_png(str(path))))
+        for path in sorted((media_root / "document_photos").glob("*.jpg"))[:limit]:
+            pages.append((path.name, None, mixin._photo_to_base64(str(path))))
+        return pages
+
+    def _answers(self, limit: int) -> Tuple[str, List[Tuple[str, str]]]:
+        """(source, [(name, raw GPT answer JSON)])."""
+        answers = []
+        for path, fixture in openai_standin.FixtureStore(openai_standin.fixtures_dir()).all():
+            try:
+                answers.append((path.stem[:16], fixture["body"]["choices"][0]["message"]["content"]))
+            except (KeyError, IndexError, TypeError):
+                continue
+            if len(answers) >= limit:
+                break
+        if answers:
+            return "recorded", answers
+        return "sample", [(f"sample-{i}", json.dumps(a)) for i, a in enumerate(SAMPLE_ANSWERS)]
+
+    def handle(self, *args, **options):
+        if options["repeat"] < 1:
+            raise CommandError("--repeat must be at least 1.")
+        stages = [s for s in STAGES if s in (options["stage"] or STAGES)]
+        if not options["verbose"]:
+            logging.getLogger().setLevel(logging.ERROR)
+
+        mixin = DocumentProcessingMixin()
+        pages = self._pages(Path(options["media_root"]), options["limit"])
+        if not pages:
+            raise CommandError("No fixtures found under MEDIA_ROOT (uploads/pdfs, document_photos).")
+        answer_source, answers = self._answers(options["limit"])
+        arzt_boxes = [mixin._arzt_box(PageImage.from_base64(b64)) for _, _, b64 in pages]
+        crops = [mixin._crop_base64_region(b64, box, scale=5, enhance=True, numeric_enhance=True)
+                 for (_, _, b64), box in zip(pages, arzt_boxes)]
+        photos = [PageImage.from_base64(b64) for _, render, b64 in pages if render is None]
+        for photo in photos:
+            photo.pixels  # decoded outside the timed stage
+        trip_hints = [mixin._trip_direction_hints(crop) for crop in crops]
+        processed = [gpt_client.postprocess(json.loads(raw), trip_hints[i % len(trip_hints)])
+                     for i, (_, raw) in enumerate(answers)]
+
+        calls: Dict[str, List[Callable[[], Any]]] = {
+            "pdf_page_to_base64_png": [render for _, render, _ in pages if render is not None],
+            "pdf_region_crops": [
+                lambda p=str(path): _render_with_crops(p)
+                for path in sorted((Path(options["media_root"]) / "uploads" / "pdfs").glob("*.pdf"))[:options["limit"]]
+            ],
+            "photo_normalize": [lambda p=photo: photo_geometry.normalize(p) for photo in photos],
+            "crop_base64_region": [
+                lambda b=b64, x=box: mixin._crop_base64_region(b, x, scale=5, enhance=True, numeric_enhance=True)
+                for (_, _, b64), box in zip(pages, arzt_boxes)
+            ],
+            "ocr_digits_from_b64": [lambda c=crop: mixin._ocr_digits_from_b64(c) for crop in crops],
+            "read_numeric_fields": [
+                lambda b=b64: numeric_ocr.read_fields(PageImage.from_base64(b)) for _, _, b64 in pages
+            ],
+            "trip_direction_hints": [lambda c=crop: mixin._trip_direction_hints(c) for crop in crops],
+            "gpt_postprocess": [
+                lambda r=raw, h=trip_hints[i % len(trip_hints)]: gpt_client.postprocess(json.loads(r), h)
+                for i, (_, raw) in enumerate(answers)
+            ],
+            "normalize_block13_doctor_contact": [
+                lambda a=answer: normalize_block13_doctor_contact(_ordering_party(a)) for answer in processed
+            ],
+            "build_payload": [lambda a=answer: build_payload(a) for answer in processed],
+        }
+        skipped = {}
+        if not ocr_engine.available():
+            skipped["ocr_digits_from_b64"] = skipped["read_numeric_fields"] = "tesseract is not installed"
+        for stage in stages:
+            if not calls[stage]:
+                skipped.setdefault(stage, "no fixtures")
+
+        results: Dict[str, Dict[str, float]] = {}
+        server = None
+        previous = api_client.BASE_URL, cache.BACKEND
+        try:
+            if "build_payload" in stages and "build_payload" not in skipped:
+                profiles = {name: {**p, "median_ms": 0, "p95_ms": 0} for name, p in standin.DEFAULT_PROFILES.items()}
+                server = standin.StandInServer(("127.0.0.1", 0), profiles=profiles, seed=0)
+                server.start()
+                api_client.BASE_URL = server.base_url
+                cache.BACKEND = "off"
+            # The OCR result cache would turn every repeat after the first into a hit
+            with override_settings(DOCUMENTS_OCR_CACHE_SIZE=0):
+                for stage in stages:
+                    if stage not in skipped:
+                        results[stage] = _measure(calls[stage], options["repeat"])
+        finally:
+            api_client.BASE_URL, cache.BACKEND = previous
+            if server is not None:
+                server.shutdown()
+                server.server_close()
+
+        current = {
+            "created_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "machine": f"{platform.node()} {platform.machine()} Python {platform.python_version()}",
+            "repeat": options["repeat"],
+            "ocr_backend": ocr_engine.backend(),
+            "fixtures": [name for name, _, _ in pages],
+            "answers": {"source": answer_source, "names": [name for name, _ in answers]},
+            "stages": results,
+        }
+        self._report(current, skipped)
+
+        baseline_path = Path(options["baseline"])
+        if options["save_baseline"]:
+            baseline_path.parent.mkdir(parents=True, exist_ok=True)
+            baseline_path.write_text(json.dumps(current, indent=2), encoding="utf-8")
+            self.stdout.write(self.style.SUCCESS(f"Baseline saved: {baseline_path}"))
+            return
+        if not baseline_path.exists():
+            self.stdout.write(f"No baseline at {baseline_path}; run with --save-baseline to create one.")
+            return
+        self._compare(json.loads(baseline_path.read_text(encoding="utf-8")), current, baseline_path, options)
+
+    def _report(self, current: Dict[str, Any], skipped: Dict[str, str]) -> None:
+        self.stdout.write(f"Fixtures: {len(current['fixtures'])} pages, "
+                          f"{len(current['answers']['names'])} GPT answers ({current['answers']['source']}), "
+                          f"best of {current['repeat']}, OCR {current['ocr_backend']} (result cache off)")
+        self.stdout.write(f"{'stage':<34}{'calls':>6}{'wall ms':>10}{'cpu ms':>10}{'peak MB':>10}")
+        for stage in STAGES:
+            m = current["stages"].get(stage)
+            if m:
+                self.stdout.write(f"{stage:<34}{m['calls']:>6}{m['wall_ms']:>10.2f}{m['cpu_ms']:>10.2f}{m['peak_mb']:>10.2f}")
+            elif stage in skipped:
+                self.stdout.write(f"{stage:<34}  skipped: {skipped[stage]}")
+
+    def _compare(self, baseline: Dict[str, Any], current: Dict[str, Any], path: Path, options) -> None:
+        if baseline.get("fixtures") != current["fixtures"] or baseline.get("answers") != current["answers"]:
+            raise CommandError(f"Baseline {path} was measured on other fixtures; "
+                               f"run with the same --limit / MEDIA_ROOT or save a new baseline.")
+        tolerance = 1 + options["tolerance"] / 100
+        memory_tolerance = 1 + options["memory_tolerance"] / 100
+        regressions = []
+        self.stdout.write(f"\nBaseline: {path} ({baseline.get('created_at')}, {baseline.get('machine')})")
+        self.stdout.write(f"{'stage':<34}{'wall':>10}{'cpu':>10}{'peak':>10}")
+        for stage, now in current["stages"].items():
+            before = baseline.get("stages", {}).get(stage)
+            if not before:
+                self.stdout.write(f"{stage:<34}  not in baseline")
+                continue
+            changes = []
+            for key, limit, min_delta in (("wall_ms", tolerance, options["min_delta_ms"]),
+                                          ("cpu_ms", tolerance, options["min_delta_ms"]),
+                                          ("peak_mb", memory_tolerance, 0.5)):
+                ratio = now[key] / before[key] if before[key] else 1.0
+                changes.append(f"{(ratio - 1) * 100:>+9.0f}%")
+                if ratio > limit and now[key] - before[key] > min_delta:
+                    regressions.append(f"{stage}: {key} {before[key]:g} -> {now[key]:g}")
+            self.stdout.write(f"{stage:<34}" + "".join(changes))
+
+        if regressions:
+            raise CommandError("Regressions against the baseline:\n" + "\n".join(regressions))
+        self.stdout.write(self.style.SUCCESS("No regressions against the baseline."))
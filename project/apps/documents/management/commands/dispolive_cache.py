@@ -0,0 +1,33 @@
+"""
+Dispolive lookup cache (vendor/dispolive_de/cache.py): hit-rate counters and reset.
+
+    python manage.py dispolive_cache           # counters per endpoint
+    python manage.py dispolive_cache --clear   # drop entries and counters
+
+With the Redis backend the counters are shared by all workers; with the
+in-process LRU they only cover the process running the command.
+"""
+from django.core.management.base import BaseCommand
+
+from dispolive_de import cache
+
+
+class Command(BaseCommand):
+    help = "Show Dispolive lookup cache hit rates, or clear the cache."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--clear", action="store_true", help="Delete cached lookups and counters.")
+
+    def handle(self, *args, **options):
+        if options["clear"]:
+            cache.clear()
+            self.stdout.write(self.style.SUCCESS("Dispolive cache cleared."))
+            return
+
+        self.stdout.write(f"Backend: {cache.backend_name()}")
+        self.stdout.write(f"{'endpoint':<16}{'hit':>8}{'stale':>8}{'negative':>10}{'miss':>8}{'error':>8}{'hit rate':>10}")
+        for endpoint, c in cache.stats().items():
+            rate = f"{100 * c['hit_rate']:.1f}%" if c["hit_rate"] is not None else "n/a"
+            self.stdout.write(
+                f"{endpoint:<16}{c['hit']:>8}{c['stale']:>8}{c['negative_hit']:>10}{c['miss']:>8}{c['error']:>8}{rate:>10}"
+            )
@@ -0,0 +1,185 @@
+"""
+Load test of the Dispolive client: build_payload + fahrberichte/add at a target rate.
+
+Without --base-url an in-process stand-in (vendor/dispolive_de/standin.py) is
+started with the given latency / error / rate-limit options. Requests start
+on a fixed schedule (open loop), so the total latency is measured from the
+scheduled start and includes waiting for a free worker.
+
+Reported: achieved throughput, p50/p95/p99/max of payload build, submit and
+total, answers per status, and retries (requests the server received minus
+requests the client made; the stand-in's /_stats is needed for that).
+
+    python manage.py dispolive_loadtest --rate 10 --duration 30
+    python manage.py dispolive_loadtest --rate 20 --requests 200 --error-rate 0.05 --rate-limit 30
+    python manage.py dispolive_loadtest --base-url http://127.0.0.1:8700/ --rate 5 --cache off
+"""
+import json
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List
+
+import requests
+from django.core.management.base import BaseCommand, CommandError
+
+from dispolive_de import api_client, cache, standin
+from dispolive_de.parser_new import build_payload
+
+from apps.documents.models import DocumentUpload
+
+
+def _percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))]
+
+
+def _synthetic_prescription(i: int, institutions: int) -> Dict[str, Any]:
+    transport = ("transport_ktw", "transport_taxi", "transport_rtw")[i % 3]
+    return {
+        "Versichertennr.": f"A{100000000 + i}",
+        "data": {
+            "patient_first_name": f"Test{i}",
+            "patient_last_name": "Lasttest",
+            "patient_birth_date": "01.01.1950",
+            "treatment_location_name": f"Klinik Lasttest {i % institutions}",
+            "treatment_location_street": "Teststr. 1",
+            "treatment_location_zip": "10115",
+            "treatment_location_city": "Berlin",
+            "treatment_date_from": "01.10.2026",
+            "transport_outbound": True,
+            transport: True,
+        },
+    }
+
+
+class Command(BaseCommand):
+    help = "Drive build_payload + fahrberichte/add at a target rate and report latency percentiles."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--base-url", help="Running stand-in (default: start one in-process).")
+        parser.add_argument("--rate", type=float, default=5.0, help="Target requests per second.")
+        parser.add_argument("--duration", type=float, default=30.0, help="Seconds to run (unless --requests).")
+        parser.add_argument("--requests", type=int, help="Number of reports to send.")
+        parser.add_argument("--workers", type=int, default=32, help="Max reports in flight.")
+        parser.add_argument("--cache", choices=("on", "off"), default="on", help="Dispolive lookup cache.")
+        parser.add_argument("--institutions", type=int, default=20, help="Distinct institutions (synthetic data).")
+        parser.add_argument("--from-db", action="store_true", help="Use parsed_data of stored uploads.")
+        parser.add_argument("--verbose", action="store_true", help="Keep the per-request client log.")
+        standin.add_arguments(parser)
+
+    def _prescriptions(self, options, count: int) -> List[Dict[str, Any]]:
+        if options["from_db"]:
+            stored = [u.parsed_data for u in DocumentUpload.objects.exclude(parsed_data__isnull=True)
+                      .only("parsed_data").order_by("-created_at")[:500] if isinstance(u.parsed_data, dict)]
+            if not stored:
+                raise CommandError("No uploads with parsed_data in the database.")
+            return [stored[i % len(stored)] for i in range(count)]
+        return [_synthetic_prescription(i, max(1, options["institutions"])) for i in range(count)]
+
+    def _server_stats(self, base_url: str) -> Dict[str, Any]:
+        try:
+            return requests.get(base_url + "_stats", timeout=5).json()
+        except (requests.RequestException, ValueError):
+            return {}
+
+    def handle(self, *args, **options):
+        if options["rate"] <= 0:
+            raise CommandError("--rate must be positive.")
+        count = options["requests"] or max(1, int(options["rate"] * options["duration"]))
+
+        server = None
+        base_url = options["base_url"]
+        if not base_url:
+            try:
+                server = standin.server_from_options(options)
+            except ValueError as e:
+                raise CommandError(str(e))
+            server.start()
+            base_url = server.base_url
+        base_url = base_url.rstrip("/") + "/"
+
+        if not options["verbose"]:
+            logging.getLogger().setLevel(logging.ERROR)
+        previous = api_client.BASE_URL, cache.BACKEND
+        api_client.BASE_URL = base_url
+        cache.BACKEND = "memory" if options["cache"] == "on" else "off"
+        cache.clear()
+        client_before = api_client.http_stats()
+        server_before = self._server_stats(base_url)
+
+        prescriptions = self._prescriptions(options, count)
+        results: List[Dict[str, Any]] = []
+        results_lock = threading.Lock()
+
+        def one(prescription: Dict[str, Any], scheduled: float) -> None:
+            started = time.perf_counter()
+            item = {"wait": started - scheduled, "build": None, "submit": None, "status": "build error"}
+            try:
+                payload = build_payload(prescription)
+                built = time.perf_counter()
+                item["build"] = built - started
+                try:
+                    status_code, _ = api_client.submit_driver_report(payload)
+                except api_client.SubmitOutcomeUnknown:
+                    status_code = None
+                item["submit"] = time.perf_counter() - built
+                item["status"] = str(status_code) if status_code else "no answer"
+            except Exception as e:
+                item["error"] = str(e)
+            item["total"] = time.perf_counter() - scheduled
+            with results_lock:
+                results.append(item)
+
+        self.stdout.write(f"Stand-in: {base_url}  target {options['rate']:g}/s  reports {count}  "
+                          f"workers {options['workers']}  cache {options['cache']}")
+        t0 = time.perf_counter()
+        try:
+            with ThreadPoolExecutor(max_workers=options["workers"]) as pool:
+                for i, prescription in enumerate(prescriptions):
+                    scheduled = t0 + i / options["rate"]
+                    delay = scheduled - time.perf_counter()
+                    if delay > 0:
+                        time.sleep(delay)
+                    pool.submit(one, prescription, scheduled)
+            elapsed = time.perf_counter() - t0
+        finally:
+            api_client.BASE_URL, cache.BACKEND = previous
+            if server is not None:
+                server.shutdown()
+                server.server_close()
+
+        self._report(results, elapsed, client_before, api_client.http_stats(), server_before,
+                     server.stats() if server is not None else self._server_stats(base_url))
+
+    def _report(self, results, elapsed, client_before, client_after, server_before, server_after):
+        self.stdout.write(f"\nSent {len(results)} in {elapsed:.1f} s -> {len(results) / elapsed:.2f} reports/s")
+
+        self.stdout.write(f"\n{'ms':<10}{'p50':>9}{'p95':>9}{'p99':>9}{'max':>9}")
+        for phase in ("wait", "build", "submit", "total"):
+            values = [r[phase] * 1000 for r in results if r.get(phase) is not None]
+            self.stdout.write(f"{phase:<10}" + "".join(
+                f"{_percentile(values, q):>9.0f}" for q in (0.5, 0.95, 0.99, 1.0)))
+
+        statuses: Dict[str, int] = {}
+        for r in results:
+            statuses[r["status"]] = statuses.get(r["status"], 0) + 1
+        self.stdout.write("\nReports: " + "  ".join(f"{k}={v}" for k, v in sorted(statuses.items())))
+        errors = [r["error"] for r in results if r.get("error")]
+        if errors:
+            self.stdout.write(self.style.WARNING(f"Exceptions: {len(errors)}, first: {errors[0]}"))
+
+        if not server_after:
+            self.stdout.write("\nRetries: n/a (server has no /_stats)")
+            return
+        self.stdout.write(f"\n{'endpoint':<30}{'client':>8}{'server':>8}{'retries':>9}  server answers")
+        for endpoint, codes in sorted(server_after.get("requests", {}).items()):
+            before = server_before.get("requests", {}).get(endpoint, {})
+            answers = {code: n - before.get(code, 0) for code, n in codes.items() if n - before.get(code, 0)}
+            received = sum(answers.values())
+            made = client_after.get(endpoint, {}).get("count", 0) - client_before.get(endpoint, {}).get("count", 0)
+            self.stdout.write(f"{endpoint:<30}{made:>8}{received:>8}{received - made:>9}  {json.dumps(answers)}")
+        self.stdout.write(f"Reports created: {server_after.get('reports_created', 0) - server_before.get('reports_created', 0)}")
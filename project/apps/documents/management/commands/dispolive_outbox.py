@@ -0,0 +1,55 @@
+"""
+Dispolive submission outbox (services/outbox.py): state, manual drain, dead letters.
+
+    python manage.py dispolive_outbox                  # rows per status, next retry
+    python manage.py dispolive_outbox --drain          # send everything that is due now
+    python manage.py dispolive_outbox --requeue-dead   # retry dead-lettered rows
+
+--requeue-dead leaves out rows with an unknown outcome (502/504, timeout
+after sending): Dispolive may have created those rides. Check them there and
+submit the review again to resend one.
+
+In "sync" processing mode a thread of the web process retries the rows of
+each submit; rows it left behind (the process was restarted during a backoff)
+wait for --drain, e.g. run from cron or after a deploy. In "queued" mode the
+worker task retries them.
+"""
+from django.core.management.base import BaseCommand
+from django.db.models import Count
+from django.utils import timezone
+
+from apps.documents.models import DispoliveSubmission
+from apps.documents.services import outbox
+
+
+class Command(BaseCommand):
+    help = "Show the Dispolive outbox, send due submissions or re-queue dead ones."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--drain", action="store_true", help="Send all due submissions now.")
+        parser.add_argument("--requeue-dead", action="store_true",
+                            help="Reset dead (not superseded, not outcome unknown) submissions to pending.")
+
+    def handle(self, *args, **options):
+        if options["requeue_dead"]:
+            dead = DispoliveSubmission.objects.filter(status="dead").exclude(last_error__startswith="Superseded")
+            unknown = dead.filter(last_error__startswith=outbox.UNKNOWN_PREFIX).count()
+            count = dead.exclude(last_error__startswith=outbox.UNKNOWN_PREFIX).update(
+                status="pending", attempts=0, next_attempt_at=timezone.now(), last_error=""
+            )
+            self.stdout.write(self.style.SUCCESS(f"Re-queued {count} submission(s)."))
+            if unknown:
+                self.stdout.write(self.style.WARNING(
+                    f"Left {unknown} submission(s) with an unknown outcome: check them in Dispolive first."))
+
+        if options["drain"]:
+            counts = outbox.deliver_due()
+            summary = ", ".join(f"{k}={v}" for k, v in sorted(counts.items())) or "nothing due"
+            self.stdout.write(self.style.SUCCESS(f"Drained: {summary}"))
+
+        rows = DispoliveSubmission.objects.values("status").annotate(n=Count("id")).order_by("status")
+        self.stdout.write(f"{'status':<10}{'count':>8}")
+        for row in rows:
+            self.stdout.write(f"{row['status']:<10}{row['n']:>8}")
+        next_at = outbox.next_attempt_at()
+        self.stdout.write(f"Next attempt: {timezone.localtime(next_at):%Y-%m-%d %H:%M:%S}" if next_at else "Next attempt: -")
@@ -0,0 +1,38 @@
+"""
+Run the local Dispolive stand-in (vendor/dispolive_de/standin.py) until Ctrl+C.
+
+    python manage.py dispolive_standin --port 8700
+    python manage.py dispolive_standin --port 8700 --error-rate 0.05 --rate-limit 20 \
+        --profile fahrberichte/add=2000:6000
+
+Point the client at it with DISPOLIVE_BASE_URL=http://127.0.0.1:8700/.
+"""
+from django.core.management.base import BaseCommand, CommandError
+
+from dispolive_de import standin
+
+
+class Command(BaseCommand):
+    help = "Serve a local stand-in for the Dispolive API (latency, errors, rate limit)."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--host", default="127.0.0.1")
+        parser.add_argument("--port", type=int, default=8700)
+        standin.add_arguments(parser)
+
+    def handle(self, *args, **options):
+        try:
+            server = standin.server_from_options(options, options["host"], options["port"])
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        for endpoint, p in server.profiles.items():
+            self.stdout.write(f"{endpoint:<30} median {p['median_ms']:>6.0f} ms  p95 {p['p95_ms']:>6.0f} ms  "
+                              f"errors {100 * p['error_rate']:.1f}% ({p['error_status']})")
+        self.stdout.write(self.style.SUCCESS(f"Dispolive stand-in on {server.base_url} (Ctrl+C to stop)"))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
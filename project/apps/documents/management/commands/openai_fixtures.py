@@ -0,0 +1,45 @@
+"""
+OpenAI record / replay fixtures (services/openai_standin.py).
+
+    python manage.py openai_fixtures           # count, size, recorded latency
+    python manage.py openai_fixtures --clear   # delete all fixtures
+
+Record with DOCUMENTS_OPENAI_STANDIN=record (e.g. while running
+bench_gpt_payload --call on the sample pages), replay with
+DOCUMENTS_OPENAI_STANDIN=replay.
+"""
+import shutil
+
+from django.core.management.base import BaseCommand
+
+from apps.documents.services import openai_standin
+
+
+class Command(BaseCommand):
+    help = "Show or delete the recorded OpenAI responses used by the replay stand-in."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--clear", action="store_true", help="Delete all recorded fixtures.")
+
+    def handle(self, *args, **options):
+        root = openai_standin.fixtures_dir()
+        if options["clear"]:
+            if root.exists():
+                shutil.rmtree(root)
+            self.stdout.write(self.style.SUCCESS(f"Deleted fixtures in {root}"))
+            return
+
+        self.stdout.write(f"Mode: {openai_standin.mode() or 'off'}  fixtures: {root}")
+        fixtures = list(openai_standin.FixtureStore(root).all()) if root.exists() else []
+        if not fixtures:
+            self.stdout.write("No fixtures recorded.")
+            return
+        latencies = sorted(f.get("elapsed_ms", 0) for _, f in fixtures)
+        size_kb = sum(path.stat().st_size for path, _ in fixtures) / 1024
+        self.stdout.write(
+            f"Fixtures: {len(fixtures)}  size: {size_kb:.0f} KB  recorded latency ms: "
+            f"median {latencies[len(latencies) // 2]}  max {latencies[-1]}"
+        )
+        for path, f in fixtures[-10:]:
+            self.stdout.write(f"  {f['fingerprint'][:16]}  {f.get('recorded_at', '')}  {f.get('elapsed_ms', 0):>6} ms  "
+                              f"{f.get('request', {}).get('model', '')}")
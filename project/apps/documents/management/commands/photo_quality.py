@@ -0,0 +1,202 @@
+"""
+Photo quality metrics (services/photo_quality.py) against extraction outcomes.
+
+Every processed photo stores its metrics in processing_metrics["photo_quality"].
+The command lists them next to the outcome (status, share of empty fields,
+warning flags) and counts which photos the given thresholds would reject, so
+a threshold can be checked against the uploads before it goes to the settings:
+
+    python manage.py photo_quality --limit 50
+    python manage.py photo_quality --min-sharpness 300      # what-if
+    python manage.py photo_quality --files media/document_photos/*.jpeg
+
+Outcomes only exist for photos that went to GPT: photos rejected at the time
+show "-" there. The summary also gives the share of photos on which the
+checkbox detector registered the form (processing_metrics["checkbox_registered"]).
+
+--calibrate checks the thresholds against known bad captures instead: every
+sample photo (--files, default media/document_photos/*.jpg) is degraded in
+CALIBRATION steps - blur, underexposure, a glare hotspot, the page far away on
+a desk - each marked as still legible or not (judged by eye on the small
+print), and the command counts false rejects and misses:
+
+    python manage.py photo_quality --calibrate
+    python manage.py photo_quality --calibrate --max-glare 0.1   # what-if
+"""
+import glob
+import hashlib
+import io
+from typing import Callable, Optional
+
+import numpy as np
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from PIL import Image, ImageFilter
+
+from apps.documents.models import DocumentUpload
+from apps.documents.services import photo_quality
+from apps.documents.services.page_image import PageImage
+
+
+HEADER = f"{'upload':<28}{'status':>16}{'sharp':>9}{'bright':>8}{'glare':>7}{'cover':>7}{'empty':>7}{'warn':>6}  rejected"
+
+
+def _jpeg(img: Image.Image, quality: int = 80) -> Image.Image:
+    buf = io.BytesIO()
+    img.save(buf, "JPEG", quality=quality)
+    return Image.open(io.BytesIO(buf.getvalue())).convert("RGB")
+
+
+def _blur(radius: float) -> Callable[[Image.Image], Image.Image]:
+    return lambda img: img.filter(ImageFilter.GaussianBlur(radius))
+
+
+def _dark(exposure: float) -> Callable[[Image.Image], Image.Image]:
+    """Underexposed: scaled down, with the sensor noise a phone adds in low light."""
+    def degrade(img):
+        noise = np.random.default_rng(0).normal(0, 6, (img.height, img.width))[..., None]
+        pixels = np.asarray(img, dtype=np.float32) * exposure + noise
+        return _jpeg(Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8)), 70)
+    return degrade
+
+
+def _glare(share: float) -> Callable[[Image.Image], Image.Image]:
+    """A blown-out reflection over `share` of the frame on a normally exposed (x0.8) page."""
+    def degrade(img):
+        pixels = np.asarray(img, dtype=np.float32) * 0.8
+        h, w = pixels.shape[:2]
+        yy, xx = np.mgrid[0:h, 0:w]
+        dist = np.hypot(xx - 0.5 * w, yy - 0.35 * h) / (share * w * h / np.pi) ** 0.5
+        pixels += np.clip(1.6 - dist, 0, 1)[..., None] * 400
+        return _jpeg(Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8)))
+    return degrade
+
+
+def _far(scale: float) -> Callable[[Image.Image], Image.Image]:
+    """The page at `scale` of the frame size on a dark desk."""
+    def degrade(img):
+        desk = Image.new("RGB", img.size, (92, 70, 52))
+        page = img.resize((int(img.width * scale), int(img.height * scale)), Image.LANCZOS)
+        desk.paste(page, ((img.width - page.width) // 2, (img.height - page.height) // 2))
+        return _jpeg(desk)
+    return degrade
+
+
+# (label, degradation, problem the gate must find - None: still legible, keep)
+CALIBRATION = [
+    ("original", lambda img: img, None),
+    ("blur 1.5px", _blur(1.5), None),
+    ("blur 2px", _blur(2), None),
+    ("blur 2.5px", _blur(2.5), "blurry"),
+    ("blur 3px", _blur(3), "blurry"),
+    ("dark x0.35", _dark(0.35), None),
+    ("dark x0.25", _dark(0.25), None),
+    ("dark x0.18", _dark(0.18), "dark"),
+    ("dark x0.12", _dark(0.12), "dark"),
+    ("glare 2%", _glare(0.02), None),
+    ("glare 5%", _glare(0.05), "glare"),
+    ("glare 10%", _glare(0.10), "glare"),
+    ("far x0.6", _far(0.6), None),
+    ("far x0.45", _far(0.45), None),
+    ("far x0.3", _far(0.3), "small"),
+]
+
+
+def _outcome(upload: DocumentUpload) -> tuple[Optional[float], Optional[int]]:
+    """(share of empty fields, number of warning flags) of a parsed upload."""
+    parsed = upload.parsed_data if isinstance(upload.parsed_data, dict) else None
+    data = parsed.get("data") if parsed else None
+    if not isinstance(data, dict) or not data:
+        return None, None
+    empty = sum(1 for v in data.values() if v in (None, "", [], {}))
+    warnings = sum(1 for f in parsed.get("flags") or [] if isinstance(f, dict) and f.get("severity") == "warning")
+    return empty / len(data), warnings
+
+
+class Command(BaseCommand):
+    help = "List stored photo quality metrics with outcomes and simulate rejection thresholds."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--limit", type=int, default=100, help="Most recent photos to show.")
+        parser.add_argument("--files", nargs="+", help="Measure these image files instead of the stored uploads.")
+        parser.add_argument("--calibrate", action="store_true",
+                            help="Check the thresholds against degraded copies of sample photos (see CALIBRATION).")
+        for name, default in photo_quality.DEFAULT_THRESHOLDS.items():
+            parser.add_argument(f"--{name.replace('_', '-')}", type=float, dest=name,
+                                help=f"Threshold to simulate (setting: DOCUMENTS_PHOTO_{name.upper()}).")
+
+    def handle(self, *args, **options):
+        limits = {name: value if options[name] is None else options[name]
+                  for name, value in photo_quality.thresholds().items()}
+        self.stdout.write("Thresholds: " + " ".join(f"{k}={v}" for k, v in limits.items()))
+        if options["calibrate"]:
+            return self._calibrate(options["files"], limits)
+        self.stdout.write(HEADER)
+
+        rows, registered = [], []
+        if options["files"]:
+            for path in options["files"]:
+                with open(path, "rb") as fh:
+                    rows.append((path[-28:], "-", photo_quality.analyze(PageImage.from_encoded(fh.read())), (None, None)))
+        else:
+            uploads = (DocumentUpload.objects.filter(processing_metrics__has_key="photo_quality")
+                       .order_by("-created_at")[:options["limit"]])
+            for upload in uploads:
+                rows.append((f"#{upload.pk} {upload.original_name}"[:27], upload.processing_status,
+                             upload.processing_metrics["photo_quality"], _outcome(upload)))
+                if upload.processing_metrics.get("checkbox_registered") is not None:
+                    registered.append(upload.processing_metrics["checkbox_registered"])
+
+        rejected, kept = [], []
+        for name, status, metrics, (empty, warnings) in rows:
+            found = photo_quality.problems(metrics, limits)
+            (rejected if found else kept).append(empty)
+            self.stdout.write(
+                f"{name:<28}{status:>16}{metrics['sharpness']:>9.0f}{metrics['brightness']:>8.0f}"
+                f"{metrics['glare']:>7.2f}{metrics['coverage']:>7.2f}"
+                f"{'-' if empty is None else f'{100 * empty:.0f}%':>7}{'-' if warnings is None else warnings:>6}"
+                f"  {','.join(found) or '-'}"
+            )
+
+        self.stdout.write(f"\nWould reject {len(rejected)} of {len(rows)} photos.")
+        for label, group in (("rejected", rejected), ("kept", kept)):
+            known = [e for e in group if e is not None]
+            if known:
+                self.stdout.write(f"Empty fields, {label} photos with a GPT result: "
+                                  f"{100 * sum(known) / len(known):.0f}% on average ({len(known)} photos)")
+        if registered:
+            # Unregistered photos get no checkbox hints, GPT reads the boxes alone
+            self.stdout.write(f"Checkbox form registered on {sum(registered)} of {len(registered)} photos "
+                              f"({100 * sum(registered) / len(registered):.0f}%).")
+
+    def _calibrate(self, files: Optional[list], limits: dict) -> None:
+        paths = files or sorted(glob.glob(str(settings.MEDIA_ROOT / "document_photos" / "*.jpg")))
+        seen, misses, false_rejects, total = set(), [], [], 0
+        self.stdout.write(f"{'photo':<16}{'variant':<13}{'sharp':>9}{'bright':>8}{'glare':>7}{'cover':>7}"
+                          f"  {'expected':<9}rejected")
+        for path in paths:
+            with open(path, "rb") as fh:
+                data = fh.read()
+            digest = hashlib.sha256(data).hexdigest()
+            if digest in seen:      # uploads are often the same capture saved twice
+                continue
+            seen.add(digest)
+            img = Image.open(io.BytesIO(data)).convert("RGB")
+            for label, degrade, expected in CALIBRATION:
+                metrics = photo_quality.analyze(PageImage(pixels=np.asarray(degrade(img)), encoded_format="JPEG"))
+                found = photo_quality.problems(metrics, limits)
+                total += 1
+                if expected and expected not in found:
+                    misses.append(f"{path[-15:]} {label}")
+                elif not expected and found:
+                    false_rejects.append(f"{path[-15:]} {label}")
+                self.stdout.write(
+                    f"{path[-15:]:<16}{label:<13}{metrics['sharpness']:>9.0f}{metrics['brightness']:>8.0f}"
+                    f"{metrics['glare']:>7.3f}{metrics['coverage']:>7.3f}  {expected or 'ok':<9}{','.join(found) or '-'}"
+                )
+
+        self.stdout.write(f"\n{len(seen)} distinct photos, {total} captures: "
+                          f"{len(false_rejects)} legible rejected, {len(misses)} illegible kept.")
+        for label, group in (("Rejected although legible", false_rejects), ("Kept although illegible", misses)):
+            if group:
+                self.stdout.write(f"{label}: " + "; ".join(group))
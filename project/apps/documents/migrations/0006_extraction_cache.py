@@ -0,0 +1,39 @@
+# Generated by Django 5.2.18 on 2026-10-17 04:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documents', '0005_alter_dispolivereport_ambulant_merkmale_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ExtractionCacheEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=64, unique=True)),
+                ('extraction_version', models.CharField(max_length=32)),
+                ('result', models.JSONField()),
+                ('hits', models.PositiveIntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('last_used_at', models.DateTimeField(auto_now_add=True, db_index=True)),
+            ],
+            options={
+                'verbose_name': 'Extraction cache entry',
+                'verbose_name_plural': 'Extraction cache entries',
+            },
+        ),
+        migrations.AddField(
+            model_name='documentupload',
+            name='extraction_cache_key',
+            field=models.CharField(blank=True, default='', max_length=64),
+        ),
+        migrations.AddField(
+            model_name='documentupload',
+            name='extraction_cache_status',
+            field=models.CharField(blank=True, choices=[('hit', 'hit'), ('miss', 'miss'), ('shared', 'shared'), ('bypass', 'bypass')], default='', max_length=10),
+        ),
+    ]
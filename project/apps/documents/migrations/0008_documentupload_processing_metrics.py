@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-17 04:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documents', '0007_documentupload_pages'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='documentupload',
+            name='processing_metrics',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+    ]
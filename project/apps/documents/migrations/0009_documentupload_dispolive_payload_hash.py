@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-17 04:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documents', '0008_documentupload_processing_metrics'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='documentupload',
+            name='dispolive_payload_hash',
+            field=models.CharField(blank=True, default='', max_length=64),
+        ),
+    ]
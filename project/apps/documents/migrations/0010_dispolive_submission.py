@@ -0,0 +1,41 @@
+# Generated by Django 5.2.18 on 2026-10-17 04:35
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documents', '0009_documentupload_dispolive_payload_hash'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='documentupload',
+            name='processing_status',
+            field=models.CharField(choices=[('uploaded', 'uploaded'), ('processing', 'processing'), ('pending_review', 'pending_review'), ('submitting', 'submitting'), ('done', 'done'), ('error', 'error')], default='uploaded', max_length=20),
+        ),
+        migrations.CreateModel(
+            name='DispoliveSubmission',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('payload', models.JSONField()),
+                ('idempotency_key', models.CharField(max_length=64, unique=True)),
+                ('status', models.CharField(choices=[('pending', 'pending'), ('sending', 'sending'), ('sent', 'sent'), ('dead', 'dead')], db_index=True, default='pending', max_length=10)),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('next_attempt_at', models.DateTimeField(db_index=True, default=django.utils.timezone.now)),
+                ('claimed_at', models.DateTimeField(blank=True, null=True)),
+                ('last_error', models.TextField(blank=True, default='')),
+                ('response', models.JSONField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('sent_at', models.DateTimeField(blank=True, null=True)),
+                ('upload', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='submissions', to='documents.documentupload')),
+            ],
+            options={
+                'verbose_name': 'Dispolive submission',
+                'verbose_name_plural': 'Dispolive submissions',
+            },
+        ),
+    ]
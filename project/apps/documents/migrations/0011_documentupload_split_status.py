@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-17 09:12
+
+from django.db import migrations, models
+
+
+def split_parents(apps, schema_editor):
+    DocumentUpload = apps.get_model("documents", "DocumentUpload")
+    parents = DocumentUpload.objects.filter(pages__isnull=False).distinct()
+    for parent in parents.exclude(processing_status__in=["uploaded", "processing"]):
+        all_done = not parent.pages.exclude(processing_status="done").exists()
+        parent.processing_status = "done" if all_done else "split"
+        parent.save(update_fields=["processing_status"])
+
+
+def unsplit_parents(apps, schema_editor):
+    DocumentUpload = apps.get_model("documents", "DocumentUpload")
+    DocumentUpload.objects.filter(processing_status="split").update(processing_status="pending_review")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documents', '0010_dispolive_submission'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='documentupload',
+            name='processing_status',
+            field=models.CharField(choices=[('uploaded', 'uploaded'), ('processing', 'processing'), ('pending_review', 'pending_review'), ('submitting', 'submitting'), ('done', 'done'), ('error', 'error'), ('split', 'split')], default='uploaded', max_length=20),
+        ),
+        migrations.RunPython(split_parents, unsplit_parents),
+    ]
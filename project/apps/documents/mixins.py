@@ -3,18 +3,45 @@ Mixins for document processing views.
 Implements DRY principle by consolidating common logic for PDF and Photo uploads.
 """
 import base64
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
 from io import BytesIO
 from typing import Dict, Any, Optional
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import connection
+from django.db.models import Prefetch
 from django.http import JsonResponse
 from django.shortcuts import redirect
+from django.urls import reverse
 from django.utils import timezone
-from PIL import Image, ImageEnhance, ImageStat
-import pytesseract
+import numpy as np
+from PIL import Image, ImageEnhance
 import logging
+import threading
 
 from .models import DocumentUpload, DocumentPhoto
-from .services.pdf_utils import pdf_page_to_base64_png, pdf_page_crop_to_base64_png
-from .services.gpt_client import parse_form_page_to_new_parser
+from .services.pdf_utils import (
+    PdfDocument,
+    iter_pdf_pages,
+)
+from .services.page_image import PageImage
+from .services.instrumentation import track_resources
+from .services.gpt_client import (
+    parse_form_page_to_new_parser,
+    parse_text_layer_to_new_parser,
+    effective_checkbox_hints,
+    extraction_version,
+    text_layer_version,
+)
+from .services import extraction_cache, photo_geometry, photo_quality, raster_cache, text_layer
+from .services.checkboxes import detect_checkboxes, frame_box, register_form
+from .services import numeric_ocr, ocr_engine
+from .services.image_payload import default_options, options_signature
+from .services.payload_preview import ensure_payload
 
 
 logger = logging.getLogger(__name__)
@@ -23,58 +50,59 @@ logger = logging.getLogger(__name__)
 Note: We intentionally avoid crop-based extraction here to keep a single
 source of truth (the full page) and rely on the prompt for accuracy.
 """
-# Minimal box for Arzt-Nr. only
-ARZT_BOX = (0.36, 0.33, 0.62, 0.40)
+# Minimal box for Arzt-Nr. only, relative to the registered form (checkboxes.register_form),
+# so it lands on the field in PDF renders and photos alike
+ARZT_BOX = numeric_ocr.MUSTER4_NUMBER_FIELDS["arzt_nr"]["box"]
+
+# Statuses of an upload that is still waiting for (or in) processing
+IN_PROGRESS_STATUSES = ("uploaded", "processing", "submitting")
+
+# Speculative Arzt-Nr. OCR runs here while GPT works (Tesseract is a subprocess, threads suffice)
+_ocr_pool: Optional[ThreadPoolExecutor] = None
+_ocr_pool_lock = threading.Lock()
+
+
+def _get_ocr_pool() -> ThreadPoolExecutor:
+    global _ocr_pool
+    with _ocr_pool_lock:
+        if _ocr_pool is None:
+            _ocr_pool = ThreadPoolExecutor(
+                max_workers=max(1, getattr(settings, "DOCUMENTS_OCR_WORKERS", 2)), thread_name_prefix="arzt-ocr"
+            )
+        return _ocr_pool
+
 
 class DocumentProcessingMixin:
 
-    def _remove_vertical_lines(self, img: Image.Image) -> Image.Image:
-        """Remove strong vertical table lines from a grayscale image."""
+    @staticmethod
+    def _gray_array(img: Image.Image) -> np.ndarray:
+        """Writable uint8 array of a grayscale copy of img."""
         if img.mode != "L":
             img = img.convert("L")
-        w, h = img.size
-        pix = img.load()
-
-        mean = ImageStat.Stat(img).mean[0]
-        dark_thresh = max(30, mean - 40)
-
-        dark_cols = []
-        for x in range(w):
-            dark_count = 0
-            for y in range(h):
-                if pix[x, y] < dark_thresh:
-                    dark_count += 1
-            if dark_count / h > 0.7:
-                dark_cols.append(x)
-
-        for x in dark_cols:
-            for y in range(h):
-                pix[x, y] = 255
-        return img
+        return np.array(img, dtype=np.uint8)
+
+    @staticmethod
+    def _mean(arr: np.ndarray) -> float:
+        """Same value as ImageStat.Stat(img).mean[0] (exact integer sum / count)."""
+        return int(arr.sum(dtype=np.int64)) / max(1, arr.size)
+
+    def _remove_vertical_lines(self, img: Image.Image) -> Image.Image:
+        """Remove strong vertical table lines from a grayscale image."""
+        arr = self._gray_array(img)
+        dark_thresh = max(30, self._mean(arr) - 40)
+        # Columns that are dark over more than 70% of their height
+        dark_ratio = (arr < dark_thresh).sum(axis=0) / arr.shape[0]
+        arr[:, dark_ratio > 0.7] = 255
+        return Image.fromarray(arr)
 
     def _remove_horizontal_lines(self, img: Image.Image) -> Image.Image:
         """Remove strong horizontal table lines from a grayscale image."""
-        if img.mode != "L":
-            img = img.convert("L")
-        w, h = img.size
-        pix = img.load()
-
-        mean = ImageStat.Stat(img).mean[0]
-        dark_thresh = max(30, mean - 40)
-
-        dark_rows = []
-        for y in range(h):
-            dark_count = 0
-            for x in range(w):
-                if pix[x, y] < dark_thresh:
-                    dark_count += 1
-            if dark_count / w > 0.7:
-                dark_rows.append(y)
-
-        for y in dark_rows:
-            for x in range(w):
-                pix[x, y] = 255
-        return img
+        arr = self._gray_array(img)
+        dark_thresh = max(30, self._mean(arr) - 40)
+        # Rows that are dark over more than 70% of their width
+        dark_ratio = (arr < dark_thresh).sum(axis=1) / arr.shape[1]
+        arr[dark_ratio > 0.7, :] = 255
+        return Image.fromarray(arr)
 
     def _enhance_numeric(self, img: Image.Image) -> Image.Image:
         """Stronger enhancement for numeric rows (codes/IDs)."""
@@ -84,23 +112,15 @@ class DocumentProcessingMixin:
         img = ImageEnhance.Sharpness(img).enhance(3.0)
         img = self._remove_vertical_lines(img)
         img = self._remove_horizontal_lines(img)
-        # Simple binarization (adaptive)
-        pix = img.load()
-        w, h = img.size
-        mean = ImageStat.Stat(img).mean[0]
-        thresh = max(90, mean - 30)
-        for y in range(h):
-            for x in range(w):
-                pix[x, y] = 0 if pix[x, y] < thresh else 255
-        return img
+        # Simple binarization (adaptive: threshold follows the crop's mean brightness)
+        arr = self._gray_array(img)
+        thresh = max(90, self._mean(arr) - 30)
+        return Image.fromarray(np.where(arr < thresh, 0, 255).astype(np.uint8))
 
-    def _ocr_digits_from_b64(self, img_b64: str) -> str:
+    def _ocr_digits(self, img: Image.Image) -> str:
         """OCR a crop and return the first 9-digit sequence, or empty."""
         try:
-            img_bytes = base64.b64decode(img_b64)
-            img = Image.open(BytesIO(img_bytes)).convert("L")
-            config = "--psm 6 -c tessedit_char_whitelist=0123456789"
-            raw = pytesseract.image_to_string(img, config=config)
+            raw = ocr_engine.image_to_string(img, psm=6, whitelist=ocr_engine.DIGITS)
             digits = ''.join(ch for ch in raw if ch.isdigit())
             for i in range(0, len(digits) - 8):
                 cand = digits[i:i+9]
@@ -110,19 +130,25 @@ class DocumentProcessingMixin:
         except Exception:
             return ""
 
-    def _crop_base64_region(self, img_b64: str, box: tuple[float, float, float, float], scale: int = 1, enhance: bool = False, numeric_enhance: bool = False) -> str:
-        """Crop base64 PNG/JPEG by relative box (x0,y0,x1,y1)."""
-        img_bytes = base64.b64decode(img_b64)
-        img = Image.open(BytesIO(img_bytes))
-        w, h = img.size
-        x0, y0, x1, y1 = box
-        left = max(0, int(w * x0))
-        top = max(0, int(h * y0))
-        right = min(w, int(w * x1))
-        bottom = min(h, int(h * y1))
-        cropped = img.crop((left, top, right, bottom))
-        if scale > 1:
-            cropped = cropped.resize((cropped.width * scale, cropped.height * scale), Image.BICUBIC)
+    def _ocr_digits_from_b64(self, img_b64: str) -> str:
+        """OCR a base64 crop and return the first 9-digit sequence, or empty."""
+        try:
+            img = Image.open(BytesIO(base64.b64decode(img_b64)))
+        except Exception:
+            return ""
+        return self._ocr_digits(img)
+
+    def _crop_region(self, page: PageImage, box: tuple[float, float, float, float], scale: int = 1, enhance: bool = False, numeric_enhance: bool = False) -> Image.Image:
+        """
+        Crop a page by relative box (x0,y0,x1,y1); only the crop is copied into PIL.
+        Scaled crops of PDF pages are rendered from the PDF at the higher DPI, photos are upscaled.
+        """
+        if scale > 1 and page.render_region is not None:
+            cropped = page.render_region(box, scale).to_pil()
+        else:
+            cropped = page.to_pil(box)
+            if scale > 1:
+                cropped = cropped.resize((cropped.width * scale, cropped.height * scale), Image.BICUBIC)
         if enhance:
             cropped = cropped.convert("L")
             cropped = ImageEnhance.Contrast(cropped).enhance(2.5)
@@ -131,31 +157,31 @@ class DocumentProcessingMixin:
             cropped = self._remove_horizontal_lines(cropped)
         if numeric_enhance:
             cropped = self._enhance_numeric(cropped)
+        return cropped
+
+    def _crop_base64_region(self, img_b64: str, box: tuple[float, float, float, float], scale: int = 1, enhance: bool = False, numeric_enhance: bool = False) -> str:
+        """Crop base64 PNG/JPEG by relative box (x0,y0,x1,y1)."""
+        cropped = self._crop_region(PageImage.from_base64(img_b64), box, scale=scale, enhance=enhance, numeric_enhance=numeric_enhance)
         buffered = BytesIO()
         cropped.save(buffered, format="JPEG")
         return base64.b64encode(buffered.getvalue()).decode()
 
-    def _trip_direction_hints(self, img_b64: str) -> dict:
-        """Detect trip direction checkboxes in the top-right block."""
+    def _trip_direction_hints(self, img: Image.Image | str) -> dict:
+        """Detect trip direction checkboxes in the top-right block (PIL crop or base64)."""
         try:
-            img_bytes = base64.b64decode(img_b64)
-            img = Image.open(BytesIO(img_bytes)).convert("L")
+            if isinstance(img, str):
+                img = Image.open(BytesIO(base64.b64decode(img)))
+            img = img.convert("L")
             w, h = img.size
             mid = w // 2
             left_box = img.crop((0, 0, mid, h))
             right_box = img.crop((mid, 0, w, h))
 
             def _mark(box: Image.Image) -> bool:
-                mean = ImageStat.Stat(box).mean[0]
-                thresh = max(25, mean - 25)
-                pix = box.load()
-                dark = 0
-                total = box.width * box.height
-                for y in range(box.height):
-                    for x in range(box.width):
-                        if pix[x, y] < thresh:
-                            dark += 1
-                return (dark / max(1, total)) > 0.015
+                arr = self._gray_array(box)
+                thresh = max(25, self._mean(arr) - 25)
+                dark = int((arr < thresh).sum())
+                return (dark / max(1, arr.size)) > 0.015
 
             return {
                 "outbound": _mark(left_box),
@@ -165,38 +191,264 @@ class DocumentProcessingMixin:
             return {"outbound": False, "return": False}
 
     def _photo_to_base64(self, image_path: str) -> str:
-        """Convert photo to base64 string."""
-        img = Image.open(image_path)
-        buffered = BytesIO()
-        img.save(buffered, format="JPEG")
-        return base64.b64encode(buffered.getvalue()).decode()
+        """Convert photo to base64 string (original bytes, no re-encoding)."""
+        return PageImage.from_file(image_path).to_base64()
 
-    def process_and_parse_document(self, upload_obj: DocumentUpload, file_path: str, is_photo: bool = False) -> tuple[bool, Optional[str]]:
-        """Process document (PDF or Photo) and parse with GPT."""
+    def _arzt_box(self, page: PageImage, frame=None) -> tuple[float, float, float, float]:
+        """ARZT_BOX on this page (`frame`: register_form() result, if the caller has it already)."""
+        return frame_box(page, frame if frame is not None else register_form(page), ARZT_BOX)
+
+    def _ocr_arzt_nr(self, page: PageImage, frame=None) -> str:
+        """Arzt-Nr. by Tesseract on the enhanced 5x crop (9 digits or empty)."""
+        box = self._arzt_box(page, frame)
+        return self._ocr_digits(self._crop_region(page, box, scale=5, enhance=True, numeric_enhance=True))
+
+    def _read_numbers(self, page: PageImage, frame) -> tuple[Optional[Dict[str, Any]], int]:
+        """Printed numbers by local OCR (services/numeric_ocr.py): (readings or None, ms)."""
+        t0 = time.perf_counter()
         try:
-            if is_photo:
-                img_b64 = self._photo_to_base64(file_path)
-            else:
-                img_b64 = pdf_page_to_base64_png(file_path, page_number=1)
-            arzt_b64 = self._crop_base64_region(img_b64, ARZT_BOX, scale=5, enhance=True, numeric_enhance=True)
-            prescription_json = parse_form_page_to_new_parser(img_b64)
+            readings = numeric_ocr.read_fields(page, frame)
+        except ocr_engine.OcrUnavailable as e:
+            logger.warning("Numeric OCR skipped: %s", e)
+            readings = None
+        except Exception:
+            logger.exception("Numeric OCR failed, continuing without cross-check")
+            readings = None
+        return readings, round((time.perf_counter() - t0) * 1000)
+
+    def _parse_page(self, upload_obj: DocumentUpload, page: PageImage, text_layout: Optional[str] = None) -> None:
+        """
+        Extract one rendered page into upload_obj (cache -> GPT -> OCR fallback).
 
-            # OCR fallback for Arzt-Nr. only
+        With `text_layout` (a digital PDF page, services/text_layer.py) GPT gets
+        the positioned text instead of the image; the local checks below still
+        run on the rendered page.
+
+        The Arzt-Nr. OCR is only needed when GPT returns no 9-digit arzt_nr.
+        When GPT is actually called (cache miss) the OCR starts speculatively on
+        the OCR pool, so it overlaps with the GPT call; its result is dropped
+        if GPT's number is fine. On a cache hit it runs only when needed.
+        The printed numbers are always read on the OCR pool while GPT works and
+        then cross-checked against GPT's values.
+        """
+        frame = None
+        checkbox_hints = None
+        checkbox_ms = None
+        if getattr(settings, "DOCUMENTS_CHECKBOX_DETECTION", True):
+            t0 = time.perf_counter()
             try:
-                if isinstance(prescription_json, dict) and isinstance(prescription_json.get("data"), dict):
-                    d = prescription_json["data"]
-                    arzt = ''.join(ch for ch in str(d.get("arzt_nr") or '') if ch.isdigit())
-                    if len(arzt) != 9:
-                        ocr_arzt = self._ocr_digits_from_b64(arzt_b64)
-                        logger.info("OCR arzt_nr: %s", ocr_arzt)
-                        if ocr_arzt and len(ocr_arzt) == 9:
-                            d["arzt_nr"] = ocr_arzt
+                frame = register_form(page)
+                checkbox_hints = detect_checkboxes(page, frame)
             except Exception:
-                pass
+                logger.exception("Checkbox detection failed, continuing with GPT only")
+            checkbox_ms = round((time.perf_counter() - t0) * 1000)
+        numbers_future = None
+        if getattr(settings, "DOCUMENTS_NUMERIC_OCR", True):
+            numbers_future = _get_ocr_pool().submit(self._read_numbers, page, frame)
+        version = extraction_version()
+        # Only hints that reach the extraction go into the key: an unregistered
+        # form (confidence 0 everywhere) shares its entry with no detection
+        key_hints = effective_checkbox_hints(checkbox_hints)
+        cache_key = extraction_cache.make_cache_key(
+            page.digest(), version,
+            extra=(f"text-layer {text_layer_version()} " if text_layout else options_signature(default_options()))
+            + (json.dumps(key_hints, sort_keys=True) if key_hints else ""),
+        )
+        ocr_future = None
+
+        def extract() -> Dict[str, Any]:
+            nonlocal ocr_future
+            if getattr(settings, "DOCUMENTS_ARZT_OCR_SPECULATIVE", True):
+                ocr_future = _get_ocr_pool().submit(self._ocr_arzt_nr, page, frame)
+            if text_layout:
+                return parse_text_layer_to_new_parser(text_layout, checkbox_hints=checkbox_hints)
+            return parse_form_page_to_new_parser(page, checkbox_hints=checkbox_hints)
+
+        try:
+            prescription_json, cache_status = extraction_cache.get_or_extract(cache_key, version, extract)
+        except BaseException:
+            for future in (ocr_future, numbers_future):
+                if future is not None:
+                    future.cancel()
+            raise
+        upload_obj.extraction_cache_key = cache_key
+        upload_obj.extraction_cache_status = cache_status
+
+        # OCR fallback for Arzt-Nr. only
+        arzt_ocr = "not_needed"
+        try:
+            if isinstance(prescription_json, dict) and isinstance(prescription_json.get("data"), dict):
+                d = prescription_json["data"]
+                arzt = ''.join(ch for ch in str(d.get("arzt_nr") or '') if ch.isdigit())
+                if len(arzt) != 9:
+                    arzt_ocr = "speculative" if ocr_future is not None else "inline"
+                    ocr_arzt = ocr_future.result() if ocr_future is not None else self._ocr_arzt_nr(page, frame)
+                    logger.info("OCR arzt_nr: %s", ocr_arzt)
+                    if ocr_arzt and len(ocr_arzt) == 9:
+                        d["arzt_nr"] = ocr_arzt
+        except Exception:
+            pass
+        if arzt_ocr == "not_needed" and ocr_future is not None:
+            # Not started yet -> never runs; already running -> the result is dropped
+            ocr_future.cancel()
+
+        numeric_ms = None
+        if numbers_future is not None:
+            readings, numeric_ms = numbers_future.result()
+            if readings is not None and isinstance(prescription_json, dict) and isinstance(prescription_json.get("data"), dict):
+                numeric_ocr.apply(prescription_json, numeric_ocr.cross_check(prescription_json["data"], readings))
+
+        upload_obj.parsed_data = prescription_json
+        upload_obj.processing_status = "pending_review"
+        upload_obj.processing_error = ""
+        # Dispolive payload + its reference-data lookups, so the review page only reads the DB
+        t0 = time.perf_counter()
+        try:
+            ensure_payload(upload_obj)
+        except Exception:
+            logger.exception("Dispolive payload preview failed | upload_id=%s", upload_obj.pk)
+        payload_ms = round((time.perf_counter() - t0) * 1000)
+        upload_obj.processing_metrics = {
+            **(upload_obj.processing_metrics or {}),
+            "image_buffers_mb": round(page.nbytes / (1024 * 1024), 1),
+            "arzt_ocr": arzt_ocr,
+            "extraction_input": "text_layer" if text_layout else "image",
+            "checkbox_detect_ms": checkbox_ms,
+            "checkboxes": checkbox_hints,
+            "checkbox_registered": (any(v["confidence"] > 0 for v in checkbox_hints.values())
+                                    if checkbox_hints else None),
+            "numeric_ocr_ms": numeric_ms,
+            "payload_build_ms": payload_ms,
+        }
+        upload_obj.save(update_fields=["parsed_data", "processing_status", "processing_error", "extraction_cache_key", "extraction_cache_status", "processing_metrics", "dispolive_payload", "dispolive_payload_hash"])
+
+    def _parse_child_page(self, page_obj: DocumentUpload, page: PageImage, text_layout: Optional[str] = None) -> bool:
+        """Thread-pool entry point for one page of a multi-page PDF."""
+        try:
+            self._parse_page(page_obj, page, text_layout)
+            return True
+        except Exception as e:
+            logger.exception("Page parsing failed | upload_id=%s page=%s", page_obj.pk, page_obj.page_number)
+            page_obj.processing_status = "error"
+            page_obj.processing_error = str(e)
+            page_obj.save(update_fields=["processing_status", "processing_error"])
+            return False
+        finally:
+            # Worker threads open their own DB connections
+            connection.close()
+
+    def process_multipage_document(self, upload_obj: DocumentUpload, file_path: str, page_count: int,
+                                   pdf: Optional[PdfDocument] = None) -> tuple[bool, Optional[str]]:
+        """
+        Split a multi-page PDF into one child upload per page, each with a
+        one-page PDF of its own as file (deleting one page must not delete
+        the source of the others).
+
+        Pages are rendered in a bounded process pool and each page goes to GPT
+        as soon as it is rendered, with at most DOCUMENTS_GPT_CONCURRENCY calls
+        in flight, so the total time is close to the slowest page.
+        """
+        max_pages = getattr(settings, "DOCUMENTS_PDF_MAX_PAGES", 50)
+        if page_count > max_pages:
+            raise RuntimeError(f"PDF has {page_count} pages, the limit is {max_pages}.")
 
-            upload_obj.parsed_data = prescription_json
-            upload_obj.processing_status = "pending_review"
-            upload_obj.save(update_fields=["parsed_data", "processing_status"])
+        base_name = upload_obj.original_name or upload_obj.file.name
+        stem = os.path.splitext(os.path.basename(upload_obj.file.name))[0]
+        with nullcontext(pdf) if pdf is not None else PdfDocument(file_path) as source:
+            pages = {
+                n: DocumentUpload.objects.create(
+                    user=upload_obj.user,
+                    parent=upload_obj,
+                    file=ContentFile(source.page_pdf(n), name=f"{stem}_page{n}.pdf"),
+                    original_name=f"{base_name} (page {n}/{page_count})",
+                    page_number=n,
+                    processing_status="processing",
+                    processing_error="",
+                )
+                for n in range(1, page_count + 1)
+            }
+
+        gpt_workers = getattr(settings, "DOCUMENTS_GPT_CONCURRENCY", 4)
+        render_workers = getattr(settings, "DOCUMENTS_PDF_RENDER_WORKERS", 4)
+        try:
+            with ThreadPoolExecutor(max_workers=gpt_workers) as pool:
+                futures = [
+                    pool.submit(self._parse_child_page, pages[n], page,
+                                text_layer.page_layout(pdf, n) if pdf is not None else None)
+                    for n, page in iter_pdf_pages(file_path, list(pages), max_workers=render_workers, doc=pdf)
+                ]
+                parsed = sum(1 for fut in futures if fut.result())
+        except Exception:
+            upload_obj.pages.filter(processing_status="processing").update(
+                processing_status="error", processing_error="Processing of the document was aborted."
+            )
+            raise
+
+        failed = page_count - parsed
+        if not parsed:
+            raise RuntimeError(f"None of the {page_count} pages could be parsed.")
+
+        # The parent itself is never reviewed or sent, its pages are
+        upload_obj.processing_status = "split"
+        upload_obj.processing_error = f"{failed} of {page_count} pages failed." if failed else ""
+        upload_obj.save(update_fields=["processing_status", "processing_error"])
+        return True, None
+
+    def _check_photo_quality(self, upload_obj: DocumentUpload, page: PageImage) -> Optional[str]:
+        """
+        Pre-flight check of a photo (services/photo_quality.py). The metrics go
+        into processing_metrics["photo_quality"] whether or not the photo passes;
+        returns the retake message when it does not.
+        """
+        try:
+            metrics = photo_quality.analyze(page)
+        except Exception:
+            logger.exception("Photo quality check failed, continuing without it")
+            return None
+        found = photo_quality.problems(metrics)
+        upload_obj.processing_metrics = {
+            **(upload_obj.processing_metrics or {}),
+            "photo_quality": {**metrics, "rejected": found},
+        }
+        logger.info("Photo quality | upload_id=%s sharpness=%s brightness=%s glare=%s coverage=%s ms=%s rejected=%s",
+                    upload_obj.pk, metrics["sharpness"], metrics["brightness"], metrics["glare"],
+                    metrics["coverage"], metrics["ms"], ",".join(found) or "-")
+        return photo_quality.retake_message(found) if found else None
+
+    def _normalize_photo(self, upload_obj: DocumentUpload, page: PageImage) -> PageImage:
+        """Sheet cropped, rectified and turned upright (services/photo_geometry.py); the original on failure."""
+        try:
+            normalized, info = photo_geometry.normalize(page)
+        except Exception:
+            logger.exception("Photo normalization failed, using the photo as it is")
+            return page
+        upload_obj.processing_metrics = {**(upload_obj.processing_metrics or {}), "photo_geometry": info}
+        logger.info("Photo geometry | upload_id=%s sheet=%s rotation=%s match=%s size=%s ms=%s",
+                    upload_obj.pk, info["sheet"] is not None, info["rotation"], info["match"],
+                    "x".join(map(str, info["size"])), info["ms"])
+        return normalized
+
+    def _process_document(self, upload_obj: DocumentUpload, file_path: str, is_photo: bool) -> tuple[bool, Optional[str]]:
+        try:
+            if is_photo:
+                page = raster_cache.load_photo(file_path)
+                if photo_quality.enabled():
+                    retake = self._check_photo_quality(upload_obj, page)
+                    if retake:
+                        upload_obj.processing_status = "error"
+                        upload_obj.processing_error = retake
+                        upload_obj.save(update_fields=["processing_status", "processing_error", "processing_metrics"])
+                        return False, retake
+                if getattr(settings, "DOCUMENTS_PHOTO_NORMALIZE", True):
+                    page = self._normalize_photo(upload_obj, page)
+                self._parse_page(upload_obj, page)
+                return True, None
+            # One open document for the page render(s) and the high-DPI field crops;
+            # pages rendered before come from the raster cache
+            with PdfDocument(file_path) as pdf:
+                if getattr(settings, "DOCUMENTS_PDF_MULTIPAGE", True) and len(pdf) > 1:
+                    return self.process_multipage_document(upload_obj, file_path, len(pdf), pdf)
+                self._parse_page(upload_obj, pdf.render(1), text_layer.page_layout(pdf, 1))
             return True, None
 
         except Exception as e:
@@ -205,13 +457,42 @@ class DocumentProcessingMixin:
             upload_obj.save(update_fields=["processing_status", "processing_error"])
             return False, str(e)
 
+    def process_and_parse_document(self, upload_obj: DocumentUpload, file_path: str, is_photo: bool = False) -> tuple[bool, Optional[str]]:
+        """Process document (PDF or Photo) and parse with GPT."""
+        trace_python = getattr(settings, "DOCUMENTS_TRACE_MEMORY", False)
+        with track_resources(f"upload_id={upload_obj.pk}", trace_python=trace_python) as metrics:
+            success, error = self._process_document(upload_obj, file_path, is_photo)
+        upload_obj.processing_metrics = {**(upload_obj.processing_metrics or {}), **metrics}
+        upload_obj.save(update_fields=["processing_metrics"])
+        return success, error
+
 
 class DocumentUploadMixin(DocumentProcessingMixin):
     """
     Mixin specifically for document upload views.
     Extends DocumentProcessingMixin with upload-specific logic.
     """
-    
+
+    def is_queued_processing(self) -> bool:
+        return getattr(settings, "DOCUMENTS_PROCESSING_MODE", "queued") == "queued"
+
+    def _initial_status(self) -> str:
+        return "uploaded" if self.is_queued_processing() else "processing"
+
+    def start_processing(self, upload_obj: DocumentUpload, file_path: str, is_photo: bool = False) -> tuple[bool, Optional[str]]:
+        """
+        Parse the document inside the request ("sync") or hand it to the
+        background worker ("queued"). In queued mode the upload stays in
+        "uploaded" until the worker picks it up.
+        """
+        if not self.is_queued_processing():
+            return self.process_and_parse_document(upload_obj, file_path, is_photo=is_photo)
+
+        from .tasks import process_document_upload  # tasks imports this module
+
+        process_document_upload(upload_obj.pk, file_path, is_photo)
+        return True, None
+
     def create_upload_object(self, user, original_name: str, file=None) -> DocumentUpload:
         """
         Create DocumentUpload object.
@@ -228,7 +509,7 @@ class DocumentUploadMixin(DocumentProcessingMixin):
             user=user,
             file=file,
             original_name=original_name,
-            processing_status="processing",
+            processing_status=self._initial_status(),
             processing_error=""
         )
     
@@ -247,7 +528,7 @@ class DocumentUploadMixin(DocumentProcessingMixin):
         upload_obj = DocumentUpload.objects.create(
             user=user,
             original_name=f"Photo {timezone.now().strftime('%Y-%m-%d %H:%M')}",
-            processing_status="processing",
+            processing_status=self._initial_status(),
             processing_error=""
         )
         
@@ -260,12 +541,37 @@ class DocumentUploadMixin(DocumentProcessingMixin):
         return upload_obj, photo
 
     def get_recent_uploads(self, user, photo_only: bool = False, limit: int = 20):
-        qs = DocumentUpload.objects.filter(user=user)
+        # Pages of multi-page PDFs are listed under their parent upload
+        qs = DocumentUpload.objects.filter(user=user, parent__isnull=True).prefetch_related(
+            Prefetch("pages", queryset=DocumentUpload.objects.order_by("page_number"))
+        )
         if photo_only:
             qs = qs.filter(photos__isnull=False).distinct()
         return qs.order_by("-created_at")[:limit]
 
+    def get_status_payload(self, upload_obj: DocumentUpload) -> Dict[str, Any]:
+        """JSON body for the status endpoint polled by the upload pages."""
+        status = upload_obj.processing_status
+        payload = {
+            "id": upload_obj.pk,
+            "status": status,
+            "finished": status not in IN_PROGRESS_STATUSES,
+            "error": upload_obj.processing_error if status == "error" else "",
+            # "submitting": when the next Dispolive attempt is due, if the first one failed
+            "message": upload_obj.processing_error if status == "submitting" else "",
+        }
+        if payload["finished"]:
+            payload["redirect_url"] = reverse("documents:review", kwargs={"pk": upload_obj.pk})
+        return payload
+
     def handle_ajax_response(self, success: bool, upload_obj: DocumentUpload, error: str | None):
+        if success and upload_obj.processing_status in IN_PROGRESS_STATUSES:
+            return JsonResponse({
+                "success": True,
+                "queued": True,
+                "upload_id": upload_obj.pk,
+                "status_url": reverse("documents:upload_status", kwargs={"pk": upload_obj.pk}),
+            }, status=202)
         if success:
             redirect_url = redirect("documents:review", pk=upload_obj.pk).url
             return JsonResponse({
@@ -1,5 +1,6 @@
 from django.db import models
 from django.conf import settings
+from django.utils import timezone
 
 
 class DispoliveReport(models.Model):
@@ -137,17 +138,45 @@ class DocumentUpload(models.Model):
             ("uploaded", "uploaded"),
             ("processing", "processing"),
             ("pending_review", "pending_review"),
+            ("submitting", "submitting"),
             ("done", "done"),
             ("error", "error"),
+            # Multi-page PDF: the pages are reviewed and sent; "done" once all pages are
+            ("split", "split"),
         ],
     )
     dispolive_payload = models.JSONField(null=True, blank=True)
+    # Hash of the parsed fields dispolive_payload was built from (see services/payload_preview.py)
+    dispolive_payload_hash = models.CharField(max_length=64, blank=True, default="")
     dispolive_report = models.OneToOneField(
         DispoliveReport, on_delete=models.SET_NULL, null=True, blank=True,
         related_name='document')
 
     processing_error = models.TextField(blank=True, default="")
 
+    # Multi-page PDFs: every page is its own upload pointing to the original one
+    parent = models.ForeignKey(
+        'self', on_delete=models.CASCADE, null=True, blank=True,
+        related_name='pages')
+    page_number = models.PositiveIntegerField(default=1)
+
+    # Timings / memory / image sizes recorded while processing
+    processing_metrics = models.JSONField(default=dict, blank=True)
+
+    # Extraction cache bookkeeping (see services/extraction_cache.py)
+    extraction_cache_key = models.CharField(max_length=64, blank=True, default="")
+    extraction_cache_status = models.CharField(
+        max_length=10,
+        blank=True,
+        default="",
+        choices=[
+            ("hit", "hit"),
+            ("miss", "miss"),
+            ("shared", "shared"),
+            ("bypass", "bypass"),
+        ],
+    )
+
     def save(self, *args, **kwargs):
         if self.file and not self.original_name:
             self.original_name = self.file.name
@@ -156,6 +185,26 @@ class DocumentUpload(models.Model):
     def __str__(self):
         return self.original_name or "Unnamed Document"
 
+class ExtractionCacheEntry(models.Model):
+    """
+    GPT extraction result keyed by page image hash + extraction version.
+    Expired by TTL and trimmed by least-recent use.
+    """
+    key = models.CharField(max_length=64, unique=True)
+    extraction_version = models.CharField(max_length=32)
+    result = models.JSONField()
+    hits = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    last_used_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    class Meta:
+        verbose_name = "Extraction cache entry"
+        verbose_name_plural = "Extraction cache entries"
+
+    def __str__(self):
+        return self.key
+
+
 class DocumentPhoto(models.Model):
     document = models.ForeignKey(DocumentUpload, on_delete=models.CASCADE, related_name='photos')
     image = models.ImageField(upload_to='document_photos/')
@@ -166,3 +215,37 @@ class DocumentPhoto(models.Model):
 
     def __str__(self):
         return f"Photo for {self.document.id}"
+
+
+class DispoliveSubmission(models.Model):
+    """
+    Outbox row for one Dispolive ride report: written in the same transaction
+    as the reviewed parsed_data, delivered by the worker (services/outbox.py).
+    """
+    STATUS_CHOICES = [
+        ("pending", "pending"),
+        ("sending", "sending"),
+        ("sent", "sent"),
+        ("dead", "dead"),
+    ]
+
+    upload = models.ForeignKey(DocumentUpload, on_delete=models.CASCADE, related_name="submissions")
+    payload = models.JSONField()
+    # Same upload + same payload -> same key: a double submit is not sent twice
+    idempotency_key = models.CharField(max_length=64, unique=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default="pending", db_index=True)
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now, db_index=True)
+    claimed_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True, default="")
+    response = models.JSONField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        verbose_name = "Dispolive submission"
+        verbose_name_plural = "Dispolive submissions"
+
+    def __str__(self):
+        return f"Submission {self.pk} ({self.status}) for upload {self.upload_id}"
+
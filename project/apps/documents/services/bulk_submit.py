@@ -0,0 +1,132 @@
+"""
+Bulk approve-and-submit of uploads waiting for review.
+
+submit_uploads() approves pending_review uploads as extracted: each goes
+through the review form exactly as if the reviewer had opened it and pressed
+submit without changes (ReviewForm bound to its initial values, is_valid(),
+to_parsed_data() plus the extraction flags), so bulk and single submits send
+the same data. An upload the form rejects (e.g. a missing patient name) or
+with a printed number local OCR contradicts (services/numeric_ocr.py) is
+skipped and has to be reviewed by hand. For the others:
+1. the Dispolive payload is built (or the stored one reused) in a thread
+   pool inside dispolive_de.cache.batch(), so an institution or
+   Verordnungsart shared by several uploads is looked up once per batch;
+2. every report is added to the outbox in the transaction that marks its
+   upload "submitting", as the review view does;
+3. the batch is sent with outbox.deliver(): concurrently, at most
+   DOCUMENTS_DISPOLIVE_SUBMIT_CONCURRENCY fahrberichte/add calls at a time.
+Reports Dispolive did not accept yet stay in the outbox and are retried by
+the worker.
+"""
+import contextvars
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+
+from django.conf import settings
+from django.db import transaction
+
+from dispolive_de import cache
+
+from ..forms import DispoliveReportForm as ReviewForm
+from ..models import DocumentUpload
+from . import numeric_ocr, outbox
+from .dispolive_logger import get_dispolive_logger
+from .payload_preview import ensure_payload
+
+
+def _reviewed_data(parsed_data: Optional[Dict[str, Any]]) -> Tuple[Optional[Dict[str, Any]], str]:
+    """
+    What the review view saves and submits for the extracted data unchanged:
+    (form.to_parsed_data() with the extraction flags, "") or (None, the errors
+    the form shows).
+    """
+    form = ReviewForm.from_parsed_data(parsed_data)
+    mismatched = numeric_ocr.mismatched_fields(parsed_data)
+    if mismatched:
+        labels = [form.fields[ReviewForm.NUMERIC_FIELDS[f]].label if f in ReviewForm.NUMERIC_FIELDS else f for f in mismatched]
+        return None, f"Printed number differs from OCR: {', '.join(labels)}"
+    # The POST of the unchanged page: filled fields, ticked checkboxes
+    data = {}
+    for name, field in form.fields.items():
+        value = form.initial.get(name, field.initial)
+        if value not in (None, False):
+            data[name] = value
+    bound = ReviewForm(data)
+    if not bound.is_valid():
+        return None, "; ".join(
+            f"{bound.fields[name].label if name in bound.fields else name}: {' '.join(errors)}"
+            for name, errors in bound.errors.items()
+        )
+    updated_data = bound.to_parsed_data()
+    updated_data["flags"] = (parsed_data.get("flags") or []) if isinstance(parsed_data, dict) else []
+    return updated_data, ""
+
+
+def _build(upload_obj: DocumentUpload) -> Tuple[Optional[Dict[str, Any]], str]:
+    try:
+        return ensure_payload(upload_obj, upload_obj.parsed_data), ""
+    except Exception as e:
+        get_dispolive_logger().exception("Dispolive BULK payload failed | upload_id=%s", upload_obj.pk)
+        return None, str(e)
+
+
+def submit_uploads(uploads: List[DocumentUpload]) -> List[Dict[str, Any]]:
+    """
+    Approve and send `uploads`; returns one {"upload", "result", "message"} per
+    upload, result one of "sent", "retrying", "failed", "skipped".
+    """
+    logger = get_dispolive_logger()
+    results = {u.pk: {"upload": u, "result": "skipped", "message": ""} for u in uploads}
+
+    ready = []
+    for upload_obj in uploads:
+        if upload_obj.processing_status != "pending_review":
+            results[upload_obj.pk]["message"] = "Not waiting for review."
+            continue
+        updated_data, errors = _reviewed_data(upload_obj.parsed_data)
+        if errors:
+            results[upload_obj.pk]["message"] = f"Needs review: {errors}"
+            continue
+        upload_obj.parsed_data = updated_data
+        ready.append(upload_obj)
+
+    t0 = time.perf_counter()
+    workers = max(1, min(getattr(settings, "DOCUMENTS_DISPOLIVE_SUBMIT_CONCURRENCY", 4), len(ready) or 1))
+    with cache.batch(), ThreadPoolExecutor(max_workers=workers) as pool:
+        # Each task runs in a copy of this context, i.e. inside the same batch
+        futures = [pool.submit(contextvars.copy_context().run, _build, u) for u in ready]
+        built = [f.result() for f in futures]
+    build_ms = (time.perf_counter() - t0) * 1000
+
+    submission_pks = []
+    for upload_obj, (payload, error) in zip(ready, built):
+        if payload is None:
+            results[upload_obj.pk].update(result="failed", message=f"Payload could not be built: {error}")
+            continue
+        with transaction.atomic():
+            submission = outbox.enqueue(upload_obj, payload, schedule=False)
+            upload_obj.save(update_fields=["parsed_data", "dispolive_payload", "dispolive_payload_hash", "processing_status", "processing_error"])
+        if upload_obj.processing_status == "submitting":
+            submission_pks.append(submission.pk)
+
+    t0 = time.perf_counter()
+    outbox.deliver(submission_pks)
+    send_ms = (time.perf_counter() - t0) * 1000
+
+    fresh = DocumentUpload.objects.in_bulk([u.pk for u in ready])
+    for upload_obj in ready:
+        if results[upload_obj.pk]["result"] == "failed":
+            continue
+        current = fresh.get(upload_obj.pk, upload_obj)
+        result = {"done": "sent", "submitting": "retrying"}.get(current.processing_status, "failed")
+        results[upload_obj.pk].update(upload=current, result=result, message=current.processing_error)
+
+    counts: Dict[str, int] = {}
+    for item in results.values():
+        counts[item["result"]] = counts.get(item["result"], 0) + 1
+    logger.info("Dispolive BULK | uploads=%s build_ms=%.0f send_ms=%.0f %s", len(uploads), build_ms, send_ms,
+                " ".join(f"{k}={v}" for k, v in sorted(counts.items())))
+    if counts.get("retrying"):
+        outbox.schedule_delivery(submission_pks)
+    return list(results.values())
@@ -0,0 +1,327 @@
+"""
+Local checkbox detection for the Muster 4 form.
+
+MUSTER4_CHECKBOXES maps every checkbox field of new_parser.json to its box,
+relative to the printed form (x0, y0, x1, y1), like ARZT_BOX. Scans and photos
+place the form anywhere on the page, at different sizes and with a few percent
+of stretch, so detection works in three steps on integral images of the
+dark-pixel mask:
+
+1. Outline map: for every position of a coarse (~400 px wide) copy of the page,
+   how much a box of the nominal size placed there looks like a checkbox frame
+   (ink on all four sides, little ink inside) - one pass of window sums.
+2. Registration: all boxes are fitted together over x/y scale and offset
+   (sum of shifted windows of the outline map), then each box snaps to the
+   nearest frame around its fitted position at full resolution.
+3. Scoring: ink density inside each snapped frame decides checked/unchecked.
+   Confidence is low when the frame was not found cleanly (misregistered
+   photo, curled page) or the density is close to the threshold. A frame
+   counts as found only if it is clearly darker than its inside: a dark
+   blob (shadow, stamp, black border) is "ink on all four sides" too.
+4. Plausibility: a form with most boxes checked, or with two boxes of an
+   exclusive group (one transport type, one equipment) checked, is not
+   believed - those boxes get confidence 0, so nothing overrides GPT.
+
+The integral image of the full-resolution mask is computed once per page:
+register_form() keeps it for the detect_checkboxes() call that follows, and
+the coarse registration copy and the form bounds are read off it.
+"""
+import threading
+import weakref
+from typing import Any, Dict, Optional
+
+import numpy as np
+
+from .page_image import PageImage
+
+
+Box = tuple[float, float, float, float]
+Frame = tuple[float, float, float, float]
+
+# Measured on a clean scan: relative to the form's ink bounds (Krankenkasse box
+# marker top-left, "L" corner mark bottom-left, title block right).
+MUSTER4_CHECKBOXES: Dict[str, Box] = {
+    "reason_accident": (0.641, 0.058, 0.678, 0.087),
+    "reason_work_accident": (0.641, 0.102, 0.678, 0.130),
+    "reason_care_condition": (0.641, 0.146, 0.678, 0.173),
+    "transport_outbound": (0.641, 0.190, 0.680, 0.217),
+    "transport_return": (0.828, 0.190, 0.867, 0.217),
+    "reason_full_or_partial_inpatient": (0.068, 0.296, 0.102, 0.322),
+    "reason_pre_post_inpatient": (0.643, 0.297, 0.678, 0.323),
+    "reason_ambulatory_with_marker": (0.068, 0.336, 0.102, 0.362),
+    "reason_other": (0.068, 0.380, 0.102, 0.406),
+    "reason_high_frequency": (0.068, 0.442, 0.102, 0.469),
+    "reason_mobility_impairment_6m": (0.068, 0.488, 0.102, 0.516),
+    "reason_other_ktw": (0.068, 0.528, 0.102, 0.556),
+    "transport_taxi": (0.028, 0.733, 0.065, 0.760),
+    "transport_ktw": (0.028, 0.770, 0.065, 0.797),
+    "equipment_wheelchair": (0.481, 0.736, 0.518, 0.762),
+    "equipment_transport_chair": (0.481, 0.773, 0.518, 0.798),
+    "equipment_lying": (0.481, 0.810, 0.518, 0.836),
+    "transport_rtw": (0.026, 0.872, 0.063, 0.899),
+    "transport_naw_nef": (0.137, 0.872, 0.174, 0.899),
+    "transport_other": (0.248, 0.873, 0.285, 0.901),
+}
+
+_FIELDS = list(MUSTER4_CHECKBOXES)
+_BOXES = np.array([MUSTER4_CHECKBOXES[k] for k in _FIELDS], dtype=np.float64)
+
+COARSE_WIDTH = 400                            # px of form width for registration
+SCALE_STEPS = np.arange(0.85, 1.151, 0.025)   # x and y scale searched independently
+SEARCH_MARGIN = 0.12                          # offset search, fraction of form size
+SNAP_RANGE = 0.4                              # per-box search, fraction of box size
+
+FILL_CHECKED = 0.02      # ink density inside the frame above which a box is checked
+FILL_CERTAIN = 0.03      # ... distance from FILL_CHECKED for full confidence (checked)
+EMPTY_CERTAIN = 0.015    # ... (unchecked)
+OUTLINE_MIN = 0.5        # frame coverage below this -> box not found, confidence 0
+OUTLINE_GOOD = 0.7       # frame coverage from which registration is fully trusted
+FRAME_CONTRAST_MIN = 0.3  # frame coverage - inner ink density below this -> no frame, confidence 0
+MAX_CHECKED_SHARE = 0.5  # more of the found boxes checked -> detection not believed
+
+# At most one box of each group is checked on a valid form
+EXCLUSIVE_GROUPS = (
+    ("transport_taxi", "transport_ktw", "transport_rtw", "transport_naw_nef", "transport_other"),
+    ("equipment_wheelchair", "equipment_transport_chair", "equipment_lying"),
+)
+
+# page -> integral image of its dark mask, from register_form() to detect_checkboxes()
+_ink_cache: "weakref.WeakKeyDictionary[PageImage, np.ndarray]" = weakref.WeakKeyDictionary()
+_ink_lock = threading.Lock()
+
+
+def _dark_mask(pixels: np.ndarray) -> np.ndarray:
+    if pixels.ndim == 3:
+        # Luma x 256 in uint16 (no float copy of the page)
+        gray = np.multiply(pixels[..., 0], 77, dtype=np.uint16)
+        gray += np.multiply(pixels[..., 1], 150, dtype=np.uint16)
+        gray += np.multiply(pixels[..., 2], 29, dtype=np.uint16)
+        scale = 256
+    else:
+        gray, scale = pixels, 1
+    return gray < max(60.0, float(gray.mean()) / scale * 0.6) * scale
+
+
+def _integral(a: np.ndarray) -> np.ndarray:
+    ii = np.zeros((a.shape[0] + 1, a.shape[1] + 1), dtype=np.int32)
+    ii[1:, 1:] = a
+    np.cumsum(ii[1:, 1:], axis=1, out=ii[1:, 1:])
+    np.cumsum(ii[1:, 1:], axis=0, out=ii[1:, 1:])
+    return ii
+
+
+def _page_ink(page: PageImage, keep: bool) -> np.ndarray:
+    """Integral image of the page's dark mask; `keep` leaves it for the next call on the page."""
+    with _ink_lock:
+        ii = _ink_cache.get(page) if keep else _ink_cache.pop(page, None)
+    if ii is None:
+        ii = _integral(_dark_mask(page.pixels))
+        if keep:
+            with _ink_lock:
+                _ink_cache[page] = ii
+    return ii
+
+
+def _window_sums(ii: np.ndarray, h: int, w: int) -> np.ndarray:
+    """Sum of every h x w window, indexed by its top-left corner."""
+    return ii[h:, w:] - ii[:-h, w:] - ii[h:, :-w] + ii[:-h, :-w]
+
+
+def _rect_sums(ii: np.ndarray, y0, x0, y1, x1):
+    """Sums of (arrays of) rectangles, clipped to the image."""
+    h, w = ii.shape[0] - 1, ii.shape[1] - 1
+    y0, y1 = np.clip(y0, 0, h), np.clip(y1, 0, h)
+    x0, x1 = np.clip(x0, 0, w), np.clip(x1, 0, w)
+    return ii[y1, x1] - ii[y0, x1] - ii[y1, x0] + ii[y0, x0]
+
+
+def _longest_span(counts: np.ndarray, min_count: float, max_gap: int) -> tuple[int, int]:
+    idx = np.nonzero(counts > min_count)[0]
+    if not len(idx):
+        return 0, len(counts)
+    breaks = np.nonzero(np.diff(idx) > max_gap)[0]
+    starts = np.concatenate([[0], breaks + 1])
+    ends = np.concatenate([breaks, [len(idx) - 1]])
+    i = int(np.argmax(idx[ends] - idx[starts]))
+    return int(idx[starts[i]]), int(idx[ends[i]]) + 1
+
+
+def _form_bounds(ii: np.ndarray) -> tuple[int, int, int, int]:
+    """Rough form bounds: longest run of inked rows/columns (scanner edges ignored)."""
+    h, w = ii.shape[0] - 1, ii.shape[1] - 1
+    rows = np.diff(ii[:, -1])
+    cols = np.diff(ii[-1, :])
+    rows[rows > 0.6 * w] = 0
+    cols[cols > 0.6 * h] = 0
+    y0, y1 = _longest_span(rows, 0.01 * w, int(0.015 * h) + 1)
+    x0, x1 = _longest_span(cols, 0.01 * h, int(0.015 * w) + 1)
+    return x0, y0, x1, y1
+
+
+def _max3x3(a: np.ndarray) -> np.ndarray:
+    """Maximum over each 3 x 3 neighbourhood (1 px dilation of a mask), without stacking 9 shifted copies."""
+    h, w = a.shape
+    padded = np.pad(a, 1)
+    out = a.copy()
+    for dy in range(3):
+        for dx in range(3):
+            np.maximum(out, padded[dy:dy + h, dx:dx + w], out=out)
+    return out
+
+
+def _outline_map(ii: np.ndarray, bw: int, bh: int) -> np.ndarray:
+    """Frame-likeness of a bw x bh box at every position: side ink - half the inner ink."""
+    h, w = ii.shape[0] - 1 - bh + 1, ii.shape[1] - 1 - bw + 1
+    hbar = _window_sums(ii, 1, bw)
+    vbar = _window_sums(ii, bh, 1)
+    sides = (
+        (hbar[:h, :w] + hbar[bh - 1:bh - 1 + h, :w]) / (2 * bw)
+        + (vbar[:h, :w] + vbar[:h, bw - 1:bw - 1 + w]) / (2 * bh)
+    ) / 2
+    inner = _window_sums(ii, bh - 4, bw - 4)[2:2 + h, 2:2 + w] / ((bh - 4) * (bw - 4))
+    # Tolerate +-1 px of layout error per box
+    return _max3x3((sides - 0.5 * inner).astype(np.float32))
+
+
+def _register(ii: np.ndarray) -> Frame:
+    """
+    Fit the checkbox map to the page (`ii`: integral of its dark mask):
+    (origin x, origin y, form width, form height) in px.
+    """
+    bx0, by0, bx1, by1 = _form_bounds(ii)
+    f = max(1, round((bx1 - bx0) / COARSE_WIDTH))
+    h, w = (ii.shape[0] - 1) // f, (ii.shape[1] - 1) // f
+    # Any-pooling (f x f block sums off the integral) + 1 px dilation keeps
+    # thin frame lines solid at coarse resolution
+    corners = ii[:h * f + 1:f, :w * f + 1:f]
+    small = _max3x3((corners[1:, 1:] - corners[:-1, 1:] - corners[1:, :-1] + corners[:-1, :-1]) > 0)
+
+    fw0, fh0 = (bx1 - bx0) / f, (by1 - by0) / f
+    bw = max(6, round(float(np.median(_BOXES[:, 2] - _BOXES[:, 0])) * fw0))
+    bh = max(6, round(float(np.median(_BOXES[:, 3] - _BOXES[:, 1])) * fh0))
+    outline = _outline_map(_integral(small), bw, bh)
+    mx, my = int(SEARCH_MARGIN * fw0), int(SEARCH_MARGIN * fh0)
+    # Enough for every window the search reads (search margin + scale shift + one box)
+    pad = int((SEARCH_MARGIN + (SCALE_STEPS[-1] - 1) / 2) * max(fw0, fh0)) + max(bw, bh) + 2
+    outline = np.pad(outline, pad)
+
+    best = (-np.inf, bx0, by0, float(bx1 - bx0), float(by1 - by0))
+    for sx in SCALE_STEPS:
+        fw = fw0 * sx
+        px = np.round(_BOXES[:, 0] * fw).astype(int)
+        x_start = int(round(bx0 / f - (fw - fw0) / 2)) - mx + pad
+        for sy in SCALE_STEPS:
+            fh = fh0 * sy
+            py = np.round(_BOXES[:, 1] * fh).astype(int)
+            y_start = int(round(by0 / f - (fh - fh0) / 2)) - my + pad
+            total = np.zeros((2 * my + 1, 2 * mx + 1), dtype=np.float32)
+            for x, y in zip(px, py):
+                total += outline[y_start + y:y_start + y + 2 * my + 1, x_start + x:x_start + x + 2 * mx + 1]
+            iy, ix = np.unravel_index(int(np.argmax(total)), total.shape)
+            if total[iy, ix] > best[0]:
+                best = (total[iy, ix], (x_start - pad + ix) * f, (y_start - pad + iy) * f, fw * f, fh * f)
+    return best[1:]
+
+
+def _snap_box(ii: np.ndarray, box: tuple[int, int, int, int], lw: int) -> tuple[float, tuple[int, int, int, int]]:
+    """Move a box onto the nearest frame; returns (frame coverage 0..1, inner box)."""
+    x0, y0, x1, y1 = box
+    bw, bh = x1 - x0, y1 - y0
+    band = 2 * lw
+    dy, dx = np.mgrid[-int(SNAP_RANGE * bh):int(SNAP_RANGE * bh) + 1, -int(SNAP_RANGE * bw):int(SNAP_RANGE * bw) + 1]
+    xs, ys = x0 + dx, y0 + dy
+    ring = (
+        (_rect_sums(ii, ys, xs, ys + band, xs + bw) + _rect_sums(ii, ys + bh - band, xs, ys + bh, xs + bw)) / (2 * band * bw)
+        + (_rect_sums(ii, ys, xs, ys + bh, xs + band) + _rect_sums(ii, ys, xs + bw - band, ys + bh, xs + bw)) / (2 * band * bh)
+    )
+    j = np.unravel_index(int(np.argmax(ring)), ring.shape)
+    x0, x1, y0, y1 = x0 + dx[j], x1 + dx[j], y0 + dy[j], y1 + dy[j]
+
+    # Each side on its own (scans are rarely perfectly axis-aligned or sized)
+    r = np.arange(-band, band + 1)
+    left = _rect_sums(ii, y0, x0 + r, y1, x0 + r + lw) / (lw * bh)
+    right = _rect_sums(ii, y0, x1 - lw + r, y1, x1 + r) / (lw * bh)
+    top = _rect_sums(ii, y0 + r, x0, y0 + r + lw, x1) / (lw * bw)
+    bottom = _rect_sums(ii, y1 - lw + r, x0, y1 + r, x1) / (lw * bw)
+    coverage = float(np.mean([left.max(), right.max(), top.max(), bottom.max()]))
+    inner = (
+        x0 + int(r[left.argmax()]) + lw,
+        y0 + int(r[top.argmax()]) + lw,
+        x1 + int(r[right.argmax()]) - lw,
+        y1 + int(r[bottom.argmax()]) - lw,
+    )
+    return coverage, inner
+
+
+def _found(coverage: float, fill: float) -> bool:
+    return coverage >= OUTLINE_MIN and coverage - fill >= FRAME_CONTRAST_MIN
+
+
+def _confidence(coverage: float, fill: float, checked: bool) -> float:
+    if not _found(coverage, fill):
+        return 0.0
+    found = np.clip((coverage - OUTLINE_MIN) / (OUTLINE_GOOD - OUTLINE_MIN), 0, 1)
+    if checked:
+        clear = np.clip((fill - FILL_CHECKED) / FILL_CERTAIN, 0, 1)
+    else:
+        clear = np.clip((FILL_CHECKED - fill) / EMPTY_CERTAIN, 0, 1)
+    return round(float(found * clear), 2)
+
+
+def register_form(page: PageImage) -> Frame:
+    """Where the printed form is on the page: (origin x, origin y, form width, form height) in px."""
+    return _register(_page_ink(page, keep=True))
+
+
+def frame_box(page: PageImage, frame: Frame, box: Box) -> Box:
+    """Form-relative box -> page-relative box (for PageImage.crop / render_region)."""
+    ox, oy, fw, fh = frame
+    x0, y0, x1, y1 = box
+    return (
+        float(np.clip((ox + x0 * fw) / page.width, 0, 1)),
+        float(np.clip((oy + y0 * fh) / page.height, 0, 1)),
+        float(np.clip((ox + x1 * fw) / page.width, 0, 1)),
+        float(np.clip((oy + y1 * fh) / page.height, 0, 1)),
+    )
+
+
+def detect_checkboxes(page: PageImage, frame: Optional[Frame] = None) -> Dict[str, Dict[str, Any]]:
+    """
+    Score all Muster 4 checkboxes of a page (`frame`: register_form() result, if
+    the caller has it already).
+    Returns {field: {"checked": bool, "confidence": 0..1}}.
+    """
+    ii = _page_ink(page, keep=False)
+    ox, oy, fw, fh = frame or _register(ii)
+    lw = max(1, round(float(np.median(_BOXES[:, 2] - _BOXES[:, 0])) * fw / 18))
+
+    scores = {}
+    for field, (x0, y0, x1, y1) in MUSTER4_CHECKBOXES.items():
+        box = (round(ox + x0 * fw), round(oy + y0 * fh), round(ox + x1 * fw), round(oy + y1 * fh))
+        coverage, (l, t, r, b) = _snap_box(ii, box, lw)
+        # Skip the frame's inner edge so only marks count
+        l, t, r, b = l + 2 * lw, t + 2 * lw, r - 2 * lw, b - 2 * lw
+        fill = float(_rect_sums(ii, t, l, b, r)) / ((r - l) * (b - t)) if r > l and b > t else 0.0
+        scores[field] = (coverage, fill)
+
+    # Most frames missing -> the layout was not found at all (rotated page, other form)
+    registered = sum(_found(c, f) for c, f in scores.values()) >= len(scores) / 2
+    results: Dict[str, Dict[str, Any]] = {}
+    for field, (coverage, fill) in scores.items():
+        checked = bool(fill >= FILL_CHECKED)
+        confidence = _confidence(coverage, fill, checked) if registered else 0.0
+        results[field] = {"checked": checked, "confidence": confidence}
+    return _plausible(results)
+
+
+def _plausible(results: Dict[str, Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+    """Zero the confidence of detections no valid form has (see EXCLUSIVE_GROUPS, MAX_CHECKED_SHARE)."""
+    ticked = {k for k, v in results.items() if v["checked"] and v["confidence"] > 0}
+    found = sum(v["confidence"] > 0 for v in results.values())
+    if len(ticked) > MAX_CHECKED_SHARE * found:
+        doubtful = set(results)
+    else:
+        doubtful = {k for group in EXCLUSIVE_GROUPS if len(ticked.intersection(group)) > 1 for k in group}
+    for field in doubtful:
+        results[field]["confidence"] = 0.0
+    return results
@@ -0,0 +1,156 @@
+"""
+Content-addressed cache for GPT extraction results.
+
+Key = sha256(rendered page image digest + extraction version), so re-uploading the
+same scan/photo reuses the previous result, and changing the prompt or
+new_parser.json starts a fresh cache. Entries live in the DB
+(ExtractionCacheEntry), expire after a TTL and are trimmed least-recently-used
+first; a store trims at most once per DOCUMENTS_EXTRACTION_CACHE_EVICT_INTERVAL
+(the table may run over its size cap until then). Concurrent requests for the same key inside one worker process share a
+single in-flight GPT call.
+"""
+import copy
+import hashlib
+import logging
+import threading
+import time
+from concurrent.futures import Future
+from datetime import timedelta
+from typing import Any, Callable, Dict, Optional
+
+from django.conf import settings
+from django.db import IntegrityError
+from django.db.models import F
+from django.utils import timezone
+
+from ..models import ExtractionCacheEntry
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TTL_SECONDS = 30 * 24 * 3600
+DEFAULT_MAX_ENTRIES = 5000
+DEFAULT_EVICT_INTERVAL_SECONDS = 600
+
+_inflight: Dict[str, Future] = {}
+_inflight_lock = threading.Lock()
+_last_evict = 0.0
+_evict_lock = threading.Lock()
+
+
+def _enabled() -> bool:
+    return getattr(settings, "DOCUMENTS_EXTRACTION_CACHE_ENABLED", True)
+
+
+def _ttl() -> timedelta:
+    return timedelta(seconds=getattr(settings, "DOCUMENTS_EXTRACTION_CACHE_TTL", DEFAULT_TTL_SECONDS))
+
+
+def _max_entries() -> int:
+    return getattr(settings, "DOCUMENTS_EXTRACTION_CACHE_MAX_ENTRIES", DEFAULT_MAX_ENTRIES)
+
+
+def _evict_due() -> bool:
+    """True (and the clock restarted) if the last trim in this process is older than the interval."""
+    global _last_evict
+    interval = getattr(settings, "DOCUMENTS_EXTRACTION_CACHE_EVICT_INTERVAL", DEFAULT_EVICT_INTERVAL_SECONDS)
+    with _evict_lock:
+        now = time.monotonic()
+        if _last_evict and now - _last_evict < interval:
+            return False
+        _last_evict = now
+        return True
+
+
+def make_cache_key(image_digest: str, version: str, extra: str = "") -> str:
+    """Hash of the page image digest plus everything else that shapes the GPT answer."""
+    h = hashlib.sha256()
+    h.update(version.encode("utf-8"))
+    h.update(b"\0")
+    h.update(extra.encode("utf-8"))
+    h.update(b"\0")
+    h.update(image_digest.encode("ascii"))
+    return h.hexdigest()
+
+
+def _lookup(key: str) -> Optional[Dict[str, Any]]:
+    entry = ExtractionCacheEntry.objects.filter(
+        key=key, created_at__gte=timezone.now() - _ttl()
+    ).first()
+    if entry is None:
+        return None
+    ExtractionCacheEntry.objects.filter(pk=entry.pk).update(
+        hits=F("hits") + 1, last_used_at=timezone.now()
+    )
+    return entry.result
+
+
+def _store(key: str, version: str, result: Dict[str, Any]) -> None:
+    now = timezone.now()
+    try:
+        ExtractionCacheEntry.objects.update_or_create(
+            key=key,
+            # A refreshed entry starts a new TTL
+            defaults={"extraction_version": version, "result": result, "hits": 0, "created_at": now, "last_used_at": now},
+        )
+    except IntegrityError:
+        # Another process stored the same key first - its result is as good as ours
+        return
+    if _evict_due():
+        evict()
+
+
+def evict() -> int:
+    """Drop expired entries and trim the table to the configured size (LRU)."""
+    deleted, _ = ExtractionCacheEntry.objects.filter(created_at__lt=timezone.now() - _ttl()).delete()
+    stale_ids = list(
+        ExtractionCacheEntry.objects.order_by("-last_used_at").values_list("pk", flat=True)[_max_entries():]
+    )
+    if stale_ids:
+        deleted += ExtractionCacheEntry.objects.filter(pk__in=stale_ids).delete()[0]
+    return deleted
+
+
+def get_or_extract(key: str, version: str, extract: Callable[[], Dict[str, Any]]) -> tuple[Dict[str, Any], str]:
+    """
+    Return (result, cache_status) where cache_status is one of
+    "hit" (served from DB), "shared" (joined an in-flight call for the same key),
+    "miss" (extract() was called) or "bypass" (cache disabled).
+    """
+    if not _enabled():
+        return extract(), "bypass"
+
+    cached = _lookup(key)
+    if cached is not None:
+        logger.info("Extraction cache HIT | key=%s", key[:12])
+        return cached, "hit"
+
+    with _inflight_lock:
+        future = _inflight.get(key)
+        leader = future is None
+        if leader:
+            future = Future()
+            _inflight[key] = future
+
+    if not leader:
+        logger.info("Extraction cache SHARED | key=%s", key[:12])
+        return copy.deepcopy(future.result()), "shared"
+
+    try:
+        # Re-check: the previous leader may have finished between lookup and lock
+        cached = _lookup(key)
+        if cached is not None:
+            future.set_result(cached)
+            return copy.deepcopy(cached), "hit"
+
+        logger.info("Extraction cache MISS | key=%s", key[:12])
+        result = extract()
+        _store(key, version, result)
+        future.set_result(copy.deepcopy(result))
+        return result, "miss"
+    except BaseException as e:
+        future.set_exception(e)
+        raise
+    finally:
+        with _inflight_lock:
+            _inflight.pop(key, None)
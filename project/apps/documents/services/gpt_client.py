@@ -1,31 +1,36 @@
+import hashlib
 import json
 import re
 import os
+import threading
+import time
+from functools import lru_cache
 from pathlib import Path
 from typing import Any, Dict
+from django.conf import settings
+import httpx
 from openai import OpenAI
 import logging
 
-logger = logging.getLogger(__name__)
+from .page_image import PageImage
+from .image_payload import prepare_image
+from . import openai_standin
 
-def _load_schema() -> Dict[str, Any]:
-    p = Path(__file__).resolve().parent / "new_parser.json"
-    return json.loads(p.read_text(encoding="utf-8"))
+logger = logging.getLogger(__name__)
 
-def parse_form_page_to_new_parser(page_png_base64: str, extra_images: list[str] | None = None, trip_hints: Dict[str, bool] | None = None) -> Dict[str, Any]:
-    api_key = os.getenv("OPENAI_API_KEY")
-    if not api_key:
-        raise RuntimeError("OPENAI_API_KEY is not set")
+MODEL = "gpt-4o"
+# Detector results below this confidence are not worth sending to GPT
+CHECKBOX_HINT_MIN_CONFIDENCE = 0.5
+SCHEMA_PATH = Path(__file__).resolve().parent / "new_parser.json"
 
-    schema = _load_schema()
-    client = OpenAI(api_key=api_key)
-    system = """SYSTEM:
+SYSTEM_PROMPT = """SYSTEM:
 You are a document data extraction engine for German medical transport forms:
 "Verordnung einer Krankenbefoerderung (Muster 4)".
 
 You will receive:
 1) IMAGE_1 containing the full scanned page
 2) EXAMPLE JSON STRUCTURE (schema) below
+3) optionally CHECKBOX_HINTS from a local checkbox detector
 
 Your job is:
 A) extract fields into JSON strictly according to schema
@@ -61,6 +66,8 @@ Checkbox rules (strict):
 - A checkbox is TRUE only if a clear X/cross is fully inside the box.
 - If unclear or empty => false + warning.
 - Do NOT infer from nearby text or pen strokes.
+- CHECKBOX_HINTS: {field: {"checked": true/false, "confidence": 0..1}} measured from the pixels of each box.
+  Use them as evidence; if your reading disagrees with a hint of confidence >= 0.8, look at that box again.
 
 Specific mappings:
 - Reasons (right block):
@@ -300,28 +307,157 @@ Return JSON in this exact shape:
   ]
 }"""
 
-    hints_text = ""
-    if isinstance(trip_hints, dict) and trip_hints:
-        hints_text += "TRIP_DIRECTION_HINTS: " + json.dumps(trip_hints, ensure_ascii=False) + "\n"
-    user_text = hints_text + "EXAMPLE JSON STRUCTURE:" + json.dumps(schema, ensure_ascii=False)
 
-    resp = client.chat.completions.create(
-        model="gpt-4o",
-        messages=[
-            {"role": "system", "content": system},
-            {"role": "user", "content": [
-                {"type": "text", "text": user_text},
-                {"type": "image_url", "image_url": {"url": f"data:image/png;base64,{page_png_base64}"}},
-            ]},
-        ],
-        temperature=0,
-        response_format={"type": "json_object"},
-        timeout=120,
+def _load_schema() -> Dict[str, Any]:
+    return json.loads(SCHEMA_PATH.read_text(encoding="utf-8"))
+
+
+@lru_cache(maxsize=1)
+def _schema_prompt() -> str:
+    """Schema part of the user message, serialized once per process."""
+    return "EXAMPLE JSON STRUCTURE:" + json.dumps(_load_schema(), ensure_ascii=False)
+
+
+# --- Shared OpenAI client ---
+# One client per process: its httpx pool keeps connections alive between
+# calls, so only the first request to api.openai.com pays for TCP + TLS.
+
+_client: OpenAI | None = None
+_client_lock = threading.Lock()
+
+
+class _RequestTimer:
+    """httpcore trace callback collecting event timestamps of one request."""
+
+    def __init__(self):
+        self.marks: Dict[str, float] = {}
+
+    def __call__(self, event_name: str, info: Dict[str, Any]) -> None:
+        # "connection.connect_tcp.started" -> "connect_tcp.started"
+        self.marks[event_name.split(".", 1)[-1]] = time.perf_counter()
+
+    def span_ms(self, start: str, end: str) -> int | None:
+        if start in self.marks and end in self.marks:
+            return round((self.marks[end] - self.marks[start]) * 1000)
+        return None
+
+
+def _on_request(request: httpx.Request) -> None:
+    request.extensions["trace"] = _RequestTimer()
+
+
+def _on_response(response: httpx.Response) -> None:
+    timer = response.request.extensions.get("trace")
+    if not isinstance(timer, _RequestTimer):
+        return
+    connect_ms = timer.span_ms("connect_tcp.started", "connect_tcp.complete")
+    tls_ms = timer.span_ms("start_tls.started", "start_tls.complete")
+    logger.info(
+        "OpenAI HTTP | status=%s new_connection=%s connect_ms=%s tls_ms=%s upload_ms=%s server_ms=%s openai_processing_ms=%s",
+        response.status_code,
+        connect_ms is not None,
+        connect_ms or 0,
+        tls_ms or 0,
+        timer.span_ms("send_request_headers.started", "send_request_body.complete"),
+        timer.span_ms("send_request_body.complete", "receive_response_headers.complete"),
+        response.headers.get("openai-processing-ms"),
     )
 
-    data = json.loads((resp.choices[0].message.content or "").strip())
-    logger.info("Parsed data keys: %s", list(data.keys()) if isinstance(data, dict) else type(data))
 
+def get_client() -> OpenAI:
+    """Process-wide OpenAI client with a keep-alive connection pool."""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                replay = openai_standin.mode() == "replay"
+                api_key = os.getenv("OPENAI_API_KEY") or ("replay" if replay else None)
+                if not api_key:
+                    raise RuntimeError("OPENAI_API_KEY is not set")
+                limits = httpx.Limits(
+                    max_connections=getattr(settings, "DOCUMENTS_OPENAI_MAX_CONNECTIONS", 20),
+                    max_keepalive_connections=getattr(settings, "DOCUMENTS_OPENAI_MAX_KEEPALIVE", 20),
+                    keepalive_expiry=getattr(settings, "DOCUMENTS_OPENAI_KEEPALIVE_EXPIRY", 60),
+                )
+                http_client = httpx.Client(
+                    limits=limits,
+                    # Record / replay stand-in (services/openai_standin.py), None = real calls
+                    transport=openai_standin.make_transport(limits),
+                    timeout=httpx.Timeout(120, connect=10),
+                    event_hooks={"request": [_on_request], "response": [_on_response]},
+                )
+                _client = OpenAI(api_key=api_key, http_client=http_client)
+    return _client
+
+
+def warm_up() -> None:
+    """Build the schema prompt, extraction version and client once, at worker start."""
+    _schema_prompt()
+    extraction_version()
+    if os.getenv("OPENAI_API_KEY") or openai_standin.mode() == "replay":
+        get_client()
+
+
+@lru_cache(maxsize=1)
+def extraction_version() -> str:
+    """
+    Version string of the extraction setup (model + prompt + schema).
+    Part of the extraction cache key: editing the prompt or new_parser.json
+    automatically invalidates cached results (computed once per process,
+    so a running worker keeps its version until it is restarted).
+    """
+    h = hashlib.sha256()
+    h.update(MODEL.encode("utf-8"))
+    h.update(SYSTEM_PROMPT.encode("utf-8"))
+    h.update(SCHEMA_PATH.read_bytes())
+    return h.hexdigest()[:16]
+
+
+@lru_cache(maxsize=1)
+def text_layer_version() -> str:
+    """Version of the text-layer request on top of extraction_version() (cache key extra)."""
+    return hashlib.sha256(TEXT_LAYER_INTRO.encode("utf-8")).hexdigest()[:16]
+
+
+def _apply_checkbox_overrides(data: Dict[str, Any], checkbox_hints: Dict[str, Dict[str, Any]]) -> None:
+    """
+    Replace GPT's checkbox values with confident local detections (flagged as info).
+    Implausible detections (two transport types, most boxes checked) already
+    come with confidence 0 from checkboxes.detect_checkboxes.
+    """
+    d = data.get("data") if isinstance(data.get("data"), dict) else None
+    if not isinstance(d, dict):
+        return
+    threshold = getattr(settings, "DOCUMENTS_CHECKBOX_OVERRIDE_CONFIDENCE", 0.9)
+    flags = data.get("flags") if isinstance(data.get("flags"), list) else []
+    for field, hint in checkbox_hints.items():
+        if hint["confidence"] < threshold or bool(d.get(field)) == hint["checked"]:
+            continue
+        d[field] = hint["checked"]
+        flags.append({
+            "code": "CHECKBOX_DETECTOR_OVERRIDE",
+            "severity": "info",
+            "field": field,
+            "related_fields": [],
+            "message": f"Set to {hint['checked']} by the checkbox detector (confidence {hint['confidence']})",
+        })
+        logger.info("Checkbox override | %s=%s confidence=%s", field, hint["checked"], hint["confidence"])
+    data["flags"] = flags
+
+
+def effective_checkbox_hints(checkbox_hints: Dict[str, Dict[str, Any]] | None) -> Dict[str, Dict[str, Any]]:
+    """
+    The detector results that can change an extraction: sent to GPT
+    (CHECKBOX_HINT_MIN_CONFIDENCE) or applied as overrides. An unregistered form
+    (all confidences 0) gives {} - the same cache key as no detection.
+    """
+    threshold = min(CHECKBOX_HINT_MIN_CONFIDENCE, getattr(settings, "DOCUMENTS_CHECKBOX_OVERRIDE_CONFIDENCE", 0.9))
+    return {k: v for k, v in (checkbox_hints or {}).items() if v["confidence"] > 0 and v["confidence"] >= threshold}
+
+
+def postprocess(data: Any, trip_hints: Dict[str, bool] | None = None,
+                checkbox_hints: Dict[str, Dict[str, Any]] | None = None) -> Any:
+    """Consistency rules applied to the parsed GPT answer (in place; returns `data`)."""
     # Split clinic line into fields if merged
     def _split_clinic_line(line: str):
         if not line:
@@ -356,6 +492,8 @@ Return JSON in this exact shape:
             elif ret_h and not out_h:
                 d["transport_outbound"] = False
                 d["transport_return"] = True
+    if isinstance(data, dict) and checkbox_hints:
+        _apply_checkbox_overrides(data, checkbox_hints)
     if isinstance(data, dict):
         d = data.get("data") if isinstance(data.get("data"), dict) else None
         if isinstance(d, dict):
@@ -510,3 +648,83 @@ Return JSON in this exact shape:
                     d[k] = False
 
     return data
+
+
+TEXT_LAYER_INTRO = """NO IMAGE: the page is a digitally generated PDF. Instead of IMAGE_1 you get TEXT_LAYER,
+its embedded text: one line per printed line, top to bottom, "y=<top-to-bottom position>", then every
+text piece as "x=<left edge> <text>" (positions are fractions of the page width/height).
+Read values from their labelled positions on the form. Digits in the text layer are exact.
+A checkbox is TRUE only if an "X"/"x" text piece lies in that box or CHECKBOX_HINTS says checked;
+otherwise false (no warning needed for boxes that are simply empty).
+"""
+
+
+def _create_completion(content: list) -> Dict[str, Any]:
+    """One extraction request (system prompt + user content); returns the parsed JSON answer."""
+    client = get_client()
+    t0 = time.perf_counter()
+    resp = client.chat.completions.create(
+        model=MODEL,
+        messages=[
+            {"role": "system", "content": SYSTEM_PROMPT},
+            {"role": "user", "content": content},
+        ],
+        temperature=0,
+        response_format={"type": "json_object"},
+        timeout=120,
+    )
+
+    logger.info("GPT call | total_ms=%d", (time.perf_counter() - t0) * 1000)
+    if getattr(resp, "usage", None) is not None:
+        logger.info("GPT usage | prompt_tokens=%s completion_tokens=%s", resp.usage.prompt_tokens, resp.usage.completion_tokens)
+    data = json.loads((resp.choices[0].message.content or "").strip())
+    logger.info("Parsed data keys: %s", list(data.keys()) if isinstance(data, dict) else type(data))
+    return data
+
+
+def _hints_text(trip_hints: Dict[str, bool] | None, checkbox_hints: Dict[str, Dict[str, Any]] | None) -> str:
+    hints_text = ""
+    if isinstance(trip_hints, dict) and trip_hints:
+        hints_text += "TRIP_DIRECTION_HINTS: " + json.dumps(trip_hints, ensure_ascii=False) + "\n"
+    if checkbox_hints:
+        confident = {k: v for k, v in checkbox_hints.items() if v["confidence"] >= CHECKBOX_HINT_MIN_CONFIDENCE}
+        if confident:
+            hints_text += "CHECKBOX_HINTS: " + json.dumps(confident, ensure_ascii=False) + "\n"
+    return hints_text
+
+
+def parse_text_layer_to_new_parser(layout: str, checkbox_hints: Dict[str, Dict[str, Any]] | None = None) -> Dict[str, Any]:
+    """
+    Extract Muster 4 fields from the text layer of a digital PDF page
+    (services.text_layer.page_layout): same prompt, schema and post-processing
+    as the image path, but a text-only request.
+    """
+    user_text = TEXT_LAYER_INTRO + _hints_text(None, checkbox_hints) + _schema_prompt() + "\nTEXT_LAYER:\n" + layout
+    data = _create_completion([{"type": "text", "text": user_text}])
+    return postprocess(data, None, checkbox_hints)
+
+
+def parse_form_page_to_new_parser(page: PageImage | str, extra_images: list[str] | None = None, trip_hints: Dict[str, bool] | None = None,
+                                  checkbox_hints: Dict[str, Dict[str, Any]] | None = None,
+                                  image_options: Dict[str, Any] | None = None) -> Dict[str, Any]:
+    """
+    Extract Muster 4 fields from a page. `page` is a PageImage (encoded here,
+    once, for the request) or an already base64-encoded PNG.
+    `checkbox_hints` ({field: {"checked", "confidence"}}, see services.checkboxes)
+    go into the prompt and override GPT where the detector is confident.
+    `image_options` override the DOCUMENTS_GPT_IMAGE_* payload settings
+    (see services.image_payload).
+    """
+    user_text = _hints_text(trip_hints, checkbox_hints) + _schema_prompt()
+    if isinstance(page, PageImage):
+        image_url, payload = prepare_image(page, image_options)
+        image_part = {"url": image_url, "detail": payload["detail"]}
+        logger.info("GPT image payload | %s", " ".join(f"{k}={v}" for k, v in payload.items()))
+    else:
+        image_part = {"url": f"data:image/png;base64,{page}"}
+
+    data = _create_completion([
+        {"type": "text", "text": user_text},
+        {"type": "image_url", "image_url": image_part},
+    ])
+    return postprocess(data, trip_hints, checkbox_hints)
@@ -0,0 +1,127 @@
+"""
+Image payload for the GPT call: resolution, colour, encoding and `detail`.
+
+OpenAI bills an image by 512 px tiles after its own resizing (high detail:
+fit into 2048x2048, then shortest side 768 px; low detail: one 512 px image).
+A 250-dpi A4 render is 2067x2923, so most of the uploaded pixels were thrown
+away on their side. prepare_image() resizes to what the model actually sees
+(or to a smaller tile budget), optionally converts to grayscale / JPEG and
+returns the data URL together with the estimated bytes and tokens.
+
+Options are a plain dict:
+    {"resize": bool, "max_tiles": int | None, "grayscale": bool,
+     "format": "PNG" | "JPEG" | "", "jpeg_quality": int, "detail": "high" | "low"}
+("" keeps the page's own format, so photos stay JPEG; resize=False sends
+the full render, as before.)
+default_options() reads them from settings (DOCUMENTS_GPT_IMAGE_*); the
+bench_gpt_payload command replays fixtures with other combinations.
+"""
+import base64
+import json
+import math
+from io import BytesIO
+from typing import Any, Dict, Optional
+
+from django.conf import settings
+from PIL import Image
+
+from .page_image import MIME_TYPES, PageImage
+
+
+TILE_SIZE = 512
+BASE_TOKENS = 85
+TOKENS_PER_TILE = 170
+HIGH_DETAIL_MAX_SIDE = 2048
+HIGH_DETAIL_SHORT_SIDE = 768
+
+
+def default_options() -> Dict[str, Any]:
+    return {
+        "resize": getattr(settings, "DOCUMENTS_GPT_IMAGE_RESIZE", True),
+        "max_tiles": getattr(settings, "DOCUMENTS_GPT_IMAGE_MAX_TILES", None),
+        "grayscale": getattr(settings, "DOCUMENTS_GPT_IMAGE_GRAYSCALE", False),
+        "format": getattr(settings, "DOCUMENTS_GPT_IMAGE_FORMAT", ""),
+        "jpeg_quality": getattr(settings, "DOCUMENTS_GPT_IMAGE_JPEG_QUALITY", 85),
+        "detail": getattr(settings, "DOCUMENTS_GPT_IMAGE_DETAIL", "high"),
+    }
+
+
+def options_signature(options: Dict[str, Any]) -> str:
+    """Stable string for the extraction cache key (the payload shapes the answer)."""
+    return json.dumps(options, sort_keys=True)
+
+
+def openai_image_size(width: int, height: int, detail: str = "high") -> tuple[int, int]:
+    """Size OpenAI scales an image to before tiling it."""
+    if detail == "low":
+        scale = min(1.0, TILE_SIZE / max(width, height))
+        return max(1, round(width * scale)), max(1, round(height * scale))
+    scale = min(1.0, HIGH_DETAIL_MAX_SIDE / max(width, height))
+    w, h = width * scale, height * scale
+    scale = min(1.0, HIGH_DETAIL_SHORT_SIDE / min(w, h))
+    return max(1, round(w * scale)), max(1, round(h * scale))
+
+
+def estimate_tokens(width: int, height: int, detail: str = "high") -> int:
+    """Image input tokens as billed by OpenAI for gpt-4o."""
+    if detail == "low":
+        return BASE_TOKENS
+    w, h = openai_image_size(width, height, detail)
+    return BASE_TOKENS + TOKENS_PER_TILE * math.ceil(w / TILE_SIZE) * math.ceil(h / TILE_SIZE)
+
+
+def _fit_tiles(width: int, height: int, max_tiles: int) -> tuple[int, int]:
+    """Largest size with the same aspect ratio that covers at most max_tiles tiles."""
+    best = 0.0
+    for tiles_x in range(1, max_tiles + 1):
+        tiles_y = max_tiles // tiles_x
+        best = max(best, min(tiles_x * TILE_SIZE / width, tiles_y * TILE_SIZE / height))
+    scale = min(1.0, best)
+    return max(1, math.floor(width * scale)), max(1, math.floor(height * scale))
+
+
+def target_size(width: int, height: int, options: Dict[str, Any]) -> tuple[int, int]:
+    if not options["resize"]:
+        return width, height
+    w, h = openai_image_size(width, height, options["detail"])
+    if options.get("max_tiles") and options["detail"] != "low":
+        w, h = _fit_tiles(w, h, options["max_tiles"])
+    return w, h
+
+
+def prepare_image(page: PageImage, options: Optional[Dict[str, Any]] = None) -> tuple[str, Dict[str, Any]]:
+    """
+    Return (data_url, info) for the GPT request; info has the sent size,
+    format, detail, bytes and estimated image tokens.
+    """
+    options = {**default_options(), **(options or {})}
+    fmt = options["format"] or page.source_format
+    size = target_size(page.width, page.height, options)
+    grayscale = options["grayscale"] and page.pixels.ndim == 3
+
+    if size == (page.width, page.height) and not grayscale and fmt == page.source_format:
+        # Nothing to change: send the encoded page as it is (no re-encoding)
+        data = page.encode()
+    else:
+        img = page.to_pil()
+        if grayscale:
+            img = img.convert("L")
+        if size != img.size:
+            img = img.resize(size, Image.LANCZOS, reducing_gap=3.0)
+        buffered = BytesIO()
+        if fmt == "JPEG":
+            img.save(buffered, format="JPEG", quality=options["jpeg_quality"])
+        else:
+            img.save(buffered, format=fmt)
+        data = buffered.getvalue()
+
+    info = {
+        "width": size[0],
+        "height": size[1],
+        "format": fmt,
+        "grayscale": bool(options["grayscale"]),
+        "detail": options["detail"],
+        "bytes": len(data),
+        "est_tokens": estimate_tokens(size[0], size[1], options["detail"]),
+    }
+    return f"data:{MIME_TYPES[fmt]};base64,{base64.b64encode(data).decode('ascii')}", info
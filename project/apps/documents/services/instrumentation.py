@@ -0,0 +1,65 @@
+"""
+Resource instrumentation for document processing.
+
+track_resources() measures one unit of work (e.g. one upload) and logs:
+- wall_s: elapsed time,
+- max_rss_mb: process RSS high-water mark after the work,
+- max_rss_growth_mb: how much this work raised the high-water mark
+  (0 if it stayed under an earlier peak),
+- python_peak_mb: peak of Python/NumPy allocations (tracemalloc), only when
+  tracing is requested - it slows allocations down, so it is opt-in.
+
+With several uploads running in one worker process the RSS numbers are
+process-wide; they are still the figure that matters for sizing workers.
+"""
+import logging
+import sys
+import time
+import tracemalloc
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, Optional
+
+try:
+    import resource
+except ImportError:  # Windows dev machines
+    resource = None
+
+
+logger = logging.getLogger(__name__)
+
+
+def max_rss_mb() -> Optional[float]:
+    """Process RSS high-water mark in MB (None where unsupported)."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KB, macOS bytes
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+@contextmanager
+def track_resources(label: str, trace_python: bool = False) -> Iterator[Dict[str, Any]]:
+    """Yield a dict that is filled with resource metrics when the block exits."""
+    metrics: Dict[str, Any] = {}
+    started_trace = False
+    if trace_python and not tracemalloc.is_tracing():
+        tracemalloc.start()
+        started_trace = True
+    if tracemalloc.is_tracing():
+        tracemalloc.reset_peak()
+
+    rss_before = max_rss_mb()
+    t0 = time.perf_counter()
+    try:
+        yield metrics
+    finally:
+        metrics["wall_s"] = round(time.perf_counter() - t0, 3)
+        rss_after = max_rss_mb()
+        if rss_after is not None:
+            metrics["max_rss_mb"] = round(rss_after, 1)
+            metrics["max_rss_growth_mb"] = round(rss_after - rss_before, 1)
+        if tracemalloc.is_tracing():
+            metrics["python_peak_mb"] = round(tracemalloc.get_traced_memory()[1] / (1024 * 1024), 1)
+            if started_trace:
+                tracemalloc.stop()
+        logger.info("Resources | %s %s", label, " ".join(f"{k}={v}" for k, v in metrics.items()))
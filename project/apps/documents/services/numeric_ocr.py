@@ -0,0 +1,160 @@
+"""
+Local OCR cross-check of the printed Muster 4 numbers.
+
+MUSTER4_NUMBER_FIELDS maps the printed numeric fields to their box relative to
+the printed form, in the frame of checkboxes.MUSTER4_CHECKBOXES
+(checkboxes.register_form() places it on the page).
+
+read_fields() runs Tesseract once per page: every crop is binarized, cleared
+of form lines, scaled to the same text height and stacked into one image with
+white gaps between them. Each recognized word is assigned back to its crop by
+its vertical position, so all fields cost one Tesseract process instead of one
+per field.
+
+cross_check() compares the readings with GPT's values (digits only; the
+leading letter of the Versicherten-Nr. is not checked, OCR runs digits-only):
+- "agree": GPT's number is in the OCR text;
+- "disagree": OCR read a well-formed, different number with at least
+  MIN_CONFIDENCE;
+- "unsure": the same at lower confidence (not flagged);
+- "unread": no well-formed number (misregistered photo, handwriting, no Tesseract).
+apply() stores the result in parsed_data["numeric_ocr"] and adds an
+OCR_MISMATCH flag per disagreement: bulk approve skips such uploads, the
+review page marks agreeing fields as verified and disagreeing ones as invalid.
+"""
+import logging
+import re
+from typing import Any, Dict, Optional
+
+import numpy as np
+from PIL import Image
+
+from . import ocr_engine
+from .checkboxes import Box, Frame, register_form
+from .page_image import PageImage
+
+
+logger = logging.getLogger(__name__)
+
+# Measured on clean scans, relative to the same form bounds as MUSTER4_CHECKBOXES.
+# digits: length of the printed number (Versicherten-Nr.: the 9 digits after the letter)
+MUSTER4_NUMBER_FIELDS: Dict[str, Dict[str, Any]] = {
+    "kostentraegerkennung": {"box": (0.040, 0.170, 0.228, 0.200), "digits": 9},
+    "insurance_number": {"box": (0.216, 0.170, 0.425, 0.200), "digits": 9},
+    "status_number": {"box": (0.440, 0.170, 0.610, 0.200), "digits": 7},
+    "betriebsstaetten_nr": {"box": (0.040, 0.212, 0.228, 0.240), "digits": 9},
+    "arzt_nr": {"box": (0.216, 0.212, 0.425, 0.240), "digits": 9},
+}
+
+TEXT_HEIGHT = 64         # px of every crop in the tiled image
+GAP = 32                 # px of white between crops (and around the tile)
+LINE_FILL = 0.7          # rows/columns with more ink than this are form lines
+MIN_CONFIDENCE = 0.6     # disagreements below this word confidence are not flagged
+
+FLAG_CODE = "OCR_MISMATCH"
+
+
+def _field_crop(page: PageImage, frame: Frame, box: Box) -> np.ndarray:
+    """Binarized crop (ink 0, paper 255) scaled to TEXT_HEIGHT, form lines removed."""
+    ox, oy, fw, fh = frame
+    x0, y0, x1, y1 = box
+    left, top = max(0, round(ox + x0 * fw)), max(0, round(oy + y0 * fh))
+    right, bottom = min(page.width, round(ox + x1 * fw)), min(page.height, round(oy + y1 * fh))
+    if right - left < 4 or bottom - top < 4:
+        return np.full((TEXT_HEIGHT, TEXT_HEIGHT), 255, dtype=np.uint8)
+
+    img = Image.fromarray(np.ascontiguousarray(page.pixels[top:bottom, left:right])).convert("L")
+    width = max(1, round(img.width * TEXT_HEIGHT / img.height))
+    gray = np.asarray(img.resize((width, TEXT_HEIGHT), Image.BICUBIC), dtype=np.float32)
+    ink = gray < max(90.0, float(gray.mean()) - 30)
+    ink[:, ink.mean(axis=0) > LINE_FILL] = False
+    ink[ink.mean(axis=1) > LINE_FILL, :] = False
+    return np.where(ink, 0, 255).astype(np.uint8)
+
+
+def _tile(crops: Dict[str, np.ndarray]) -> tuple[Image.Image, Dict[str, tuple[int, int]]]:
+    """Stack the crops into one image; returns it and {field: (top, bottom)} rows."""
+    width = max(c.shape[1] for c in crops.values()) + 2 * GAP
+    height = GAP + sum(c.shape[0] + GAP for c in crops.values())
+    tiled = np.full((height, width), 255, dtype=np.uint8)
+    rows = {}
+    y = GAP
+    for field, crop in crops.items():
+        h, w = crop.shape
+        tiled[y:y + h, GAP:GAP + w] = crop
+        rows[field] = (y, y + h)
+        y += h + GAP
+    return Image.fromarray(tiled), rows
+
+
+def read_fields(page: PageImage, frame: Optional[Frame] = None) -> Dict[str, Dict[str, Any]]:
+    """
+    OCR all MUSTER4_NUMBER_FIELDS of a page in one Tesseract call.
+    Returns {field: {"text": digits read, "confidence": 0..1}}.
+    Raises ocr_engine.OcrUnavailable without Tesseract.
+    """
+    frame = frame or register_form(page)
+    crops = {field: _field_crop(page, frame, spec["box"]) for field, spec in MUSTER4_NUMBER_FIELDS.items()}
+    tiled, rows = _tile(crops)
+    words: Dict[str, list] = {field: [] for field in crops}
+    for text, conf, left, top, _, height in ocr_engine.image_to_words(tiled, psm=6, whitelist=ocr_engine.DIGITS):
+        center = top + height / 2
+        for field, (row_top, row_bottom) in rows.items():
+            if row_top - GAP / 2 <= center < row_bottom + GAP / 2:
+                words[field].append((left, text, conf))
+                break
+
+    readings = {}
+    for field, found in words.items():
+        found.sort()
+        readings[field] = {
+            "text": "".join(text for _, text, _ in found),
+            "confidence": round(min(conf for _, _, conf in found) / 100, 2) if found else 0.0,
+        }
+    return readings
+
+
+def cross_check(data: Dict[str, Any], readings: Dict[str, Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+    """Compare GPT's values (parsed_data["data"]) with read_fields() per field."""
+    checks = {}
+    for field, spec in MUSTER4_NUMBER_FIELDS.items():
+        reading = readings.get(field) or {"text": "", "confidence": 0.0}
+        gpt = re.sub(r"\D", "", str(data.get(field) or ""))
+        ocr = re.sub(r"\D", "", reading["text"])
+        n = spec["digits"]
+        if len(gpt) == n and gpt in ocr:
+            status = "agree"
+        elif len(ocr) < n:
+            status = "unread"
+        else:
+            status = "disagree" if reading["confidence"] >= MIN_CONFIDENCE else "unsure"
+        # A tick mark next to the number may be read as a leading "1": show the last n digits
+        checks[field] = {"status": status, "ocr": ocr[-n:] if len(ocr) > n and status != "agree" else ocr,
+                         "confidence": reading["confidence"]}
+    return checks
+
+
+def apply(parsed_data: Dict[str, Any], checks: Dict[str, Dict[str, Any]]) -> None:
+    """Store the checks in parsed_data and flag every disagreement for review."""
+    d = parsed_data.get("data") if isinstance(parsed_data.get("data"), dict) else {}
+    flags = [f for f in parsed_data.get("flags") or [] if not (isinstance(f, dict) and f.get("code") == FLAG_CODE)]
+    for field, check in checks.items():
+        if check["status"] != "disagree":
+            continue
+        flags.append({
+            "code": FLAG_CODE,
+            "severity": "warning",
+            "field": field,
+            "related_fields": [],
+            "message": f"Printed number reads {check['ocr']} (OCR confidence {check['confidence']}), "
+                       f"extracted '{d.get(field) or ''}'",
+        })
+    parsed_data["flags"] = flags
+    parsed_data["numeric_ocr"] = checks
+    logger.info("Numeric OCR | %s", " ".join(f"{k}={v['status']}" for k, v in checks.items()))
+
+
+def mismatched_fields(parsed_data: Optional[Dict[str, Any]]) -> list[str]:
+    """Fields flagged OCR_MISMATCH in parsed_data."""
+    flags = parsed_data.get("flags") if isinstance(parsed_data, dict) else None
+    return [f.get("field", "") for f in flags or [] if isinstance(f, dict) and f.get("code") == FLAG_CODE]
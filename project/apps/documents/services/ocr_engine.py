@@ -0,0 +1,180 @@
+"""
+Tesseract OCR for small crops (digit fields), with a result cache.
+
+With tesserocr installed (Tesseract C API bindings, needs libtesseract) every
+thread keeps one initialized engine: the language data is loaded once and
+images are passed as pixel buffers, no process or temp file per call. The OCR
+pool threads are long-lived, so in practice that is one engine per pool
+worker. Without tesserocr each call falls back to pytesseract (one tesseract
+process per call).
+
+Results are cached in-process by (crop pixels, mode, page segmentation,
+whitelist): the same crop OCR'd again (re-processing, a second check of a
+field) costs a hash. DOCUMENTS_OCR_CACHE_SIZE entries, LRU, 0 = off.
+"""
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Tuple
+
+import numpy as np
+import pytesseract
+from django.conf import settings
+from PIL import Image
+
+try:
+    import tesserocr
+except ImportError:  # optional, see module docstring
+    tesserocr = None
+
+
+logger = logging.getLogger(__name__)
+
+DIGITS = "0123456789"
+
+# (text, confidence 0..100, left, top, width, height) per recognized word
+Word = Tuple[str, float, int, int, int, int]
+
+
+class OcrUnavailable(RuntimeError):
+    """Neither tesserocr nor the tesseract binary can be used."""
+
+
+_local = threading.local()
+_cache: "OrderedDict[str, Any]" = OrderedDict()
+_cache_lock = threading.Lock()
+_stats: Dict[str, int] = {"hits": 0, "misses": 0}
+
+
+def backend() -> str:
+    return "tesserocr" if tesserocr is not None else "pytesseract"
+
+
+def available() -> bool:
+    if tesserocr is not None:
+        return True
+    try:
+        pytesseract.get_tesseract_version()
+        return True
+    except Exception:
+        return False
+
+
+def _engine():
+    """This thread's tesserocr engine (created on first use)."""
+    api = getattr(_local, "api", None)
+    if api is None:
+        try:
+            api = tesserocr.PyTessBaseAPI(lang="eng")
+        except RuntimeError as e:
+            raise OcrUnavailable(f"Tesseract engine could not be initialized: {e}") from e
+        _local.api = api
+        logger.info("OCR engine started | thread=%s", threading.current_thread().name)
+    return api
+
+
+def _gray(img: Image.Image | np.ndarray) -> Image.Image:
+    if isinstance(img, np.ndarray):
+        img = Image.fromarray(np.ascontiguousarray(img))
+    return img if img.mode == "L" else img.convert("L")
+
+
+def _cache_key(img: Image.Image, mode: str, psm: int, whitelist: str) -> str:
+    h = hashlib.blake2b(digest_size=16)
+    h.update(f"{mode}|{psm}|{whitelist}|{img.width}x{img.height}|".encode("ascii"))
+    h.update(img.tobytes())
+    return h.hexdigest()
+
+
+def _cached(key: str):
+    with _cache_lock:
+        if key in _cache:
+            _cache.move_to_end(key)
+            _stats["hits"] += 1
+            return _cache[key]
+        _stats["misses"] += 1
+    return None
+
+
+def _store(key: str, value: Any) -> None:
+    size = getattr(settings, "DOCUMENTS_OCR_CACHE_SIZE", 2000)
+    if size <= 0:
+        return
+    with _cache_lock:
+        _cache[key] = value
+        _cache.move_to_end(key)
+        while len(_cache) > size:
+            _cache.popitem(last=False)
+
+
+def _run_tesserocr(img: Image.Image, mode: str, psm: int, whitelist: str):
+    api = _engine()
+    # Variables stick to the engine: set every call
+    api.SetPageSegMode(psm)
+    api.SetVariable("tessedit_char_whitelist", whitelist)
+    api.SetImage(img)
+    try:
+        if mode == "text":
+            return api.GetUTF8Text()
+        api.Recognize()
+        words: List[Word] = []
+        level = tesserocr.RIL.WORD
+        for r in tesserocr.iterate_level(api.GetIterator(), level):
+            text = r.GetUTF8Text(level)
+            box = r.BoundingBox(level)
+            if not text or box is None:
+                continue
+            x0, y0, x1, y1 = box
+            words.append((text, float(r.Confidence(level)), x0, y0, x1 - x0, y1 - y0))
+        return words
+    finally:
+        api.Clear()
+
+
+def _run_pytesseract(img: Image.Image, mode: str, psm: int, whitelist: str):
+    config = f"--psm {psm}" + (f" -c tessedit_char_whitelist={whitelist}" if whitelist else "")
+    try:
+        if mode == "text":
+            return pytesseract.image_to_string(img, config=config)
+        data = pytesseract.image_to_data(img, config=config, output_type=pytesseract.Output.DICT)
+    except pytesseract.TesseractNotFoundError as e:
+        raise OcrUnavailable("tesseract is not installed") from e
+    return [
+        (text.strip(), float(conf), left, top, width, height)
+        for text, conf, left, top, width, height in zip(
+            data["text"], data["conf"], data["left"], data["top"], data["width"], data["height"])
+        if (text or "").strip() and float(conf) >= 0
+    ]
+
+
+def _ocr(img: Image.Image | np.ndarray, mode: str, psm: int, whitelist: str):
+    img = _gray(img)
+    key = _cache_key(img, mode, psm, whitelist)
+    result = _cached(key)
+    if result is None:
+        run = _run_tesserocr if tesserocr is not None else _run_pytesseract
+        result = run(img, mode, psm, whitelist)
+        _store(key, result)
+    return result
+
+
+def image_to_string(img: Image.Image | np.ndarray, psm: int = 6, whitelist: str = "") -> str:
+    """Text of a (grayscale or converted) image. Raises OcrUnavailable."""
+    return _ocr(img, "text", psm, whitelist)
+
+
+def image_to_words(img: Image.Image | np.ndarray, psm: int = 6, whitelist: str = "") -> List[Word]:
+    """Recognized words with confidence and box. Raises OcrUnavailable."""
+    return list(_ocr(img, "words", psm, whitelist))
+
+
+def cache_stats() -> Dict[str, int]:
+    with _cache_lock:
+        return {**_stats, "entries": len(_cache)}
+
+
+def clear_cache() -> None:
+    with _cache_lock:
+        _cache.clear()
+        _stats.update(hits=0, misses=0)
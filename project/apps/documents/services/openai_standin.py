@@ -0,0 +1,195 @@
+"""
+Record / replay of OpenAI calls, for benchmarks and load tests without GPT costs.
+
+DOCUMENTS_OPENAI_STANDIN selects the httpx transport of the shared client
+(gpt_client.get_client), so every process loading the settings (web, worker,
+management commands) follows it:
+- "" (default): real calls;
+- "record": real calls; each 200 answer is saved under the request fingerprint
+  in DOCUMENTS_OPENAI_FIXTURES_DIR;
+- "replay": no network. Answers come from the fixture store and are delayed per
+  DOCUMENTS_OPENAI_REPLAY_LATENCY: "recorded" (the time the real call took),
+  "0", or "MEDIAN:P95" in ms (log-normal). An unknown request gets a 404, so
+  the OpenAI SDK raises NotFoundError without retrying.
+
+The fingerprint is the SHA-256 of the request path and its JSON body with
+sorted keys. The body includes the model, prompt and image, so a different
+render, crop or prompt is a miss: record again after changing any of them.
+Fixtures contain the extracted patient data: keep them out of git.
+"""
+import hashlib
+import json
+import logging
+import math
+import random
+import threading
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+import httpx
+from django.conf import settings
+
+
+logger = logging.getLogger(__name__)
+
+MODES = ("", "record", "replay")
+
+
+def mode() -> str:
+    value = getattr(settings, "DOCUMENTS_OPENAI_STANDIN", "") or ""
+    if value not in MODES:
+        raise ValueError(f"DOCUMENTS_OPENAI_STANDIN must be one of {MODES}, got '{value}'")
+    return value
+
+
+def fixtures_dir() -> Path:
+    return Path(getattr(settings, "DOCUMENTS_OPENAI_FIXTURES_DIR", Path(settings.BASE_DIR) / "fixtures" / "openai"))
+
+
+def fingerprint(request: httpx.Request) -> str:
+    body = request.content or b""
+    try:
+        canonical = json.dumps(json.loads(body), sort_keys=True, ensure_ascii=False).encode("utf-8")
+    except ValueError:
+        canonical = body
+    h = hashlib.sha256()
+    h.update(request.method.encode("ascii"))
+    h.update(request.url.path.encode("utf-8"))
+    h.update(b"\0")
+    h.update(canonical)
+    return h.hexdigest()
+
+
+def _summary(request: httpx.Request) -> Dict[str, Any]:
+    """What the fixture was recorded for (the image itself is not stored)."""
+    try:
+        body = json.loads(request.content or b"{}")
+    except ValueError:
+        return {"path": request.url.path}
+    images = [
+        part["image_url"]["url"]
+        for message in body.get("messages", []) if isinstance(message.get("content"), list)
+        for part in message["content"] if part.get("type") == "image_url"
+    ]
+    return {
+        "path": request.url.path,
+        "model": body.get("model"),
+        "image_sha256": [hashlib.sha256(url.encode("utf-8")).hexdigest()[:16] for url in images],
+        "image_chars": sum(len(url) for url in images),
+    }
+
+
+class FixtureStore:
+    """One JSON file per fingerprint; loaded fixtures are kept in memory."""
+
+    def __init__(self, root: Path):
+        self.root = Path(root)
+        self._loaded: Dict[str, Optional[Dict[str, Any]]] = {}
+        self._lock = threading.Lock()
+
+    def path(self, key: str) -> Path:
+        return self.root / key[:2] / f"{key}.json"
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            if key in self._loaded:
+                return self._loaded[key]
+        path = self.path(key)
+        fixture = json.loads(path.read_text(encoding="utf-8")) if path.exists() else None
+        with self._lock:
+            self._loaded[key] = fixture
+        return fixture
+
+    def put(self, key: str, fixture: Dict[str, Any]) -> None:
+        path = self.path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_suffix(".tmp")
+        tmp.write_text(json.dumps(fixture, ensure_ascii=False, indent=1), encoding="utf-8")
+        tmp.replace(path)
+        with self._lock:
+            self._loaded[key] = fixture
+
+    def all(self):
+        for path in sorted(self.root.glob("*/*.json")):
+            yield path, json.loads(path.read_text(encoding="utf-8"))
+
+
+class RecordingTransport(httpx.BaseTransport):
+    """Sends requests for real and stores every 200 answer."""
+
+    def __init__(self, store: FixtureStore, inner: httpx.BaseTransport):
+        self.store = store
+        self.inner = inner
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        t0 = time.perf_counter()
+        response = self.inner.handle_request(request)
+        if response.status_code != 200:
+            return response
+        content = response.read()
+        elapsed_ms = round((time.perf_counter() - t0) * 1000)
+        key = fingerprint(request)
+        try:
+            self.store.put(key, {
+                "fingerprint": key,
+                "recorded_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+                "elapsed_ms": elapsed_ms,
+                "request": _summary(request),
+                "status": response.status_code,
+                "body": json.loads(content),
+            })
+            logger.info("OpenAI fixture recorded | fingerprint=%s elapsed_ms=%s", key[:16], elapsed_ms)
+        except (OSError, ValueError) as e:
+            logger.warning("OpenAI fixture not recorded | fingerprint=%s error=%s", key[:16], e)
+        return response
+
+    def close(self) -> None:
+        self.inner.close()
+
+
+class ReplayTransport(httpx.BaseTransport):
+    """Answers from the fixture store, never touches the network."""
+
+    def __init__(self, store: FixtureStore, latency: str = "recorded", seed: Optional[int] = None):
+        self.store = store
+        self.latency = latency
+        self.random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def _delay_s(self, fixture: Dict[str, Any]) -> float:
+        if self.latency == "recorded":
+            return fixture.get("elapsed_ms", 0) / 1000
+        if ":" not in self.latency:
+            return float(self.latency or 0) / 1000
+        median, p95 = (float(v) for v in self.latency.split(":", 1))
+        sigma = math.log(p95 / median) / 1.645 if p95 > median > 0 else 0.0
+        with self._lock:
+            z = self.random.gauss(0, 1)
+        return median * math.exp(sigma * z) / 1000
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        key = fingerprint(request)
+        fixture = self.store.get(key)
+        if fixture is None:
+            logger.warning("OpenAI replay miss | fingerprint=%s", key[:16])
+            return httpx.Response(404, request=request, json={"error": {
+                "message": f"No recorded OpenAI response for fingerprint {key} in {self.store.root}",
+                "type": "replay_miss", "code": "replay_miss",
+            }})
+        time.sleep(self._delay_s(fixture))
+        return httpx.Response(fixture.get("status", 200), request=request, json=fixture["body"],
+                              headers={"x-openai-replay": key[:16]})
+
+
+def make_transport(limits: httpx.Limits) -> Optional[httpx.BaseTransport]:
+    """Transport for the shared client per DOCUMENTS_OPENAI_STANDIN (None = httpx default)."""
+    current = mode()
+    if not current:
+        return None
+    store = FixtureStore(fixtures_dir())
+    logger.info("OpenAI stand-in | mode=%s fixtures=%s", current, store.root)
+    if current == "record":
+        return RecordingTransport(store, httpx.HTTPTransport(limits=limits))
+    return ReplayTransport(store, getattr(settings, "DOCUMENTS_OPENAI_REPLAY_LATENCY", "recorded"))
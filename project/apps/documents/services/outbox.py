@@ -0,0 +1,307 @@
+"""
+Transactional outbox for Dispolive ride reports.
+
+The review view calls enqueue() inside the transaction that saves the
+reviewed parsed_data, so the DispoliveSubmission row commits (or rolls back)
+together with it and the upload goes to "submitting". Delivery runs after the
+commit:
+- "queued" mode: the background worker (tasks.submit_dispolive_reports),
+- "sync" mode: a thread of the web process sends the rows of that request
+  and retries them after their backoff, so the view returns at once either
+  way. Rows the thread leaves behind when the process stops are sent by
+  `manage.py dispolive_outbox --drain`.
+
+deliver_due() claims due rows with an atomic status update (a row is never
+sent by two workers at once), sends at most DOCUMENTS_DISPOLIVE_SUBMIT_CONCURRENCY
+in parallel and records the outcome:
+- 200 -> "sent", upload "done";
+- not sent (no connection, or an error before the request went out), 408,
+  425, 429 or 503 (Dispolive surely did not create the ride) -> retried
+  with exponential backoff + jitter;
+- 502, 504 or no answer to a sent request (read timeout) -> outcome unknown:
+  fahrberichte/add is not idempotent (Dispolive ignores Idempotency-Key), the
+  ride may exist, so the row goes to "dead" with a "check in Dispolive" error;
+- other errors, or DOCUMENTS_DISPOLIVE_SUBMIT_MAX_ATTEMPTS used up -> "dead"
+  (dead letter), upload "error"; submitting the review again re-queues it.
+A row still "sending" after CLAIM_LEASE (its worker died during the request)
+is not sent again either: outcome unknown.
+"""
+import hashlib
+import json
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Min
+from django.utils import timezone
+
+from dispolive_de.api_client import SubmitOutcomeUnknown, submit_driver_report
+
+from ..models import DispoliveSubmission, DocumentUpload
+from .dispolive_logger import get_dispolive_logger
+
+
+# A "sending" row older than this is assumed to belong to a dead worker
+CLAIM_LEASE = timedelta(minutes=5)
+# Dispolive did not process the request: safe to send again
+RETRY_STATUS = {408, 425, 429, 503}
+# A gateway answered in place of Dispolive, which may have created the ride
+UNKNOWN_STATUS = {502, 504}
+UNKNOWN_PREFIX = "Outcome unknown"
+UNKNOWN_ERROR = (UNKNOWN_PREFIX + ": Dispolive did not confirm the report ({error}); the ride may have been "
+                 "created. Check in Dispolive before submitting again.")
+
+
+def _max_attempts() -> int:
+    return getattr(settings, "DOCUMENTS_DISPOLIVE_SUBMIT_MAX_ATTEMPTS", 8)
+
+
+def _concurrency() -> int:
+    return getattr(settings, "DOCUMENTS_DISPOLIVE_SUBMIT_CONCURRENCY", 4)
+
+
+def backoff(attempts: int) -> timedelta:
+    """Delay before retry number `attempts` (1, 2, ...): base * 2^(n-1), capped, with jitter."""
+    base = getattr(settings, "DOCUMENTS_DISPOLIVE_SUBMIT_BACKOFF_BASE", 30)
+    cap = getattr(settings, "DOCUMENTS_DISPOLIVE_SUBMIT_BACKOFF_MAX", 3600)
+    delay = min(cap, base * 2 ** (attempts - 1))
+    return timedelta(seconds=delay * random.uniform(0.5, 1.0))
+
+
+def idempotency_key(upload_obj: DocumentUpload, payload: Dict[str, Any]) -> str:
+    h = hashlib.sha256()
+    h.update(str(upload_obj.pk).encode("ascii"))
+    h.update(b"\0")
+    h.update(json.dumps(payload, sort_keys=True, ensure_ascii=False, default=str).encode("utf-8"))
+    return h.hexdigest()
+
+
+def _outcome(status_code: Optional[int]) -> str:
+    """"sent", "retry", "unknown" or "failed" for the answer to a fahrberichte/add call."""
+    if status_code == 200:
+        return "sent"
+    if status_code is None or status_code in RETRY_STATUS:
+        return "retry"
+    if status_code in UNKNOWN_STATUS:
+        return "unknown"
+    return "failed"
+
+
+def enqueue(upload_obj: DocumentUpload, payload: Dict[str, Any], schedule: bool = True) -> DispoliveSubmission:
+    """
+    Add the report to the outbox and mark the upload "submitting".
+    Call inside the transaction that saves upload_obj (the caller saves it);
+    delivery is triggered on commit unless schedule=False (the caller then
+    sends it itself with deliver()).
+    """
+    submission, created = DispoliveSubmission.objects.get_or_create(
+        idempotency_key=idempotency_key(upload_obj, payload),
+        defaults={"upload": upload_obj, "payload": payload},
+    )
+    if not created and submission.status == "dead":
+        submission.status = "pending"
+        submission.attempts = 0
+        submission.next_attempt_at = timezone.now()
+        submission.last_error = ""
+        submission.save(update_fields=["status", "attempts", "next_attempt_at", "last_error"])
+
+    # An older, different payload for the same upload must not be sent after this one
+    DispoliveSubmission.objects.filter(upload=upload_obj, status="pending").exclude(pk=submission.pk).update(
+        status="dead", last_error="Superseded by a newer submission"
+    )
+
+    if submission.status == "sent":
+        # Same report was already delivered: nothing to send again
+        upload_obj.processing_status = "done"
+    else:
+        upload_obj.processing_status = "submitting"
+        if schedule:
+            transaction.on_commit(lambda: schedule_delivery([submission.pk]))
+    upload_obj.processing_error = ""
+    return submission
+
+
+def schedule_delivery(pks: Optional[List[int]] = None) -> None:
+    """
+    Queue a worker run ("queued" mode) or start a thread that sends the rows
+    among `pks` ("sync"; None: all pending rows) until none is pending.
+    Returns at once in both modes.
+    """
+    if getattr(settings, "DOCUMENTS_PROCESSING_MODE", "queued") == "queued":
+        from ..tasks import submit_dispolive_reports  # tasks imports the mixins, avoid a cycle
+
+        submit_dispolive_reports()
+    else:
+        threading.Thread(target=deliver_until_settled, args=(pks,), name="dispolive-outbox", daemon=True).start()
+
+
+def deliver_until_settled(pks: Optional[List[int]] = None) -> None:
+    """
+    Send the rows among `pks` and wait out the backoff of those still
+    pending, until every one is sent or dead ("sync" mode delivery thread).
+    """
+    pending = DispoliveSubmission.objects.filter(status="pending")
+    if pks is not None:
+        pending = pending.filter(pk__in=pks)
+    try:
+        while True:
+            deliver_due(pks=pks)
+            next_at = pending.aggregate(at=Min("next_attempt_at"))["at"]
+            if next_at is None:
+                return
+            connection.close()  # no connection held open through the backoff
+            time.sleep(max(0.0, (next_at - timezone.now()).total_seconds()))
+    except Exception:
+        get_dispolive_logger().exception("Dispolive EXCEPTION | delivery thread pks=%s", pks)
+    finally:
+        connection.close()
+
+
+def _claim(pk: int, now: datetime) -> bool:
+    return DispoliveSubmission.objects.filter(pk=pk, status="pending").update(status="sending", claimed_at=now) == 1
+
+
+def _deliver(pk: int) -> str:
+    logger = get_dispolive_logger()
+    reached = False  # Dispolive may have the report (created the ride)
+    settle_parent = False
+    try:
+        submission = DispoliveSubmission.objects.select_related("upload").get(pk=pk)
+        upload_obj = submission.upload
+        try:
+            status_code, body = submit_driver_report(submission.payload, submission.idempotency_key)
+            outcome = _outcome(status_code)
+        except SubmitOutcomeUnknown as e:
+            status_code, body, outcome = None, str(e), "unknown"
+        except Exception as e:
+            # Anything but SubmitOutcomeUnknown is raised before the request
+            # reaches the transport: nothing went out, retry like a refused connection
+            logger.exception("Dispolive NOT SENT | upload_id=%s submission_id=%s", upload_obj.pk, pk)
+            status_code, body, outcome = None, f"{type(e).__name__}: {e}", "retry"
+        reached = outcome != "retry"
+        submission.attempts += 1
+        now = timezone.now()
+
+        if outcome == "sent":
+            submission.status = "sent"
+            submission.sent_at = now
+            submission.response = body
+            submission.last_error = ""
+            upload_obj.processing_status = "done"
+            upload_obj.processing_error = ""
+            settle_parent = upload_obj.parent_id is not None
+            logger.info("Dispolive SUCCESS | upload_id=%s submission_id=%s attempt=%s", upload_obj.pk, pk, submission.attempts)
+        else:
+            error = f"HTTP {status_code}: {str(body)[:500]}" if status_code else f"No response: {body}"
+            submission.last_error = error
+            submission.response = body if isinstance(body, (dict, list)) else None
+            if outcome == "retry" and submission.attempts < _max_attempts():
+                submission.status = "pending"
+                submission.next_attempt_at = now + backoff(submission.attempts)
+                upload_obj.processing_error = (
+                    f"Dispolive not reachable ({error[:120]}), retry {submission.attempts} "
+                    f"at {timezone.localtime(submission.next_attempt_at):%H:%M}"
+                )
+                logger.warning("Dispolive RETRY | upload_id=%s submission_id=%s attempt=%s error=%s",
+                               upload_obj.pk, pk, submission.attempts, error)
+            elif outcome == "unknown":
+                submission.status = "dead"
+                submission.last_error = UNKNOWN_ERROR.format(error=error[:500])
+                upload_obj.processing_status = "error"
+                upload_obj.processing_error = UNKNOWN_ERROR.format(error=error[:200])
+                logger.error("Dispolive UNKNOWN | upload_id=%s submission_id=%s attempts=%s error=%s",
+                             upload_obj.pk, pk, submission.attempts, error)
+            else:
+                submission.status = "dead"
+                upload_obj.processing_status = "error"
+                upload_obj.processing_error = f"Dispolive API returned an error. Check required fields. ({error[:200]})"
+                logger.error("Dispolive FAILED | upload_id=%s submission_id=%s attempts=%s error=%s",
+                             upload_obj.pk, pk, submission.attempts, error)
+
+        with transaction.atomic():
+            submission.claimed_at = None
+            submission.save(update_fields=["status", "attempts", "next_attempt_at", "claimed_at",
+                                           "last_error", "response", "sent_at"])
+            upload_obj.save(update_fields=["processing_status", "processing_error"])
+            if settle_parent:
+                _settle_parent(upload_obj.parent_id)
+        return submission.status
+    except Exception:
+        logger.exception("Dispolive EXCEPTION | submission_id=%s", pk)
+        if not reached:
+            # Dispolive did not get the report: hand the row back
+            DispoliveSubmission.objects.filter(pk=pk, status="sending").update(status="pending", claimed_at=None)
+        # Otherwise the row stays "sending" and expires as outcome unknown after CLAIM_LEASE
+        return "error"
+    finally:
+        connection.close()
+
+
+def _settle_parent(parent_id: int) -> None:
+    """A multi-page PDF ("split") is "done" once every one of its pages is."""
+    DocumentUpload.objects.filter(pk=parent_id, processing_status="split").exclude(
+        pages__in=DocumentUpload.objects.filter(parent_id=parent_id).exclude(processing_status="done")
+    ).update(processing_status="done")
+
+
+def _expire_stale(now: datetime) -> int:
+    """
+    Move rows left "sending" longer than CLAIM_LEASE to "dead": the request may
+    have reached Dispolive before the worker died, so they are not sent again.
+    """
+    expired = 0
+    stale = DispoliveSubmission.objects.filter(status="sending", claimed_at__lt=now - CLAIM_LEASE)
+    for submission in stale.select_related("upload"):
+        error = UNKNOWN_ERROR.format(error="worker stopped during the request")
+        with transaction.atomic():
+            taken = DispoliveSubmission.objects.filter(
+                pk=submission.pk, status="sending", claimed_at=submission.claimed_at
+            ).update(status="dead", claimed_at=None, last_error=error)
+            if not taken:
+                continue
+            upload_obj = submission.upload
+            upload_obj.processing_status = "error"
+            upload_obj.processing_error = error
+            upload_obj.save(update_fields=["processing_status", "processing_error"])
+        get_dispolive_logger().error("Dispolive UNKNOWN | upload_id=%s submission_id=%s error=stale claim",
+                                     upload_obj.pk, submission.pk)
+        expired += 1
+    return expired
+
+
+def deliver_due(limit: int = 100, pks: Optional[List[int]] = None) -> Dict[str, int]:
+    """Send due outbox rows (only those among `pks` if given); returns {status: count} of this run."""
+    now = timezone.now()
+    counts: Dict[str, int] = {}
+    expired = _expire_stale(now)
+    if expired:
+        counts["dead"] = expired
+    due = DispoliveSubmission.objects.filter(status="pending", next_attempt_at__lte=now)
+    if pks is not None:
+        due = due.filter(pk__in=pks)
+    for status in deliver(list(due.order_by("next_attempt_at").values_list("pk", flat=True)[:limit]), now).values():
+        counts[status] = counts.get(status, 0) + 1
+    return counts
+
+
+def deliver(pks: List[int], now: Optional[datetime] = None) -> Dict[int, str]:
+    """
+    Send the given "pending" outbox rows now, at most DOCUMENTS_DISPOLIVE_SUBMIT_CONCURRENCY
+    at a time; returns {pk: status}. Rows another worker holds are left out.
+    """
+    now = now or timezone.now()
+    claimed = [pk for pk in pks if _claim(pk, now)]
+    if not claimed:
+        return {}
+    with ThreadPoolExecutor(max_workers=max(1, min(_concurrency(), len(claimed)))) as pool:
+        return dict(zip(claimed, pool.map(_deliver, claimed)))
+
+
+def next_attempt_at() -> Optional[datetime]:
+    """When the earliest pending row becomes due (None if the outbox is empty)."""
+    return DispoliveSubmission.objects.filter(status="pending").aggregate(at=Min("next_attempt_at"))["at"]
@@ -0,0 +1,156 @@
+"""
+Decoded page raster passed through the whole documents pipeline.
+
+A PageImage is created once per page (from a PyMuPDF pixmap, an encoded
+PNG/JPEG or a photo file) and keeps:
+- the pixel buffer as a NumPy array (zero-copy view of the pixmap samples),
+- the encoded bytes, produced at most once and only when needed
+  (OpenAI request). Photos/PNG renders keep their original bytes, so they
+  are never re-encoded.
+
+Crops are NumPy slices of the same buffer (no copy, no decode/encode).
+Pages rendered from an open pdf_utils.PdfDocument also get render_region:
+a box is re-rasterized from the PDF at a multiple of the page resolution
+instead of upscaling the page pixels.
+"""
+import base64
+import hashlib
+from io import BytesIO
+from typing import Callable, Optional
+
+import numpy as np
+from PIL import Image
+
+
+MIME_TYPES = {"PNG": "image/png", "JPEG": "image/jpeg"}
+
+
+class PageImage:
+
+    def __init__(self, pixels: Optional[np.ndarray] = None, encoded: Optional[bytes] = None,
+                 encoded_format: str = "PNG", owner=None):
+        if pixels is None and encoded is None:
+            raise ValueError("PageImage needs pixels or encoded bytes")
+        self._pixels = pixels
+        # Object that owns the memory behind `pixels` (e.g. a fitz.Pixmap)
+        self._owner = owner
+        self._encoded: dict[str, bytes] = {}
+        if encoded is not None:
+            self._encoded[encoded_format] = encoded
+        self.source_format = encoded_format
+        # (relative box, scale) -> PageImage of that box at scale x the resolution; None = pixels only
+        self.render_region: Optional[Callable[..., "PageImage"]] = None
+
+    # --- constructors ---
+
+    @classmethod
+    def from_pixmap(cls, pix) -> "PageImage":
+        """Wrap PyMuPDF pixmap samples without copying."""
+        arr = np.frombuffer(pix.samples_mv, dtype=np.uint8).reshape(pix.height, pix.width, pix.n)
+        if pix.n == 1:
+            arr = arr[:, :, 0]
+        return cls(pixels=arr, encoded_format="PNG", owner=pix)
+
+    @classmethod
+    def from_encoded(cls, data: bytes, pixels: Optional[np.ndarray] = None) -> "PageImage":
+        """
+        Wrap PNG/JPEG bytes; pixels are decoded lazily on first access,
+        unless already decoded ones are given (raster cache).
+        """
+        with Image.open(BytesIO(data)) as img:
+            fmt = img.format
+        if fmt in MIME_TYPES:
+            return cls(pixels=pixels, encoded=data, encoded_format=fmt)
+        # Other formats are not sent as-is: decode now, encode as JPEG at the boundary
+        return cls(pixels=pixels if pixels is not None else cls._decode(data), encoded_format="JPEG")
+
+    @classmethod
+    def from_base64(cls, img_b64: str) -> "PageImage":
+        return cls.from_encoded(base64.b64decode(img_b64))
+
+    @classmethod
+    def from_file(cls, path: str) -> "PageImage":
+        with open(path, "rb") as fh:
+            return cls.from_encoded(fh.read())
+
+    @staticmethod
+    def _decode(data: bytes) -> np.ndarray:
+        with Image.open(BytesIO(data)) as img:
+            if img.mode not in ("L", "RGB"):
+                img = img.convert("RGB")
+            return np.asarray(img)
+
+    # --- pixels ---
+
+    @property
+    def pixels(self) -> np.ndarray:
+        if self._pixels is None:
+            self._pixels = self._decode(self._encoded[self.source_format])
+        return self._pixels
+
+    @property
+    def width(self) -> int:
+        return self.pixels.shape[1]
+
+    @property
+    def height(self) -> int:
+        return self.pixels.shape[0]
+
+    @property
+    def nbytes(self) -> int:
+        """Memory held by this image: pixel buffer + encoded copies."""
+        pixel_bytes = self._pixels.nbytes if self._pixels is not None else 0
+        return pixel_bytes + sum(len(b) for b in self._encoded.values())
+
+    def box_to_pixels(self, box: tuple[float, float, float, float]) -> tuple[int, int, int, int]:
+        """Relative box (x0,y0,x1,y1) -> pixel box (left, top, right, bottom)."""
+        w, h = self.width, self.height
+        x0, y0, x1, y1 = box
+        return (
+            max(0, int(w * x0)),
+            max(0, int(h * y0)),
+            min(w, int(w * x1)),
+            min(h, int(h * y1)),
+        )
+
+    def crop(self, box: tuple[float, float, float, float]) -> np.ndarray:
+        """Zero-copy view of a relative box (x0,y0,x1,y1)."""
+        left, top, right, bottom = self.box_to_pixels(box)
+        return self.pixels[top:bottom, left:right]
+
+    def to_pil(self, box: Optional[tuple[float, float, float, float]] = None) -> Image.Image:
+        """PIL copy of the page (or of a relative box) for PIL-based processing."""
+        arr = self.crop(box) if box else self.pixels
+        return Image.fromarray(np.ascontiguousarray(arr))
+
+    # --- encoding (OpenAI boundary) ---
+
+    def encode(self, fmt: Optional[str] = None) -> bytes:
+        """Encoded bytes in `fmt` (default: source format). Encoded once, then reused."""
+        fmt = fmt or self.source_format
+        if fmt not in self._encoded:
+            if fmt == "PNG" and self._owner is not None and hasattr(self._owner, "tobytes"):
+                self._encoded[fmt] = self._owner.tobytes("png")
+            else:
+                buffered = BytesIO()
+                self.to_pil().save(buffered, format=fmt)
+                self._encoded[fmt] = buffered.getvalue()
+        return self._encoded[fmt]
+
+    def to_base64(self, fmt: Optional[str] = None) -> str:
+        return base64.b64encode(self.encode(fmt)).decode("ascii")
+
+    def to_data_url(self, fmt: Optional[str] = None) -> str:
+        fmt = fmt or self.source_format
+        return f"data:{MIME_TYPES[fmt]};base64,{self.to_base64(fmt)}"
+
+    def digest(self) -> str:
+        """
+        sha256 of the pixel buffer with its shape and dtype; the extraction
+        cache key. Hashing pixels needs no encode (a full-page PNG encode costs
+        hundreds of ms), and a fresh render and a raster cache hit get the same key.
+        """
+        pixels = np.ascontiguousarray(self.pixels)
+        h = hashlib.sha256(f"{pixels.shape} {pixels.dtype}".encode("ascii"))
+        h.update(pixels)
+        return h.hexdigest()
@@ -0,0 +1,68 @@
+"""
+Dispolive payload built once and stored on the upload.
+
+build_payload() does live Dispolive lookups (Verordnungsart, institution),
+so it runs right after extraction (in the worker) and the result is stored in
+DocumentUpload.dispolive_payload together with a hash of its inputs, the
+fields listed in PAYLOAD_INPUT_FIELDS. The review page reads the stored
+payload; it is only rebuilt when the reviewer changes one of those fields.
+The ride date is not an input: it falls back to "today", so a payload
+reused on a later day only gets its "date" reset (payload_date, no lookups).
+A payload with a lookup missing (missing_lookups: Dispolive slow, down or
+without an answer) is stored without the hash, so the next call, at the
+latest the submit, builds it again.
+"""
+import hashlib
+import json
+import logging
+from typing import Any, Dict, Optional
+
+from dispolive_de.parser_new import PAYLOAD_INPUT_FIELDS, build_payload, missing_lookups, payload_date
+
+from ..models import DocumentUpload
+
+
+logger = logging.getLogger(__name__)
+
+
+def _norm(value: Any) -> Any:
+    # build_payload only looks at truthiness / stripped text, so None, "" and False
+    # (GPT output vs. review form) are the same input
+    if not value:
+        return ""
+    return value.strip() if isinstance(value, str) else value
+
+
+def payload_input_hash(parsed_data: Optional[Dict[str, Any]]) -> str:
+    parsed_data = parsed_data if isinstance(parsed_data, dict) else {}
+    data = parsed_data.get("data") if isinstance(parsed_data.get("data"), dict) else {}
+    inputs = {
+        "fields": {name: _norm(data.get(name)) for name in PAYLOAD_INPUT_FIELDS},
+        "versichertennr": _norm(parsed_data.get("Versichertennr.")),
+    }
+    return hashlib.sha256(json.dumps(inputs, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+def ensure_payload(upload_obj: DocumentUpload, parsed_data: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """
+    Return the Dispolive payload for `parsed_data` (default: upload_obj.parsed_data),
+    reusing upload_obj.dispolive_payload while its input hash matches (with
+    today's ride date if the stored one is from an earlier day) and it is complete.
+    Sets dispolive_payload / dispolive_payload_hash on the object; the caller saves.
+    Exceptions from build_payload propagate.
+    """
+    parsed_data = upload_obj.parsed_data if parsed_data is None else parsed_data
+    input_hash = payload_input_hash(parsed_data)
+    if upload_obj.dispolive_payload and upload_obj.dispolive_payload_hash == input_hash:
+        ride_date = payload_date(parsed_data or {})
+        if upload_obj.dispolive_payload.get("date") != ride_date:
+            upload_obj.dispolive_payload = {**upload_obj.dispolive_payload, "date": ride_date}
+        return upload_obj.dispolive_payload
+
+    logger.info("Building Dispolive payload | upload_id=%s", upload_obj.pk)
+    upload_obj.dispolive_payload = build_payload(parsed_data or {})
+    missing = missing_lookups(upload_obj.dispolive_payload)
+    if missing:
+        logger.warning("Dispolive payload incomplete, not reused | upload_id=%s missing=%s", upload_obj.pk, missing)
+    upload_obj.dispolive_payload_hash = "" if missing else input_hash
+    return upload_obj.dispolive_payload
@@ -1,7 +1,231 @@
+import atexit
 import base64
-import io
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from typing import Iterator, Optional
 import fitz  # PyMuPDF
 
+from . import raster_cache
+from .page_image import PageImage
+
+
+# PyMuPDF is not thread-safe, not even across different documents (one global
+# MuPDF context): every fitz call of this process runs under this lock. Worker
+# threads of parallel uploads wait for each other; whole pages of a multi-page
+# PDF render in worker processes (iter_pdf_pages), which have their own.
+_fitz_lock = threading.RLock()
+
+_render_pool: Optional[ProcessPoolExecutor] = None
+_render_pool_lock = threading.Lock()
+
+
+def pdf_page_count(pdf_path: str) -> int:
+    """Return the number of pages in a PDF."""
+    with _fitz_lock, fitz.open(pdf_path) as doc:
+        return len(doc)
+
+
+def _page_pixmap(doc: "fitz.Document", page_number: int, dpi: int, clip: "fitz.Rect | None" = None) -> "fitz.Pixmap":
+    if page_number < 1 or page_number > len(doc):
+        raise RuntimeError(f"Page {page_number} does not exist. PDF has {len(doc)} pages.")
+
+    page = doc[page_number - 1]  # PyMuPDF uses 0-indexed pages
+
+    # Calculate zoom factor for desired DPI (default PDF is 72 DPI)
+    zoom = dpi / 72
+    mat = fitz.Matrix(zoom, zoom)
+
+    if clip is not None:
+        # Relative box -> page points (page.rect is already rotated, as is the render)
+        r = page.rect
+        x0, y0, x1, y1 = clip
+        clip = fitz.Rect(r.x0 + x0 * r.width, r.y0 + y0 * r.height, r.x0 + x1 * r.width, r.y0 + y1 * r.height)
+
+    # Render page (or only the clipped region) to pixmap
+    return page.get_pixmap(matrix=mat, clip=clip)
+
+
+def _render_page_pixmap(pdf_path: str, page_number: int, dpi: int) -> "fitz.Pixmap":
+    with _fitz_lock, fitz.open(pdf_path) as doc:
+        return _page_pixmap(doc, page_number, dpi)
+
+
+class PdfDocument:
+    """
+    One open PDF shared by the full-page render and any number of region
+    renders of the same upload.
+
+    render_region() rasterizes only the box (clip rectangle), so a field crop
+    at a high DPI costs its own pixels instead of a whole page at that DPI.
+    PyMuPDF is not thread-safe: all calls go through the process-wide
+    _fitz_lock (the regions are small, the OCR pool threads rarely wait).
+
+    Full pages go through the raster cache (services/raster_cache.py): a page
+    rendered before at the same DPI is memory-mapped from disk, not rendered.
+    """
+
+    def __init__(self, pdf_path: str):
+        self.path = pdf_path
+        with _fitz_lock:
+            self._doc = fitz.open(pdf_path)
+        self._digest: Optional[str] = None
+
+    def __len__(self) -> int:
+        return len(self._doc)
+
+    def __enter__(self) -> "PdfDocument":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def close(self) -> None:
+        with _fitz_lock:
+            self._doc.close()
+
+    def cache_key(self, page_number: int, dpi: int) -> Optional[str]:
+        """Raster cache key of a page (file content hash, page, DPI); None when the cache is off."""
+        if not raster_cache.enabled():
+            return None
+        if self._digest is None:
+            self._digest = raster_cache.file_digest(self.path)
+        return raster_cache.make_key(self._digest, page_number, dpi)
+
+    def cached(self, page_number: int, dpi: int = 250) -> Optional[PageImage]:
+        """The page from the raster cache, or None."""
+        key = self.cache_key(page_number, dpi)
+        page = raster_cache.load(key) if key else None
+        return self.adopt(page, page_number, dpi) if page is not None else None
+
+    def adopt(self, page: PageImage, page_number: int, dpi: int, store: bool = False) -> PageImage:
+        """Attach render_region for this page (and store a fresh render in the raster cache)."""
+        if store:
+            key = self.cache_key(page_number, dpi)
+            if key:
+                raster_cache.store(key, page)
+        page.render_region = lambda box, scale=1: self.render_region(page_number, box, dpi * scale)
+        return page
+
+    def render(self, page_number: int = 1, dpi: int = 250) -> PageImage:
+        """
+        Full page as a PageImage. Its render_region re-renders boxes of this
+        page from the PDF at a multiple of dpi (while the document is open).
+        """
+        page = self.cached(page_number, dpi)
+        if page is not None:
+            return page
+        with _fitz_lock:
+            page = PageImage.from_pixmap(_page_pixmap(self._doc, page_number, dpi))
+        return self.adopt(page, page_number, dpi, store=True)
+
+    def text_spans(self, page_number: int) -> list[dict]:
+        """
+        Embedded text of a page: [{"text", "box": relative (x0,y0,x1,y1)}] per
+        non-blank span, in content order. Empty for scans without a text layer.
+        """
+        with _fitz_lock:
+            page = self._doc[page_number - 1]
+            r = page.rect
+            blocks = page.get_text("dict", flags=fitz.TEXTFLAGS_TEXT)["blocks"]
+        spans = []
+        for block in blocks:
+            for line in block.get("lines", []):
+                for span in line["spans"]:
+                    text = span["text"].strip()
+                    if not text:
+                        continue
+                    x0, y0, x1, y1 = span["bbox"]
+                    spans.append({"text": text, "box": (
+                        (x0 - r.x0) / r.width, (y0 - r.y0) / r.height, (x1 - r.x0) / r.width, (y1 - r.y0) / r.height,
+                    )})
+        return spans
+
+    def page_pdf(self, page_number: int) -> bytes:
+        """The page as a PDF file of its own (the file of a multi-page child upload)."""
+        with _fitz_lock, fitz.open() as single:
+            single.insert_pdf(self._doc, from_page=page_number - 1, to_page=page_number - 1)
+            return single.tobytes(garbage=3, deflate=True)
+
+    def image_coverage(self, page_number: int) -> float:
+        """Share of the page covered by its largest image (about 1.0 for a scan)."""
+        with _fitz_lock:
+            page = self._doc[page_number - 1]
+            rect = page.rect
+            images = page.get_image_info()
+        area = abs(rect) or 1.0
+        return max((abs(fitz.Rect(info["bbox"]) & rect) / area for info in images), default=0.0)
+
+    def render_region(self, page_number: int, box: tuple[float, float, float, float], dpi: int) -> PageImage:
+        """Relative box (x0,y0,x1,y1) of a page, rasterized alone at dpi."""
+        with _fitz_lock:
+            return PageImage.from_pixmap(_page_pixmap(self._doc, page_number, dpi, clip=box))
+
+
+def pdf_page_to_image(pdf_path: str, page_number: int = 1, dpi: int = 250) -> PageImage:
+    """
+    Render a PDF page into a PageImage (pixels shared with the pixmap, no encoding).
+    
+    Args:
+        pdf_path: Path to the PDF file
+        page_number: Page number (1-indexed)
+        dpi: Resolution for rendering
+    """
+    with _fitz_lock:
+        return PageImage.from_pixmap(_render_page_pixmap(pdf_path, page_number, dpi))
+
+
+def pdf_page_to_png_bytes(pdf_path: str, page_number: int = 1, dpi: int = 250) -> bytes:
+    """Render a PDF page to PNG bytes (compact form for passing between processes)."""
+    with _fitz_lock:
+        return _render_page_pixmap(pdf_path, page_number, dpi).tobytes("png")
+
+
+def _render_page_png(pdf_path: str, page_number: int, dpi: int, cache_paths: Optional[tuple] = None) -> bytes:
+    """Process-pool worker: PNG bytes of a page, also written to the raster cache files if given."""
+    pix = _render_page_pixmap(pdf_path, page_number, dpi)
+    png = pix.tobytes("png")
+    if cache_paths is not None:
+        try:
+            raster_cache.write_entry(*cache_paths, PageImage.from_pixmap(pix).pixels, png)
+        except OSError:
+            pass  # the parent falls back to decoding the PNG
+    return png
+
+
+def _pool(max_workers: int) -> ProcessPoolExecutor:
+    """
+    The render process pool of this process, started on first use and shared
+    by all uploads (at most max_workers of the first caller). Workers come
+    from a forkserver (spawn where there is none), not from fork(): a fork of
+    this multithreaded process could inherit a lock another thread holds
+    (logging, the DB driver, _fitz_lock) and wait on it forever.
+    """
+    global _render_pool
+    with _render_pool_lock:
+        if _render_pool is None:
+            if "forkserver" in multiprocessing.get_all_start_methods():
+                context = multiprocessing.get_context("forkserver")
+                # Imported once in the server, so the forked workers start ready
+                context.set_forkserver_preload([__name__])
+            else:
+                context = multiprocessing.get_context("spawn")
+            _render_pool = ProcessPoolExecutor(max_workers=max_workers, mp_context=context)
+            # Stop the workers and release the pool's semaphores before the
+            # interpreter exits (else resource_tracker reports them as leaked)
+            atexit.register(_render_pool.shutdown, wait=True, cancel_futures=True)
+        return _render_pool
+
+
+def _discard_pool(pool: ProcessPoolExecutor) -> None:
+    """Drop a broken pool (a worker died) so the next call starts a new one."""
+    global _render_pool
+    with _render_pool_lock:
+        if _render_pool is pool:
+            _render_pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
 
 def pdf_page_to_base64_png(pdf_path: str, page_number: int = 1, dpi: int = 250) -> str:
     """
@@ -15,51 +239,74 @@ def pdf_page_to_base64_png(pdf_path: str, page_number: int = 1, dpi: int = 250)
     Returns:
         Base64-encoded PNG string
     """
-    doc = fitz.open(pdf_path)
-    
-    if page_number < 1 or page_number > len(doc):
-        raise RuntimeError(f"Page {page_number} does not exist. PDF has {len(doc)} pages.")
-    
-    page = doc[page_number - 1]  # PyMuPDF uses 0-indexed pages
-    
-    # Calculate zoom factor for desired DPI (default PDF is 72 DPI)
-    zoom = dpi / 72
-    mat = fitz.Matrix(zoom, zoom)
-    
-    # Render page to pixmap
-    pix = page.get_pixmap(matrix=mat)
-    
-    # Convert to PNG bytes
-    png_bytes = pix.tobytes("png")
-    
-    doc.close()
-    
-    return base64.b64encode(png_bytes).decode("utf-8")
+    return base64.b64encode(pdf_page_to_png_bytes(pdf_path, page_number, dpi)).decode("utf-8")
 
-from PIL import Image
 
+def iter_pdf_pages(pdf_path: str, page_numbers: list[int], dpi: int = 250, max_workers: int = 4,
+                   doc: PdfDocument | None = None) -> Iterator[tuple[int, PageImage]]:
+    """
+    Render several PDF pages in the process-wide render pool (_pool).
 
-def pdf_page_crop_to_base64_png(pdf_path: str, page_number: int, dpi: int, box: tuple[float, float, float, float]) -> str:
-    # Render a PDF page at higher DPI and crop by relative box (x0,y0,x1,y1).
-    doc = fitz.open(pdf_path)
-    if page_number < 1 or page_number > len(doc):
-        raise RuntimeError(f"Page {page_number} does not exist. PDF has {len(doc)} pages.")
+    PyMuPDF is not thread-safe, so pages are rendered in worker processes.
+    Workers return PNG bytes (a fraction of the raw pixel size); the PNG is
+    what gets sent to OpenAI, pixels are decoded only if a stage needs them.
+    Yields (page_number, PageImage) as soon as each page is ready,
+    i.e. NOT in page order.
 
-    page = doc[page_number - 1]
-    zoom = dpi / 72
-    mat = fitz.Matrix(zoom, zoom)
-    pix = page.get_pixmap(matrix=mat)
-    img = Image.frombytes("RGB", [pix.width, pix.height], pix.samples)
-    doc.close()
-
-    w, h = img.size
-    x0, y0, x1, y1 = box
-    left = max(0, int(w * x0))
-    top = max(0, int(h * y0))
-    right = min(w, int(w * x1))
-    bottom = min(h, int(h * y1))
-    cropped = img.crop((left, top, right, bottom))
-
-    buffered = io.BytesIO()
-    cropped.save(buffered, format="PNG")
-    return base64.b64encode(buffered.getvalue()).decode("utf-8")
+    With an open doc, pages in the raster cache are yielded first without
+    rendering, fresh renders are stored there, and the pages get
+    render_region from it (region renders happen in this process, on the
+    shared document).
+    """
+    if doc is not None:
+        pending = []
+        for n in page_numbers:
+            page = doc.cached(n, dpi)
+            if page is None:
+                pending.append(n)
+            else:
+                yield n, page
+        page_numbers = pending
+
+    if len(page_numbers) <= 1 or max_workers <= 1:
+        for n in page_numbers:
+            yield n, doc.render(n, dpi) if doc is not None else pdf_page_to_image(pdf_path, page_number=n, dpi=dpi)
+        return
+
+    keys = {n: doc.cache_key(n, dpi) if doc is not None else None for n in page_numbers}
+    pool = _pool(max_workers)
+    futures = {}
+    try:
+        futures = {
+            pool.submit(_render_page_png, pdf_path, n, dpi, raster_cache.paths(keys[n]) if keys[n] else None): n
+            for n in page_numbers
+        }
+        for fut in as_completed(futures):
+            n = futures[fut]
+            png = fut.result()
+            # The worker wrote the raster cache entry: map its pixels instead of decoding the PNG
+            page = (raster_cache.load(keys[n], encoded=png) if keys[n] else None) or PageImage.from_encoded(png)
+            yield n, doc.adopt(page, n, dpi) if doc is not None else page
+    except BrokenProcessPool:
+        _discard_pool(pool)
+        raise
+    finally:
+        # The consumer stopped early (error): do not render the rest
+        for fut in futures:
+            fut.cancel()
+    if any(keys.values()):
+        raster_cache.evict()
+
+
+def pdf_page_crop_to_base64_png(pdf_path: str, page_number: int, dpi: int, box: tuple[float, float, float, float],
+                                doc: PdfDocument | None = None) -> str:
+    """
+    Render a relative box (x0,y0,x1,y1) of a PDF page at dpi, as base64 PNG.
+
+    Only the box is rasterized (clip rectangle). Pass an open PdfDocument to
+    render several crops (or a crop and the full page) without reopening the file.
+    """
+    if doc is not None:
+        return doc.render_region(page_number, box, dpi).to_base64("PNG")
+    with PdfDocument(pdf_path) as own:
+        return own.render_region(page_number, box, dpi).to_base64("PNG")
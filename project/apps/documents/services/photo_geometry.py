@@ -0,0 +1,227 @@
+"""
+Page boundary, perspective and orientation of phone photos.
+
+normalize() turns a photo into an upright image of the sheet:
+1. Sheet: on a grayscale copy reduced to about WORK_SIZE px the paper is
+   separated from a darker background (Otsu threshold, BLOCK px blocks);
+   background = the non-paper blocks connected to the photo border. The sheet
+   corners are the paper pixels furthest towards each corner of the photo.
+   Photos whose sheet fills the frame (scanner apps crop them already) keep
+   their frame.
+2. Perspective: the sheet quadrilateral is warped to an upright rectangle with
+   the ISO 216 ratio of A4/A5 sheets (Muster 4 is A5), at most MAX_SIDE px
+   long and never enlarged - table top, fingers and background are gone.
+3. Orientation: the ink of the sheet, on an 8 x 6 grid over its ink bounds,
+   is correlated with MUSTER4_INK_GRID (the average upright Muster 4 scan) in
+   all four 90 degree turns; the best turn wins when it beats the current one by
+   ROTATE_MARGIN (upside down and sideways photos).
+
+The result is a new PageImage (JPEG); a photo that needs none of this is
+returned as it is, so its bytes (and extraction cache key) do not change.
+Field boxes are placed relative to the registered form (checkboxes.frame_box),
+which holds for normalized photos as for PDF renders.
+"""
+import time
+from typing import Any, Dict, Optional
+
+import numpy as np
+from PIL import Image
+
+from .page_image import PageImage
+
+
+WORK_SIZE = 512          # px of the longer side analysed
+BLOCK = 8                # px, paper / background grid on the work copy
+MAX_SIDE = 1600          # px, longer side of the normalized image
+ISO_RATIO = 2 ** 0.5     # long / short side of A4 and A5 sheets
+FILLS_FRAME = 0.92       # sheet share of the photo from which the frame is kept
+MIN_SHEET = 0.2          # smaller "sheets" are not trusted
+MIN_QUAD_FILL = 0.85     # sheet blocks inside the corner quadrilateral (else not a sheet)
+ROTATE_MARGIN = 0.05     # correlation a turn must gain over the current orientation
+MIN_MATCH = 0.2          # below this the page does not look like Muster 4: no turn
+
+# Ink share (%) of an upright Muster 4 per cell of an 8 x 6 grid over its ink
+# bounds, rows top to bottom; average of the sample scans (uploads/pdfs).
+MUSTER4_INK_GRID = np.array([
+    [2.55, 1.42, 0.70, 1.18, 2.65, 1.55],
+    [2.58, 2.12, 1.37, 1.38, 1.30, 1.30],
+    [2.83, 3.23, 1.35, 1.33, 2.27, 1.37],
+    [2.79, 3.26, 2.21, 1.62, 2.24, 1.85],
+    [2.28, 2.68, 2.46, 2.09, 1.79, 1.42],
+    [2.50, 2.27, 1.29, 1.72, 3.63, 3.54],
+    [2.19, 2.16, 1.56, 1.65, 3.14, 2.20],
+    [2.59, 2.74, 1.82, 1.38, 2.59, 1.90],
+])
+
+
+def _gray(img: Image.Image) -> np.ndarray:
+    return np.asarray(img.convert("L"), dtype=np.float32)
+
+
+def _otsu(gray: np.ndarray) -> float:
+    hist = np.bincount(gray.astype(np.uint8).ravel(), minlength=256).astype(np.float64)
+    levels = np.arange(256)
+    w0 = np.cumsum(hist)
+    m0 = np.cumsum(hist * levels)
+    w1 = w0[-1] - w0
+    between = (m0[-1] * w0 - m0 * w0[-1]) ** 2 / np.maximum(w0 * w1, 1)
+    return float(np.argmax(between[:-1]))
+
+
+def _dilate(mask: np.ndarray) -> np.ndarray:
+    out = mask.copy()
+    out[1:] |= mask[:-1]
+    out[:-1] |= mask[1:]
+    out[:, 1:] |= mask[:, :-1]
+    out[:, :-1] |= mask[:, 1:]
+    return out
+
+
+def find_sheet(gray: np.ndarray) -> Optional[np.ndarray]:
+    """
+    Corners of the sheet (top-left, top-right, bottom-right, bottom-left; x, y
+    in `gray` px) or None when the sheet fills the frame or is not found.
+    """
+    h, w = (gray.shape[0] // BLOCK) * BLOCK, (gray.shape[1] // BLOCK) * BLOCK
+    bright = gray[:h, :w] > _otsu(gray)
+    paper = bright.reshape(h // BLOCK, BLOCK, w // BLOCK, BLOCK).mean(axis=(1, 3)) >= 0.5
+
+    edge = np.zeros_like(paper)
+    edge[[0, -1], :] = edge[:, [0, -1]] = True
+    background = edge & ~paper
+    while True:
+        grown = _dilate(background) & ~paper
+        if (grown == background).all():
+            break
+        background = grown
+    sheet = ~background
+    share = float(sheet.mean())
+    if share >= FILLS_FRAME or share < MIN_SHEET:
+        return None
+
+    mask = np.repeat(np.repeat(sheet, BLOCK, axis=0), BLOCK, axis=1) & bright
+    ys, xs = np.nonzero(mask)
+    s, d = xs + ys, xs - ys
+    quad = np.array([
+        (xs[s.argmin()], ys[s.argmin()]), (xs[d.argmax()], ys[d.argmax()]),
+        (xs[s.argmax()], ys[s.argmax()]), (xs[d.argmin()], ys[d.argmin()]),
+    ], dtype=np.float64)
+    # Shoelace area: a sheet fills its corner quadrilateral (a hand or a second page does not)
+    x, y = quad[:, 0], quad[:, 1]
+    area = 0.5 * abs(float(x @ np.roll(y, -1) - y @ np.roll(x, -1)))
+    if area <= 0 or sheet.sum() * BLOCK * BLOCK < MIN_QUAD_FILL * area:
+        return None
+    return quad
+
+
+def _perspective_coeffs(dst: np.ndarray, src: np.ndarray) -> tuple:
+    """PIL PERSPECTIVE coefficients mapping `dst` (output) corners onto `src` (input) corners."""
+    rows, rhs = [], []
+    for (x, y), (u, v) in zip(dst, src):
+        rows.append([x, y, 1, 0, 0, 0, -u * x, -u * y])
+        rows.append([0, 0, 0, x, y, 1, -v * x, -v * y])
+        rhs.extend([u, v])
+    return tuple(np.linalg.solve(np.array(rows), np.array(rhs)))
+
+
+def _sides(quad: np.ndarray) -> tuple[float, float]:
+    """Mean width and height of a corner quadrilateral."""
+    width = (np.linalg.norm(quad[1] - quad[0]) + np.linalg.norm(quad[2] - quad[3])) / 2
+    height = (np.linalg.norm(quad[3] - quad[0]) + np.linalg.norm(quad[2] - quad[1])) / 2
+    return float(width), float(height)
+
+
+def _warp(img: Image.Image, quad: np.ndarray, max_side: int, turns: int = 0) -> Image.Image:
+    """
+    The quadrilateral as an ISO-ratio rectangle (at most max_side px long),
+    turned by `turns` quarter turns counter-clockwise - one resampling pass.
+    """
+    width, height = _sides(quad)
+    long_side = round(min(max_side, max(width, height)))
+    short_side = round(long_side / ISO_RATIO)
+    w, h = (long_side, short_side) if width > height else (short_side, long_side)
+    dst = [(0, 0), (w, 0), (w, h), (0, h)]
+    for _ in range(turns):
+        dst = [(y, w - x) for x, y in dst]
+        w, h = h, w
+    return img.transform((w, h), Image.PERSPECTIVE, _perspective_coeffs(np.array(dst, dtype=np.float64), quad),
+                         Image.BILINEAR)
+
+
+def ink_grid(gray: np.ndarray) -> np.ndarray:
+    """Ink share per cell of an 8 x 6 grid over the ink bounds (ink: darker than the local paper)."""
+    img = Image.fromarray(gray.astype(np.uint8))
+    paper = np.asarray(img.reduce(16).resize(img.size, Image.BILINEAR), dtype=np.float32)
+    ink = gray < 0.75 * np.maximum(paper, float(gray.mean()))
+    ys, xs = np.nonzero(ink)
+    if len(ys) < 100:
+        return np.zeros(MUSTER4_INK_GRID.shape)
+    y0, y1 = np.percentile(ys, [1, 99]).astype(int)
+    x0, x1 = np.percentile(xs, [1, 99]).astype(int)
+    ink = ink[y0:y1 + 1, x0:x1 + 1].astype(np.float32)
+    rows, cols = MUSTER4_INK_GRID.shape
+    cells = np.add.reduceat(ink, np.linspace(0, ink.shape[0], rows, endpoint=False).astype(int), axis=0)
+    cells = np.add.reduceat(cells, np.linspace(0, ink.shape[1], cols, endpoint=False).astype(int), axis=1)
+    return 100 * cells / max(1.0, float(cells.sum()))
+
+
+def _match(gray: np.ndarray) -> float:
+    a = ink_grid(gray).ravel()
+    b = MUSTER4_INK_GRID.ravel()
+    a, b = a - a.mean(), b - b.mean()
+    return float(a @ b / max(1e-9, np.sqrt((a @ a) * (b @ b))))
+
+
+def orientation(gray: np.ndarray) -> tuple[int, float]:
+    """
+    Counter-clockwise quarter turns (0..3) that make the page upright, and the
+    match of the chosen orientation with MUSTER4_INK_GRID (-1..1).
+    """
+    matches = [_match(np.rot90(gray, k)) for k in range(4)]
+    best = int(np.argmax(matches))
+    if matches[best] < MIN_MATCH or matches[best] < matches[0] + ROTATE_MARGIN:
+        return 0, round(matches[0], 3)
+    return best, round(matches[best], 3)
+
+
+def _work_copy(img: Image.Image) -> tuple[np.ndarray, int]:
+    factor = max(1, max(img.size) // WORK_SIZE)
+    return _gray(img.reduce(factor) if factor > 1 else img), factor
+
+
+def normalize(page: PageImage) -> tuple[PageImage, Dict[str, Any]]:
+    """
+    Upright, cropped and rectified photo of the sheet, and what was done:
+    {"sheet": corners in photo px or None, "rotation": degrees counter-clockwise,
+     "match": ..., "size": [w, h], "ms": ...}.
+    """
+    t0 = time.perf_counter()
+    img = page.to_pil()
+    gray, factor = _work_copy(img)
+    quad = find_sheet(gray)
+    if quad is not None:
+        sheet_gray = _warp(Image.fromarray(gray.astype(np.uint8)), quad, WORK_SIZE)
+        turns, match = orientation(np.asarray(sheet_gray, dtype=np.float32))
+        quad = quad * factor
+        # Box-reduce first, so the warp itself hardly scales (no aliasing, fewer source pixels)
+        step = max(1, int(max(_sides(quad)) // MAX_SIDE))
+        img = _warp(img.reduce(step) if step > 1 else img, quad / step, MAX_SIDE, turns)
+    else:
+        turns, match = orientation(gray)
+        if turns:
+            img = img.transpose((Image.ROTATE_90, Image.ROTATE_180, Image.ROTATE_270)[turns - 1])
+        if max(img.size) > MAX_SIDE:
+            scale = MAX_SIDE / max(img.size)
+            img = img.resize((round(img.width * scale), round(img.height * scale)), Image.LANCZOS)
+    changed = quad is not None or turns or img.size != (page.width, page.height)
+
+    info = {
+        "sheet": quad.round().astype(int).tolist() if quad is not None else None,
+        "rotation": 90 * turns,
+        "match": match,
+        "size": list(img.size),
+        "ms": round((time.perf_counter() - t0) * 1000, 1),
+    }
+    if not changed:
+        return page, info
+    return PageImage(pixels=np.asarray(img), encoded_format="JPEG"), info
@@ -0,0 +1,127 @@
+"""
+Pre-flight quality check of phone photos, before the GPT call.
+
+Blurry, dark, glare-covered or far-away photos come back from GPT as mostly
+empty fields after the full wait. analyze() measures a grayscale copy reduced
+to about WORK_SIZE px (about 10 ms for a 2000 px photo):
+- sharpness: variance of the 4-neighbour Laplacian (text edges);
+- brightness: median of the paper blocks (0..255);
+- glare: share of the paper covered by saturated blocks clearly brighter than
+  the paper around them (a white page from a scanner app is not glare);
+- coverage: share of the frame taken by paper-bright blocks.
+The page is split into BLOCK x BLOCK blocks; the paper level comes from the
+brightest blocks (PAPER_PERCENTILE), so a dark desk around the page does not
+count as paper even when the page fills a small part of the frame.
+
+DEFAULT_THRESHOLDS are calibrated on the sample captures (media/document_photos)
+degraded step by step until the small print (Versicherten-Nr.) was no longer
+legible; `manage.py photo_quality --calibrate` repeats the run:
+- blur: sharp captures score 4200-7800; Gaussian blur 2 px still reads at
+  114-218, 2.5 px misreads "Z" as "2" at 45-85 -> min_sharpness 100;
+- dark (exposure x0.25 / x0.18 with sensor noise): 59-60 reads, 42-44 does
+  not -> min_brightness 50;
+- glare (blown-out hotspot on an exposed page): 2 % of the page scores
+  0.024-0.027 and costs a few words, 5 % scores 0.071-0.078 and hides whole
+  fields; the page on a dark desk alone scores up to 0.044 -> max_glare 0.05;
+- far (page scaled into a desk photo): 0.45 of the frame width scores
+  0.20-0.21 and reads, 0.3 scores 0.08-0.09 and the labels blur -> min_coverage 0.15.
+Known limit: scanner-app captures clip the paper to white (up to a third of
+the blocks at 255), so a reflection on them is as bright as the paper and
+scores no glare; only reflections on a normally exposed page are caught.
+
+problems() compares the metrics with the DOCUMENTS_PHOTO_* thresholds. The
+processing pipeline stores the metrics in processing_metrics["photo_quality"]
+for every photo (rejected or not); `manage.py photo_quality` sets them against
+the extraction outcome to tune the thresholds.
+"""
+import time
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+from django.conf import settings
+from PIL import Image
+
+from .page_image import PageImage
+
+
+WORK_SIZE = 800      # px of the longer side analysed
+BLOCK = 32           # px, block grid for paper / glare / coverage
+SATURATED = 250
+GLARE_MARGIN = 20    # a glare block is this much brighter than the paper level
+PAPER_PERCENTILE = 95  # block brightness taken as the paper reference (the page may fill only 5 % of the frame)
+
+DEFAULT_THRESHOLDS = {
+    "min_sharpness": 100.0,
+    "min_brightness": 50.0,
+    "max_glare": 0.05,
+    "min_coverage": 0.15,
+}
+
+RETAKE_MESSAGES = {
+    "blurry": "the photo is blurry",
+    "dark": "the photo is too dark",
+    "glare": "light reflections cover part of the form",
+    "small": "the form fills too little of the photo",
+}
+
+
+def enabled() -> bool:
+    return getattr(settings, "DOCUMENTS_PHOTO_QUALITY_GATE", True)
+
+
+def thresholds() -> Dict[str, float]:
+    """DEFAULT_THRESHOLDS overridden by DOCUMENTS_PHOTO_MIN_SHARPNESS etc."""
+    return {name: getattr(settings, f"DOCUMENTS_PHOTO_{name.upper()}", default)
+            for name, default in DEFAULT_THRESHOLDS.items()}
+
+
+def _reduced_gray(page: PageImage) -> np.ndarray:
+    img = Image.fromarray(np.ascontiguousarray(page.pixels))
+    factor = max(1, max(img.size) // WORK_SIZE)
+    if factor > 1:
+        img = img.reduce(factor)
+    return np.asarray(img.convert("L"), dtype=np.float32)
+
+
+def analyze(page: PageImage) -> Dict[str, Any]:
+    t0 = time.perf_counter()
+    gray = _reduced_gray(page)
+
+    lap = (gray[:-2, 1:-1] + gray[2:, 1:-1] + gray[1:-1, :-2] + gray[1:-1, 2:]) - 4 * gray[1:-1, 1:-1]
+
+    h, w = (gray.shape[0] // BLOCK) * BLOCK, (gray.shape[1] // BLOCK) * BLOCK
+    if not h or not w:
+        return {"sharpness": 0.0, "brightness": 0.0, "glare": 0.0, "coverage": 0.0, "ms": 0}
+    blocks = gray[:h, :w].reshape(h // BLOCK, BLOCK, w // BLOCK, BLOCK)
+    block_mean = blocks.mean(axis=(1, 3))
+    block_saturated = (blocks >= SATURATED).mean(axis=(1, 3))
+    paper = block_mean >= 0.6 * float(np.percentile(block_mean, PAPER_PERCENTILE))
+    level = float(np.median(block_mean[paper]))
+    glare = (block_saturated >= 0.9) & (block_mean >= level + GLARE_MARGIN) & paper
+
+    return {
+        "sharpness": round(float(lap.var()), 1),
+        "brightness": round(level, 1),
+        "glare": round(float(glare.sum() / max(1, paper.sum())), 3),
+        "coverage": round(float(paper.mean()), 3),
+        "ms": round((time.perf_counter() - t0) * 1000, 1),
+    }
+
+
+def problems(metrics: Dict[str, Any], limits: Optional[Dict[str, float]] = None) -> List[str]:
+    """Keys of RETAKE_MESSAGES the metrics fail (empty = good enough)."""
+    limits = limits or thresholds()
+    found = []
+    if metrics["sharpness"] < limits["min_sharpness"]:
+        found.append("blurry")
+    if metrics["brightness"] < limits["min_brightness"]:
+        found.append("dark")
+    if metrics["glare"] > limits["max_glare"]:
+        found.append("glare")
+    if metrics["coverage"] < limits["min_coverage"]:
+        found.append("small")
+    return found
+
+
+def retake_message(found: List[str]) -> str:
+    return "Please retake the photo: " + ", ".join(RETAKE_MESSAGES[p] for p in found) + "."
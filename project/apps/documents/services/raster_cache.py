@@ -0,0 +1,157 @@
+"""
+On-disk cache of decoded page rasters.
+
+Key = sha256(file content hash + page number + DPI), so re-processing an
+upload, or uploading the same scan/photo again, finds the page that was
+rendered (PDF) or decoded (photo) before. An entry is two files under
+DOCUMENTS_RASTER_CACHE_DIR:
+- <key>.npy: the pixels (grayscale or RGB uint8), opened memory-mapped, so a
+  hit costs neither rendering nor decoding and only the pages of the file that
+  a stage touches are read from disk;
+- <key>.png: the PNG of a PDF render, so a hit that needs the encoded page
+  (e.g. for OpenAI) does not encode it again. Photos keep their original file
+  bytes and need no copy.
+
+The whole directory is capped at DOCUMENTS_RASTER_CACHE_MAX_MB and trimmed
+least-recently-used first (a hit refreshes the files' mtime); 0 = off.
+"""
+import hashlib
+import logging
+import os
+import threading
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+from django.conf import settings
+
+from .page_image import PageImage
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_MB = 2048
+PHOTO = 0  # page / DPI of a photo entry
+
+_evict_lock = threading.Lock()
+
+
+def _max_bytes() -> int:
+    return getattr(settings, "DOCUMENTS_RASTER_CACHE_MAX_MB", DEFAULT_MAX_MB) * 1024 * 1024
+
+
+def enabled() -> bool:
+    return _max_bytes() > 0
+
+
+def cache_dir() -> Path:
+    return Path(getattr(settings, "DOCUMENTS_RASTER_CACHE_DIR", Path(settings.MEDIA_ROOT) / "raster_cache"))
+
+
+def file_digest(path: str) -> str:
+    """sha256 of a file's content (read in chunks)."""
+    h = hashlib.sha256()
+    with open(path, "rb") as fh:
+        for chunk in iter(lambda: fh.read(1024 * 1024), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def make_key(digest: str, page_number: int, dpi: int) -> str:
+    return hashlib.sha256(f"{digest}|{page_number}|{dpi}".encode("ascii")).hexdigest()
+
+
+def paths(key: str) -> tuple[Path, Path]:
+    """(pixels .npy, PNG) files of an entry."""
+    base = cache_dir() / key[:2]
+    return base / f"{key}.npy", base / f"{key}.png"
+
+
+def load(key: str, encoded: Optional[bytes] = None) -> Optional[PageImage]:
+    """
+    Cached page, pixels memory-mapped. `encoded` are the source bytes (photos);
+    without them the stored PNG is used. None on a miss.
+    """
+    if not enabled():
+        return None
+    pixels_path, png_path = paths(key)
+    try:
+        pixels = np.load(pixels_path, mmap_mode="r")
+        if encoded is None:
+            encoded = png_path.read_bytes()
+            os.utime(png_path)
+        os.utime(pixels_path)
+    except (OSError, ValueError):
+        return None
+    logger.info("Raster cache HIT | key=%s", key[:12])
+    return PageImage.from_encoded(encoded, pixels=pixels)
+
+
+def write_entry(pixels_path: Path, png_path: Optional[Path], pixels: np.ndarray, png: Optional[bytes]) -> None:
+    """
+    Write an entry's files (atomically, via a temp file each). Needs no
+    settings, so the PDF render worker processes call it directly.
+    """
+    pixels_path.parent.mkdir(parents=True, exist_ok=True)
+    if png_path is not None and png is not None:
+        tmp = png_path.with_name(f"{png_path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        tmp.write_bytes(png)
+        tmp.replace(png_path)
+    tmp = pixels_path.with_name(f"{pixels_path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    with open(tmp, "wb") as fh:
+        np.save(fh, np.ascontiguousarray(pixels), allow_pickle=False)
+    tmp.replace(pixels_path)
+
+
+def store(key: str, page: PageImage, with_png: bool = True) -> None:
+    """Write the page's pixels (and its PNG) for later load(); errors are logged, not raised."""
+    if not enabled():
+        return
+    pixels_path, png_path = paths(key)
+    try:
+        write_entry(pixels_path, png_path if with_png else None, page.pixels, page.encode("PNG") if with_png else None)
+    except OSError as e:
+        logger.warning("Raster cache store failed | key=%s error=%s", key[:12], e)
+        return
+    evict()
+
+
+def evict() -> int:
+    """Trim the cache directory to the size cap (LRU by mtime). Returns the number of entries dropped."""
+    root = cache_dir()
+    with _evict_lock:
+        entries = {}
+        for path in root.glob("*/*.*"):
+            try:
+                stat = path.stat()
+            except OSError:
+                continue
+            key = path.name.split(".", 1)[0]
+            size, mtime = entries.get(key, (0, 0.0))
+            entries[key] = (size + stat.st_size, max(mtime, stat.st_mtime))
+        total = sum(size for size, _ in entries.values())
+        dropped = 0
+        for key, (size, _) in sorted(entries.items(), key=lambda kv: kv[1][1]):
+            if total <= _max_bytes():
+                break
+            for path in root.glob(f"{key[:2]}/{key}.*"):
+                path.unlink(missing_ok=True)
+            total -= size
+            dropped += 1
+    if dropped:
+        logger.info("Raster cache evicted | entries=%s", dropped)
+    return dropped
+
+
+def load_photo(path: str) -> PageImage:
+    """Photo as a PageImage: original bytes plus pixels from the cache (decoded and stored on a miss)."""
+    with open(path, "rb") as fh:
+        data = fh.read()
+    if not enabled():
+        return PageImage.from_encoded(data)
+    key = make_key(hashlib.sha256(data).hexdigest(), PHOTO, PHOTO)
+    page = load(key, encoded=data)
+    if page is None:
+        page = PageImage.from_encoded(data)
+        store(key, page, with_png=False)
+    return page
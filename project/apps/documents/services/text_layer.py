@@ -0,0 +1,75 @@
+"""
+Text-layer fast path for digitally generated PDFs.
+
+Prescriptions printed to PDF by practice software carry their text as a real
+text layer. For such pages the positioned spans are sent to GPT as text
+(gpt_client.parse_text_layer_to_new_parser) instead of the page image: no
+image tokens, no vision pass, and every printed digit is exact.
+
+A page qualifies when its text layer has at least
+DOCUMENTS_PDF_TEXT_LAYER_MIN_CHARS characters and no image covers more than
+SCAN_COVERAGE of it. Scans (also "searchable" scans with an invisible OCR
+layer on top of the page image) keep the vision path: their text layer is only
+as good as the scanner's OCR.
+
+page_layout() renders the spans as lines top to bottom, each span prefixed with
+its left edge, so GPT can tell the columns of the form apart:
+    y=0.172 | x=0.046 109519005 | x=0.229 A123456789 | x=0.452 5000000
+"""
+import logging
+from typing import Any, Dict, List, Optional
+
+from django.conf import settings
+
+from .pdf_utils import PdfDocument
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MIN_CHARS = 200
+SCAN_COVERAGE = 0.5      # an image over this share of the page means "scan"
+LINE_TOLERANCE = 0.006   # spans whose vertical centers are closer are one line (page fraction)
+
+
+def _enabled() -> bool:
+    return getattr(settings, "DOCUMENTS_PDF_TEXT_LAYER", True)
+
+
+def _lines(spans: List[Dict[str, Any]]) -> List[List[Dict[str, Any]]]:
+    """Group spans into lines by vertical center, top to bottom, each line left to right."""
+    lines: List[List[Dict[str, Any]]] = []
+    for span in sorted(spans, key=lambda s: (s["box"][1] + s["box"][3]) / 2):
+        center = (span["box"][1] + span["box"][3]) / 2
+        if lines and abs(center - lines[-1][0]["center"]) <= LINE_TOLERANCE:
+            lines[-1].append({**span, "center": lines[-1][0]["center"]})
+        else:
+            lines.append([{**span, "center": center}])
+    return [sorted(line, key=lambda s: s["box"][0]) for line in lines]
+
+
+def format_layout(spans: List[Dict[str, Any]]) -> str:
+    return "\n".join(
+        f"y={line[0]['center']:.3f} | " + " | ".join(f"x={s['box'][0]:.3f} {s['text']}" for s in line)
+        for line in _lines(spans)
+    )
+
+
+def page_layout(pdf: PdfDocument, page_number: int) -> Optional[str]:
+    """Positioned text of a page for the text-only request, or None (use vision)."""
+    if not _enabled():
+        return None
+    try:
+        spans = pdf.text_spans(page_number)
+        chars = sum(len(s["text"]) for s in spans)
+        if chars < getattr(settings, "DOCUMENTS_PDF_TEXT_LAYER_MIN_CHARS", DEFAULT_MIN_CHARS):
+            return None
+        coverage = pdf.image_coverage(page_number)
+    except Exception:
+        logger.exception("Text layer check failed, using the page image | page=%s", page_number)
+        return None
+    if coverage > SCAN_COVERAGE:
+        logger.info("Text layer ignored (scanned page) | page=%s chars=%s image_coverage=%.2f",
+                    page_number, chars, coverage)
+        return None
+    logger.info("Text layer used | page=%s spans=%s chars=%s", page_number, len(spans), chars)
+    return format_layout(spans)
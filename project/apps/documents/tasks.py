@@ -0,0 +1,69 @@
+"""
+Background tasks for document processing.
+Executed by the django-background-tasks worker: python manage.py process_tasks
+
+process_document_upload never raises: a parsing error is stored on the
+upload, and a retry would only parse (and pay for) the same file again.
+submit_dispolive_reports keeps the library's retries, e.g. when the DB is
+briefly unreachable.
+"""
+import logging
+
+from background_task import background
+from background_task.models import Task
+
+from .models import DocumentUpload
+from .mixins import DocumentProcessingMixin
+from .services import outbox
+
+
+logger = logging.getLogger(__name__)
+
+DOCUMENTS_QUEUE = "documents"
+DISPOLIVE_QUEUE = "dispolive"
+
+
+@background(schedule=0, queue=DOCUMENTS_QUEUE)
+def process_document_upload(upload_id: int, file_path: str, is_photo: bool = False) -> None:
+    """Render, OCR and parse a queued upload ("uploaded" -> "processing" -> result)."""
+    upload_obj = DocumentUpload.objects.filter(pk=upload_id).first()
+    if upload_obj is None:
+        # Upload was removed (e.g. history cleared) before the worker got to it
+        logger.info("Skip processing: upload_id=%s no longer exists", upload_id)
+        return
+
+    upload_obj.processing_status = "processing"
+    upload_obj.processing_error = ""
+    upload_obj.save(update_fields=["processing_status", "processing_error"])
+
+    try:
+        success, error = DocumentProcessingMixin().process_and_parse_document(
+            upload_obj=upload_obj,
+            file_path=file_path,
+            is_photo=is_photo,
+        )
+    except Exception as e:
+        logger.exception("Processing crashed | upload_id=%s", upload_id)
+        upload_obj.processing_status = "error"
+        upload_obj.processing_error = str(e)
+        upload_obj.save(update_fields=["processing_status", "processing_error"])
+        return
+    if not success:
+        logger.error("Processing failed | upload_id=%s error=%s", upload_id, error)
+
+
+@background(schedule=0, queue=DISPOLIVE_QUEUE)
+def submit_dispolive_reports() -> None:
+    """Deliver due Dispolive outbox rows, then schedule the run for the next retry."""
+    counts = outbox.deliver_due()
+    if counts:
+        logger.info("Dispolive outbox run | %s", " ".join(f"{k}={v}" for k, v in counts.items()))
+
+    next_at = outbox.next_attempt_at()
+    if next_at is None:
+        return
+    already_scheduled = Task.objects.filter(
+        task_name=submit_dispolive_reports.name, run_at__lte=next_at, locked_by__isnull=True
+    ).exists()
+    if not already_scheduled:
+        submit_dispolive_reports(schedule=next_at)
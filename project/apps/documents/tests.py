@@ -1,3 +1,471 @@
-from django.test import TestCase
+import logging
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import timedelta
+from pathlib import Path
+from unittest import mock
 
-# Create your tests here.
+import numpy as np
+import requests
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from dispolive_de import api_client, parser_new
+from dispolive_de.api_client import SubmitOutcomeUnknown
+from dispolive_de.parser_new import payload_date
+
+from .management.commands import bench_numeric_enhance as reference
+from .mixins import DocumentProcessingMixin
+from .models import DispoliveSubmission, DocumentUpload, ExtractionCacheEntry
+from .services import bulk_submit, checkboxes, extraction_cache, outbox, payload_preview
+from .services.page_image import PageImage
+
+
+PARSED = {
+    "data": {
+        "patient_last_name": "Jung",
+        "patient_first_name": "Helmut",
+        "patient_street": "Moritzstr. 4",
+        "patient_zip": "10969",
+        "patient_city": "Berlin",
+        "arzt_nr": "047333001",
+        "prescription_date": "09.02.26",
+        "transport_outbound": True,
+        "transport_return": False,
+    },
+    "flags": [{"code": "SOME_WARNING", "severity": "warning", "field": "patient_zip"}],
+}
+
+
+def _upload(**kwargs) -> DocumentUpload:
+    return DocumentUpload.objects.create(file="uploads/pdfs/test.pdf", **kwargs)
+
+
+def _quiet_dispolive_log(test) -> None:
+    """Keep the Dispolive file logger (logs/dispolive.log) out of test runs."""
+    logger = logging.getLogger("documents.dispolive")
+    test.enterContext(mock.patch.object(logger, "handlers", [logging.NullHandler()]))
+    test.enterContext(mock.patch.object(logger, "propagate", False))
+
+
+# Rows are sent on worker threads with their own DB connections: no wrapping transaction
+@override_settings(DOCUMENTS_DISPOLIVE_SUBMIT_CONCURRENCY=1, DOCUMENTS_PROCESSING_MODE="sync")
+class OutboxTests(TransactionTestCase):
+    def setUp(self):
+        _quiet_dispolive_log(self)
+        self.upload = _upload(processing_status="submitting")
+
+    def _submission(self, key="k1", **kwargs) -> DispoliveSubmission:
+        return DispoliveSubmission.objects.create(upload=self.upload, payload={"date": "2026-02-09"},
+                                                  idempotency_key=key, **kwargs)
+
+    def _send(self, submission, result=None, error=None):
+        with mock.patch.object(outbox, "submit_driver_report", return_value=result, side_effect=error) as send:
+            statuses = outbox.deliver([submission.pk])
+        submission.refresh_from_db()
+        self.upload.refresh_from_db()
+        return statuses, send
+
+    def test_200_is_sent(self):
+        submission = self._submission()
+        statuses, _ = self._send(submission, (200, {"id": 7}))
+        self.assertEqual(statuses, {submission.pk: "sent"})
+        self.assertEqual(submission.status, "sent")
+        self.assertEqual(submission.attempts, 1)
+        self.assertIsNotNone(submission.sent_at)
+        self.assertEqual(self.upload.processing_status, "done")
+
+    def test_not_reached_is_retried_later(self):
+        for status_code in (None, 503, 429):
+            with self.subTest(status_code=status_code):
+                submission = self._submission(key=f"k{status_code}")
+                self._send(submission, (status_code, "busy"))
+                self.assertEqual(submission.status, "pending")
+                self.assertEqual(submission.attempts, 1)
+                self.assertGreater(submission.next_attempt_at, timezone.now())
+                self.assertIsNone(submission.claimed_at)
+                self.assertEqual(self.upload.processing_status, "submitting")
+
+    def test_retries_end_in_dead_letter(self):
+        submission = self._submission()
+        with override_settings(DOCUMENTS_DISPOLIVE_SUBMIT_MAX_ATTEMPTS=1):
+            self._send(submission, (503, "busy"))
+        self.assertEqual(submission.status, "dead")
+        self.assertEqual(self.upload.processing_status, "error")
+
+    def test_unknown_outcome_is_not_resent(self):
+        cases = [((502, "Bad Gateway"), None), ((504, "Gateway Timeout"), None),
+                 (None, SubmitOutcomeUnknown("read timeout"))]
+        for n, (result, error) in enumerate(cases):
+            with self.subTest(result=result, error=error):
+                submission = self._submission(key=f"u{n}")
+                self._send(submission, result, error)
+                self.assertEqual(submission.status, "dead")
+                self.assertTrue(submission.last_error.startswith(outbox.UNKNOWN_PREFIX))
+                self.assertEqual(self.upload.processing_status, "error")
+                self.assertTrue(self.upload.processing_error.startswith(outbox.UNKNOWN_PREFIX))
+
+    def test_rejected_report_is_dead(self):
+        submission = self._submission()
+        self._send(submission, (500, {"error": "arzt_nr"}))
+        self.assertEqual(submission.status, "dead")
+        self.assertFalse(submission.last_error.startswith(outbox.UNKNOWN_PREFIX))
+        self.assertEqual(self.upload.processing_status, "error")
+
+    def test_claimed_row_is_not_sent_twice(self):
+        submission = self._submission(status="sending", claimed_at=timezone.now())
+        statuses, send = self._send(submission, (200, {}))
+        self.assertEqual(statuses, {})
+        send.assert_not_called()
+        self.assertEqual(submission.status, "sending")
+
+    def test_stale_claim_expires_as_unknown(self):
+        submission = self._submission(status="sending",
+                                      claimed_at=timezone.now() - outbox.CLAIM_LEASE - timedelta(minutes=1))
+        with mock.patch.object(outbox, "submit_driver_report") as send:
+            self.assertEqual(outbox.deliver_due(), {"dead": 1})
+        send.assert_not_called()
+        submission.refresh_from_db()
+        self.assertEqual(submission.status, "dead")
+        self.assertTrue(submission.last_error.startswith(outbox.UNKNOWN_PREFIX))
+
+    def test_error_before_sending_is_retried_not_expired(self):
+        submission = self._submission()
+        self._send(submission, error=TypeError("Object of type Decimal is not JSON serializable"))
+        self.assertEqual(submission.status, "pending")
+        self.assertEqual(submission.attempts, 1)
+        self.assertIsNone(submission.claimed_at)
+        self.assertIn("TypeError", submission.last_error)
+
+    def test_sync_delivery_runs_outside_the_request(self):
+        with mock.patch.object(outbox.threading, "Thread") as thread:
+            outbox.schedule_delivery([1, 2])
+        thread.assert_called_once_with(target=outbox.deliver_until_settled, args=([1, 2],),
+                                       name="dispolive-outbox", daemon=True)
+        thread.return_value.start.assert_called_once()
+
+    def test_delivery_thread_sends_only_the_given_rows(self):
+        mine, other = self._submission(key="mine"), self._submission(key="other")
+        with mock.patch.object(outbox, "submit_driver_report", return_value=(200, {})) as send:
+            outbox.deliver_until_settled([mine.pk])
+        self.assertEqual(send.call_count, 1)
+        self.assertEqual(DispoliveSubmission.objects.get(pk=mine.pk).status, "sent")
+        self.assertEqual(DispoliveSubmission.objects.get(pk=other.pk).status, "pending")
+
+    def test_delivery_thread_retries_after_the_backoff(self):
+        submission = self._submission()
+        with mock.patch.object(outbox, "submit_driver_report", side_effect=[(503, "busy"), (None, "refused"), (200, {})]) as send, \
+                mock.patch.object(outbox, "backoff", return_value=timedelta(milliseconds=50)):
+            outbox.deliver_until_settled([submission.pk])
+        self.assertEqual(send.call_count, 3)
+        submission.refresh_from_db()
+        self.assertEqual((submission.status, submission.attempts), ("sent", 3))
+
+    def test_split_parent_is_done_once_all_pages_are_sent(self):
+        parent = _upload(processing_status="split")
+        pages = [_upload(processing_status="submitting", parent=parent, page_number=n) for n in (1, 2)]
+        for n, page in enumerate(pages):
+            self.upload = page
+            self._send(self._submission(key=f"page{n}"), (200, {}))
+            parent.refresh_from_db()
+            self.assertEqual(parent.processing_status, "done" if page is pages[-1] else "split")
+
+    def test_enqueue_sends_on_commit_and_supersedes_older_payloads(self):
+        from django.db import transaction
+
+        older = self._submission(key="older")
+        with mock.patch.object(outbox, "submit_driver_report", return_value=(200, {})) as send, \
+                mock.patch.object(outbox, "schedule_delivery", side_effect=outbox.deliver_until_settled):
+            with transaction.atomic():
+                submission = outbox.enqueue(self.upload, {"date": "2026-02-10"})
+                self.upload.save()
+                send.assert_not_called()
+        self.assertEqual(send.call_count, 1)
+        self.assertEqual(DispoliveSubmission.objects.get(pk=submission.pk).status, "sent")
+        older.refresh_from_db()
+        self.assertEqual(older.status, "dead")
+
+
+class SubmitClientTests(SimpleTestCase):
+    """What the Dispolive client reports as not sent (safe to retry) vs. outcome unknown."""
+
+    def _submit(self, error):
+        with mock.patch.object(api_client, "_request", side_effect=error):
+            return api_client.submit_driver_report({"date": "2026-02-09"})
+
+    def test_not_sent(self):
+        for error in (requests.exceptions.ConnectTimeout("connect"), requests.exceptions.InvalidJSONError("NaN"),
+                      requests.exceptions.InvalidURL("url")):
+            with self.subTest(error=error):
+                self.assertEqual(self._submit(error)[0], None)
+
+    def test_sent_without_answer_is_unknown(self):
+        for error in (requests.exceptions.ReadTimeout("read"), requests.exceptions.ConnectionError("reset")):
+            with self.subTest(error=error), self.assertRaises(SubmitOutcomeUnknown):
+                self._submit(error)
+
+
+class ExtractionCacheTests(TestCase):
+    def test_miss_then_hit(self):
+        extract = mock.Mock(return_value={"data": {"arzt_nr": "047333001"}})
+        key = extraction_cache.make_cache_key("digest", "v1")
+        self.assertEqual(extraction_cache.get_or_extract(key, "v1", extract), (extract.return_value, "miss"))
+        self.assertEqual(extraction_cache.get_or_extract(key, "v1", extract), (extract.return_value, "hit"))
+        extract.assert_called_once()
+        self.assertEqual(ExtractionCacheEntry.objects.get(key=key).hits, 1)
+
+    def test_key_covers_version_and_extra(self):
+        key = extraction_cache.make_cache_key("digest", "v1")
+        self.assertNotEqual(key, extraction_cache.make_cache_key("digest", "v2"))
+        self.assertNotEqual(key, extraction_cache.make_cache_key("digest", "v1", extra="hints"))
+        self.assertNotEqual(key, extraction_cache.make_cache_key("other", "v1"))
+
+    @override_settings(DOCUMENTS_EXTRACTION_CACHE_TTL=60)
+    def test_expired_entry_is_extracted_again_with_a_new_ttl(self):
+        key = extraction_cache.make_cache_key("digest", "v1")
+        extract = mock.Mock(return_value={"data": {}})
+        extraction_cache.get_or_extract(key, "v1", extract)
+        ExtractionCacheEntry.objects.filter(key=key).update(created_at=timezone.now() - timedelta(minutes=5))
+        self.assertEqual(extraction_cache.get_or_extract(key, "v1", extract)[1], "miss")
+        self.assertEqual(extraction_cache.get_or_extract(key, "v1", extract)[1], "hit")
+        self.assertEqual(extract.call_count, 2)
+
+    @override_settings(DOCUMENTS_EXTRACTION_CACHE_ENABLED=False)
+    def test_disabled_cache_is_bypassed(self):
+        extract = mock.Mock(return_value={"data": {}})
+        key = extraction_cache.make_cache_key("digest", "v1")
+        self.assertEqual(extraction_cache.get_or_extract(key, "v1", extract)[1], "bypass")
+        self.assertFalse(ExtractionCacheEntry.objects.exists())
+
+    def test_concurrent_requests_share_one_extraction(self):
+        key = extraction_cache.make_cache_key("digest", "v1")
+        release = threading.Event()
+        calls = []
+
+        def extract():
+            calls.append(1)
+            release.wait(5)
+            return {"data": {"arzt_nr": "047333001"}}
+
+        def log(msg, *args):
+            # The second request joined the in-flight call: let the first one finish
+            if msg.startswith("Extraction cache SHARED"):
+                release.set()
+
+        # The DB side is covered above; the threads here only meet in memory
+        with mock.patch.object(extraction_cache, "_lookup", return_value=None), \
+                mock.patch.object(extraction_cache, "_store"), \
+                mock.patch.object(extraction_cache.logger, "info", side_effect=log), \
+                ThreadPoolExecutor(max_workers=2) as pool:
+            leader = pool.submit(extraction_cache.get_or_extract, key, "v1", extract)
+            while not calls:
+                threading.Event().wait(0.01)
+            follower = pool.submit(extraction_cache.get_or_extract, key, "v1", extract)
+            results = [leader.result(5), follower.result(5)]
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual([status for _, status in results], ["miss", "shared"])
+        self.assertEqual(results[0][0], results[1][0])
+        self.assertIsNot(results[0][0], results[1][0])
+        self.assertNotIn(key, extraction_cache._inflight)
+
+
+class PayloadPreviewTests(SimpleTestCase):
+    def setUp(self):
+        self.upload = DocumentUpload(parsed_data=PARSED)
+        build = self.enterContext(mock.patch.object(payload_preview, "build_payload"))
+        build.side_effect = lambda parsed: {"date": payload_date(parsed), "patient": parsed["data"]["patient_last_name"],
+                                            "auftraggeberId": "inst-1", "verordnungsartId": ""}
+        self.build = build
+
+    def test_stored_payload_is_reused(self):
+        first = payload_preview.ensure_payload(self.upload)
+        self.assertEqual(payload_preview.ensure_payload(self.upload), first)
+        self.build.assert_called_once()
+        self.assertEqual(self.upload.dispolive_payload_hash, payload_preview.payload_input_hash(PARSED))
+
+    def test_next_day_only_moves_the_ride_date(self):
+        payload_preview.ensure_payload(self.upload)
+        self.upload.dispolive_payload = {**self.upload.dispolive_payload, "date": "2026-02-09"}
+        payload = payload_preview.ensure_payload(self.upload)
+        self.build.assert_called_once()
+        self.assertEqual(payload["date"], payload_date(PARSED))
+
+    def test_changed_input_field_rebuilds(self):
+        payload_preview.ensure_payload(self.upload)
+        edited = {**PARSED, "data": {**PARSED["data"], "patient_last_name": "Jungmann"}}
+        self.assertEqual(payload_preview.ensure_payload(self.upload, edited)["patient"], "Jungmann")
+        self.assertEqual(self.build.call_count, 2)
+
+    def test_payload_with_a_missed_lookup_is_rebuilt(self):
+        self.build.side_effect = parser_new.build_payload
+        ktw = {**PARSED, "data": {**PARSED["data"], "transport_ktw": True}}
+        self.upload.parsed_data = ktw
+        found = Future()
+        found.set_result({"_id": "va-1", "name": "KTW"})
+        self.enterContext(mock.patch.object(parser_new, "LOOKUP_DEADLINE", 0.05))
+        self.enterContext(mock.patch.object(parser_new, "get_or_create_institution", return_value={"_id": "inst-1"}))
+        # First build: the Verordnungsart lookup misses the deadline; second one answers
+        self.enterContext(mock.patch.object(parser_new, "get_verordnungsart_by_name_async", side_effect=[Future(), found]))
+
+        first = payload_preview.ensure_payload(self.upload)
+        self.assertIsNone(first["verordnungsartId"])
+        self.assertEqual(self.upload.dispolive_payload_hash, "")
+
+        second = payload_preview.ensure_payload(self.upload)
+        self.assertEqual(second["verordnungsartId"], {"_id": "va-1", "name": "KTW"})
+        self.assertEqual(second["auftraggeberId"], "inst-1")
+        self.assertEqual(self.upload.dispolive_payload_hash, payload_preview.payload_input_hash(ktw))
+        self.assertIs(payload_preview.ensure_payload(self.upload), second)
+        self.assertEqual(self.build.call_count, 2)
+
+    def test_hash_ignores_fields_the_payload_does_not_use(self):
+        base = payload_preview.payload_input_hash(PARSED)
+        for same in ({"arzt_nr": "999999999"}, {"treatment_until": None}, {"transport_return": None},
+                     {"patient_city": " Berlin "}):
+            with self.subTest(change=same):
+                self.assertEqual(payload_preview.payload_input_hash({**PARSED, "data": {**PARSED["data"], **same}}), base)
+        for changed in ({"transport_return": True}, {"patient_zip": "10967"}):
+            with self.subTest(change=changed):
+                self.assertNotEqual(
+                    payload_preview.payload_input_hash({**PARSED, "data": {**PARSED["data"], **changed}}), base)
+
+
+class BulkSubmitValidationTests(SimpleTestCase):
+    def test_unchanged_review_form_data(self):
+        data, errors = bulk_submit._reviewed_data(PARSED)
+        self.assertEqual(errors, "")
+        self.assertEqual(data["data"]["patient_last_name"], "Jung")
+        self.assertEqual(data["data"]["arzt_nr"], "047333001")
+        self.assertIs(data["data"]["transport_outbound"], True)
+        self.assertIs(data["data"]["transport_return"], False)
+        self.assertEqual(data["flags"], PARSED["flags"])
+
+    def test_form_errors_skip_the_upload(self):
+        parsed = {**PARSED, "data": {**PARSED["data"], "patient_last_name": ""}}
+        data, errors = bulk_submit._reviewed_data(parsed)
+        self.assertIsNone(data)
+        self.assertIn("Patient surname", errors)
+
+    def test_ocr_mismatch_skips_the_upload(self):
+        parsed = {**PARSED, "flags": [{"code": "OCR_MISMATCH", "severity": "warning", "field": "arzt_nr"}]}
+        data, errors = bulk_submit._reviewed_data(parsed)
+        self.assertIsNone(data)
+        self.assertIn("Printed number differs from OCR", errors)
+
+
+@override_settings(DOCUMENTS_DISPOLIVE_SUBMIT_CONCURRENCY=1)
+class BulkSubmitTests(TransactionTestCase):
+    def setUp(self):
+        _quiet_dispolive_log(self)
+        self.enterContext(mock.patch.object(payload_preview, "build_payload",
+                                            return_value={"date": "2026-02-09", "auftraggeberId": "inst-1"}))
+        self.send = self.enterContext(mock.patch.object(outbox, "submit_driver_report", return_value=(200, {})))
+
+    def test_only_valid_pending_uploads_are_sent(self):
+        good = _upload(processing_status="pending_review", parsed_data=PARSED)
+        invalid = _upload(processing_status="pending_review",
+                          parsed_data={**PARSED, "data": {**PARSED["data"], "patient_first_name": ""}})
+        done = _upload(processing_status="done", parsed_data=PARSED)
+
+        results = {r["upload"].pk: r for r in bulk_submit.submit_uploads([good, invalid, done])}
+
+        self.assertEqual(results[good.pk]["result"], "sent")
+        self.assertEqual(results[invalid.pk]["result"], "skipped")
+        self.assertIn("Patient first name", results[invalid.pk]["message"])
+        self.assertEqual(results[done.pk]["result"], "skipped")
+        self.send.assert_called_once()
+        good.refresh_from_db()
+        self.assertEqual(good.processing_status, "done")
+        self.assertEqual(good.parsed_data, bulk_submit._reviewed_data(PARSED)[0])
+
+
+    def test_multi_page_parent_is_not_bulk_submitted(self):
+        user = get_user_model().objects.create_user("driver", password="x")
+        # A parent from before the "split" status still says pending_review
+        parent = _upload(user=user, processing_status="pending_review")
+        page = _upload(user=user, processing_status="pending_review", parsed_data=PARSED, parent=parent, page_number=1)
+        self.client.force_login(user)
+
+        with mock.patch("apps.documents.views.submit_uploads", return_value=[]) as submit:
+            self.client.post(reverse("documents:bulk_submit"), {"upload_ids": [parent.pk, page.pk]})
+
+        self.assertEqual(submit.call_args.args[0], [page])
+
+
+class NumericEnhanceTests(SimpleTestCase):
+    """The vectorized image helpers against the per-pixel reference (bench_numeric_enhance)."""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        mixin = DocumentProcessingMixin()
+        fixtures = reference.Command()._fixtures(Path(settings.BASE_DIR) / "media", 3)
+        cls.crops = [(name, mixin._crop_region(page, mixin._arzt_box(page), scale=5).convert("L"))
+                     for name, page in fixtures]
+        # Ruled crop: a full-height and a full-width line the line removal must find
+        ruled = np.random.default_rng(0).integers(150, 256, (120, 400)).astype(np.uint8)
+        ruled[:, 37] = ruled[90, :] = 10
+        ruled[30:60, 200:210] = 40
+        cls.crops.append(("ruled", reference.Image.fromarray(ruled)))
+
+    def test_fixtures_found(self):
+        self.assertGreaterEqual(len(self.crops), 5)
+
+    def test_outputs_are_pixel_identical(self):
+        mixin = DocumentProcessingMixin()
+        cases = {
+            "remove_vertical_lines": (reference._legacy_remove_vertical_lines, mixin._remove_vertical_lines),
+            "remove_horizontal_lines": (reference._legacy_remove_horizontal_lines, mixin._remove_horizontal_lines),
+            "enhance_numeric": (reference._legacy_enhance_numeric, mixin._enhance_numeric),
+        }
+        for name, crop in self.crops:
+            for case, (legacy, vectorized) in cases.items():
+                with self.subTest(fixture=name, case=case):
+                    np.testing.assert_array_equal(np.asarray(vectorized(crop)), np.asarray(legacy(crop)))
+
+    def test_trip_direction_hints_match(self):
+        mixin = DocumentProcessingMixin()
+        for name, crop in self.crops:
+            mid = crop.width // 2
+            with self.subTest(fixture=name):
+                self.assertEqual(mixin._trip_direction_hints(crop), {
+                    "outbound": reference._legacy_mark(crop.crop((0, 0, mid, crop.height))),
+                    "return": reference._legacy_mark(crop.crop((mid, 0, crop.width, crop.height))),
+                })
+
+
+class CheckboxDetectionTests(SimpleTestCase):
+    def _hints(self, checked):
+        return {f: {"checked": f in checked, "confidence": 0.95} for f in checkboxes.MUSTER4_CHECKBOXES}
+
+    def test_dark_blob_is_not_a_form(self):
+        pixels = np.full((2000, 1400, 3), 255, dtype=np.uint8)
+        pixels[300:1700, 200:1200] = 20
+        page = PageImage(pixels=pixels)
+        hints = checkboxes.detect_checkboxes(page, checkboxes.register_form(page))
+        self.assertEqual({v["confidence"] for v in hints.values()}, {0.0})
+        # A frame with as much ink inside as on its sides is no frame
+        self.assertEqual(checkboxes._confidence(coverage=1.0, fill=0.9, checked=True), 0.0)
+
+    def test_two_transport_types_are_not_believed(self):
+        hints = checkboxes._plausible(self._hints({"transport_outbound", "transport_taxi", "transport_ktw"}))
+        for field in checkboxes.EXCLUSIVE_GROUPS[0]:
+            self.assertEqual(hints[field]["confidence"], 0.0)
+        self.assertEqual(hints["transport_outbound"]["confidence"], 0.95)
+        self.assertEqual(hints["equipment_lying"]["confidence"], 0.95)
+
+    def test_mostly_checked_form_is_not_believed(self):
+        fields = list(checkboxes.MUSTER4_CHECKBOXES)
+        hints = checkboxes._plausible(self._hints(set(fields[:len(fields) // 2 + 1])))
+        self.assertEqual({v["confidence"] for v in hints.values()}, {0.0})
+
+    def test_register_and_detect_share_the_mask(self):
+        page = PageImage(pixels=np.full((600, 400), 255, dtype=np.uint8))
+        with mock.patch.object(checkboxes, "_dark_mask", wraps=checkboxes._dark_mask) as dark:
+            checkboxes.detect_checkboxes(page, checkboxes.register_form(page))
+        dark.assert_called_once()
+        self.assertNotIn(page, checkboxes._ink_cache)
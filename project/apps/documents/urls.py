@@ -1,5 +1,5 @@
 from django.urls import path
-from .views import upload, review, clear_history, dispolive_log, photo_upload, photo_gallery
+from .views import upload, upload_status, review, bulk_submit, clear_history, dispolive_log, photo_upload, photo_gallery
 
 app_name = 'documents'
 
@@ -7,7 +7,9 @@ urlpatterns = [
     path('upload/', upload, name='upload'),
     path('photo/', photo_upload, name='photo_upload'),
     path('gallery/', photo_gallery, name='photo_gallery'),
+    path('status/<int:pk>/', upload_status, name='upload_status'),
     path('review/<int:pk>/', review, name='review'),
+    path('bulk-submit/', bulk_submit, name='bulk_submit'),
     path('clear-history/', clear_history, name='clear_history'),
     path('logs/dispolive/', dispolive_log, name='dispolive_log'),
 ]
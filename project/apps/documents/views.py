@@ -4,16 +4,17 @@ from django.contrib import messages
 from django.views.decorators.http import require_POST
 from django.http import HttpResponse, JsonResponse
 from django.conf import settings
+from django.db import transaction
 import json
 import os
 
 from .models import DocumentUpload, DocumentPhoto
 from .forms import DispoliveReportForm as ReviewForm, DocumentPhotoForm
-from .mixins import DocumentUploadMixin
+from .mixins import DocumentUploadMixin, IN_PROGRESS_STATUSES
 from .services.dispolive_logger import get_dispolive_logger
-
-from dispolive_de.parser_new import build_payload
-from dispolive_de.api_client import create_driver_report
+from .services.payload_preview import ensure_payload
+from .services import outbox
+from .services.bulk_submit import submit_uploads
 
 
 # DocumentUploadMixin instance for reusable logic
@@ -36,8 +37,8 @@ def upload(request):
                 file=f
             )
             
-            # Process and parse document using mixin
-            success, error = document_mixin.process_and_parse_document(
+            # Process (or queue) document using mixin
+            success, error = document_mixin.start_processing(
                 upload_obj=upload_obj,
                 file_path=upload_obj.file.path,
                 is_photo=False
@@ -47,6 +48,9 @@ def upload(request):
             if is_ajax:
                 return document_mixin.handle_ajax_response(success, upload_obj, error)
             
+            if success and upload_obj.processing_status in IN_PROGRESS_STATUSES:
+                # Queued: the history list polls the status until parsing is done
+                return redirect("documents:upload")
             if success:
                 return redirect("documents:review", pk=upload_obj.pk)
             
@@ -69,14 +73,27 @@ def upload(request):
     })
 
 
+@login_required
+def upload_status(request, pk):
+    """Processing state of a single upload, polled by the upload pages."""
+    upload_obj = get_object_or_404(DocumentUpload, pk=pk, user=request.user)
+    return JsonResponse(document_mixin.get_status_payload(upload_obj))
+
+
 @login_required
 def review(request, pk):
     logger = get_dispolive_logger()
     upload_obj = get_object_or_404(DocumentUpload, pk=pk, user=request.user)
     
-    if upload_obj.processing_status not in ["pending_review", "done", "error"]:
+    if upload_obj.processing_status not in ["pending_review", "done", "error", "split"]:
         return redirect("documents:upload")
     
+    # Multi-page PDF: every page is reviewed on its own, open the first one still pending
+    pages = upload_obj.pages.order_by("page_number")
+    if pages.exists():
+        page = pages.filter(processing_status="pending_review").first() or pages.first()
+        return redirect("documents:review", pk=page.pk)
+    
     parsed_data = upload_obj.parsed_data or {}
     error_message = upload_obj.processing_error if upload_obj.processing_status == "error" else ""
     
@@ -93,25 +110,18 @@ def review(request, pk):
             upload_obj.parsed_data = updated_data
             
             try:
-                payload = build_payload(updated_data)
+                # Rebuilt only if the review changed fields the payload is built from
+                payload = ensure_payload(upload_obj, updated_data)
                 logger.info("Preparing Dispolive | upload_id=%s user_id=%s", upload_obj.pk, request.user.pk)
-                upload_obj.dispolive_payload = payload
-                
-                api_resp = create_driver_report(payload)
-                
-                if api_resp is None:
-                    logger.error("Dispolive FAILED | upload_id=%s", upload_obj.pk)
-                    upload_obj.processing_status = "error"
-                    upload_obj.processing_error = "Dispolive API returned an error. Check required fields."
-                    upload_obj.save(update_fields=["parsed_data", "dispolive_payload", "processing_status", "processing_error"])
-                    error_message = upload_obj.processing_error
-                else:
-                    logger.info("Dispolive SUCCESS | upload_id=%s", upload_obj.pk)
-                    upload_obj.processing_status = "done"
-                    upload_obj.processing_error = ""
-                    upload_obj.save(update_fields=["parsed_data", "dispolive_payload", "processing_status", "processing_error"])
-                    return redirect("documents:upload")
-                    
+
+                # Reviewed data + outbox row commit together; the report is sent after
+                # the commit, outside this request (outbox.schedule_delivery)
+                with transaction.atomic():
+                    submission = outbox.enqueue(upload_obj, payload)
+                    upload_obj.save(update_fields=["parsed_data", "dispolive_payload", "dispolive_payload_hash", "processing_status", "processing_error"])
+                logger.info("Dispolive QUEUED | upload_id=%s submission_id=%s", upload_obj.pk, submission.pk)
+                return redirect("documents:upload")
+
             except Exception as e:
                 logger.exception("Dispolive EXCEPTION | upload_id=%s", upload_obj.pk)
                 upload_obj.processing_status = "error"
@@ -120,11 +130,15 @@ def review(request, pk):
                 error_message = upload_obj.processing_error
     else:
         form = ReviewForm.from_parsed_data(parsed_data)
+        form.mark_numeric_checks(parsed_data.get("numeric_ocr") if isinstance(parsed_data, dict) else None)
     
-    # Prepare Dispolive payload for display (preview from parsed_data)
+    # Dispolive payload for display: built at parse time, rebuilt only when its inputs changed
     dispolive_payload_json = None
     try:
-        preview_payload = build_payload(parsed_data)
+        stored = upload_obj.dispolive_payload
+        preview_payload = ensure_payload(upload_obj, parsed_data)
+        if preview_payload is not stored:
+            upload_obj.save(update_fields=["dispolive_payload", "dispolive_payload_hash"])
         dispolive_payload_json = json.dumps(preview_payload, indent=2, ensure_ascii=False)
     except Exception as e:
         logger.warning("Failed to build payload preview for upload_id=%s: %s", upload_obj.pk, str(e))
@@ -139,6 +153,29 @@ def review(request, pk):
     })
 
 
+@login_required
+@require_POST
+def bulk_submit(request):
+    """Approve the selected pending_review uploads as extracted and send them to Dispolive."""
+    back = request.POST.get("source") if request.POST.get("source") in ("upload", "photo_upload") else "upload"
+    ids = [i for i in request.POST.getlist("upload_ids") if i.isdigit()]
+    uploads = list(
+        # Multi-page parents are not sent themselves (their pages are)
+        DocumentUpload.objects.filter(user=request.user, pk__in=ids, processing_status="pending_review", pages__isnull=True)
+        .order_by("created_at")
+    )
+    if not uploads:
+        messages.warning(request, "Select at least one upload waiting for review.")
+        return redirect(f"documents:{back}")
+
+    results = submit_uploads(uploads)
+    return render(request, "documents/bulk_submit_result.html", {
+        "results": results,
+        "back_url": f"documents:{back}",
+        "title": "Bulk submit",
+    })
+
+
 @login_required
 @require_POST
 def clear_history(request):
@@ -174,8 +211,8 @@ def photo_upload(request):
                     photo_form=form
                 )
                 
-                # Process and parse photo using mixin
-                success, error = document_mixin.process_and_parse_document(
+                # Process (or queue) photo using mixin
+                success, error = document_mixin.start_processing(
                     upload_obj=upload_obj,
                     file_path=photo.image.path,
                     is_photo=True
@@ -185,6 +222,8 @@ def photo_upload(request):
                 if is_ajax:
                     return document_mixin.handle_ajax_response(success, upload_obj, error)
                 
+                if success and upload_obj.processing_status in IN_PROGRESS_STATUSES:
+                    return redirect('documents:photo_upload')
                 if success:
                     return redirect("documents:review", pk=upload_obj.pk)
                 return redirect('documents:photo_upload')
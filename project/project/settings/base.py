@@ -30,6 +30,7 @@ BASE_APPS = [
     'django.contrib.staticfiles',
     'apps.core',
     'widget_tweaks',
+    'background_task',
     'apps.documents',
 ]
 
@@ -152,3 +153,101 @@ DATA_UPLOAD_MAX_NUMBER_FIELDS = 500000
 STATICFILES_DIRS = [
     BASE_DIR / "static",
 ]
+
+# === Documents processing ===
+# "queued" (default): upload and review views return immediately; parsing and
+# Dispolive retries run in the django-background-tasks worker, which must run
+# next to the web server:
+#     python manage.py process_tasks --queue documents   (and --queue dispolive)
+# or one `python manage.py process_tasks` for both queues. Without it,
+# queued uploads stay "uploaded".
+# "sync": parse inside the upload request, no worker needed (development.py
+# default - docker-compose.dev.yml starts no worker). See README.md.
+DOCUMENTS_PROCESSING_MODE = os.environ.get("DOCUMENTS_PROCESSING_MODE", "queued")
+
+BACKGROUND_TASK_RUN_ASYNC = True
+BACKGROUND_TASK_ASYNC_THREADS = int(os.environ.get("DOCUMENTS_WORKER_CONCURRENCY", "4"))
+
+# Multi-page PDFs: one child upload per page, rendered in a process pool and
+# sent to GPT concurrently.
+DOCUMENTS_PDF_MULTIPAGE = os.environ.get("DOCUMENTS_PDF_MULTIPAGE", "1") == "1"
+DOCUMENTS_PDF_MAX_PAGES = int(os.environ.get("DOCUMENTS_PDF_MAX_PAGES", "50"))
+DOCUMENTS_PDF_RENDER_WORKERS = int(os.environ.get("DOCUMENTS_PDF_RENDER_WORKERS", "4"))
+DOCUMENTS_GPT_CONCURRENCY = int(os.environ.get("DOCUMENTS_GPT_CONCURRENCY", "4"))
+# Shared OpenAI client (one keep-alive connection pool per worker process)
+DOCUMENTS_OPENAI_MAX_CONNECTIONS = int(os.environ.get("DOCUMENTS_OPENAI_MAX_CONNECTIONS", "20"))
+DOCUMENTS_OPENAI_MAX_KEEPALIVE = int(os.environ.get("DOCUMENTS_OPENAI_MAX_KEEPALIVE", "20"))
+DOCUMENTS_OPENAI_KEEPALIVE_EXPIRY = float(os.environ.get("DOCUMENTS_OPENAI_KEEPALIVE_EXPIRY", "60"))
+# Record / replay of OpenAI calls (services/openai_standin.py): "", "record" or "replay".
+# Replay latency: "recorded", "0" or "MEDIAN:P95" in ms.
+DOCUMENTS_OPENAI_STANDIN = os.environ.get("DOCUMENTS_OPENAI_STANDIN", "")
+DOCUMENTS_OPENAI_FIXTURES_DIR = Path(os.environ.get("DOCUMENTS_OPENAI_FIXTURES_DIR", str(BASE_DIR / "fixtures" / "openai")))
+DOCUMENTS_OPENAI_REPLAY_LATENCY = os.environ.get("DOCUMENTS_OPENAI_REPLAY_LATENCY", "recorded")
+
+# Dispolive submissions go through an outbox (services/outbox.py), drained by
+# the worker: bounded concurrency (also the limit for bulk submit),
+# exponential backoff, then dead letter.
+DOCUMENTS_DISPOLIVE_SUBMIT_CONCURRENCY = int(os.environ.get("DOCUMENTS_DISPOLIVE_SUBMIT_CONCURRENCY", "4"))
+DOCUMENTS_DISPOLIVE_SUBMIT_MAX_ATTEMPTS = int(os.environ.get("DOCUMENTS_DISPOLIVE_SUBMIT_MAX_ATTEMPTS", "8"))
+DOCUMENTS_DISPOLIVE_SUBMIT_BACKOFF_BASE = int(os.environ.get("DOCUMENTS_DISPOLIVE_SUBMIT_BACKOFF_BASE", "30"))
+DOCUMENTS_DISPOLIVE_SUBMIT_BACKOFF_MAX = int(os.environ.get("DOCUMENTS_DISPOLIVE_SUBMIT_BACKOFF_MAX", "3600"))
+
+# Log Python/NumPy peak allocations per upload (tracemalloc, slows processing down)
+DOCUMENTS_TRACE_MEMORY = os.environ.get("DOCUMENTS_TRACE_MEMORY", "0") == "1"
+
+# GPT extraction cache (page image hash + prompt/schema version)
+DOCUMENTS_EXTRACTION_CACHE_ENABLED = os.environ.get("DOCUMENTS_EXTRACTION_CACHE_ENABLED", "1") == "1"
+DOCUMENTS_EXTRACTION_CACHE_TTL = int(os.environ.get("DOCUMENTS_EXTRACTION_CACHE_TTL", str(30 * 24 * 3600)))
+DOCUMENTS_EXTRACTION_CACHE_MAX_ENTRIES = int(os.environ.get("DOCUMENTS_EXTRACTION_CACHE_MAX_ENTRIES", "5000"))
+# Seconds between two trims of the table (per worker process)
+DOCUMENTS_EXTRACTION_CACHE_EVICT_INTERVAL = int(os.environ.get("DOCUMENTS_EXTRACTION_CACHE_EVICT_INTERVAL", "600"))
+
+# Digital PDFs (services/text_layer.py): pages with a real text layer of at least
+# MIN_CHARS characters go to GPT as positioned text instead of an image.
+DOCUMENTS_PDF_TEXT_LAYER = os.environ.get("DOCUMENTS_PDF_TEXT_LAYER", "1") == "1"
+DOCUMENTS_PDF_TEXT_LAYER_MIN_CHARS = int(os.environ.get("DOCUMENTS_PDF_TEXT_LAYER_MIN_CHARS", "200"))
+
+# Decoded page rasters (services/raster_cache.py): memory-mapped per file hash /
+# page / DPI, so re-processing skips rendering and decoding. LRU, 0 = off.
+DOCUMENTS_RASTER_CACHE_DIR = Path(os.environ.get("DOCUMENTS_RASTER_CACHE_DIR", str(MEDIA_ROOT / "raster_cache")))
+DOCUMENTS_RASTER_CACHE_MAX_MB = int(os.environ.get("DOCUMENTS_RASTER_CACHE_MAX_MB", "2048"))
+
+# Photo quality gate (services/photo_quality.py): blurry, dark, glare-covered or
+# far-away photos are rejected with a retake message before the GPT call.
+# The metrics are stored for every photo (manage.py photo_quality); the defaults
+# come from `manage.py photo_quality --calibrate` on degraded sample captures.
+DOCUMENTS_PHOTO_QUALITY_GATE = os.environ.get("DOCUMENTS_PHOTO_QUALITY_GATE", "1") == "1"
+DOCUMENTS_PHOTO_MIN_SHARPNESS = float(os.environ.get("DOCUMENTS_PHOTO_MIN_SHARPNESS", "100"))
+DOCUMENTS_PHOTO_MIN_BRIGHTNESS = float(os.environ.get("DOCUMENTS_PHOTO_MIN_BRIGHTNESS", "50"))
+DOCUMENTS_PHOTO_MAX_GLARE = float(os.environ.get("DOCUMENTS_PHOTO_MAX_GLARE", "0.05"))
+DOCUMENTS_PHOTO_MIN_COVERAGE = float(os.environ.get("DOCUMENTS_PHOTO_MIN_COVERAGE", "0.15"))
+
+# Photos are cropped to the sheet, rectified and turned upright before extraction
+# (services/photo_geometry.py).
+DOCUMENTS_PHOTO_NORMALIZE = os.environ.get("DOCUMENTS_PHOTO_NORMALIZE", "1") == "1"
+
+# Local Muster 4 checkbox detector (services/checkboxes.py): results are sent to
+# GPT as hints; boxes detected with at least this confidence override GPT.
+DOCUMENTS_CHECKBOX_DETECTION = os.environ.get("DOCUMENTS_CHECKBOX_DETECTION", "1") == "1"
+DOCUMENTS_CHECKBOX_OVERRIDE_CONFIDENCE = float(os.environ.get("DOCUMENTS_CHECKBOX_OVERRIDE_CONFIDENCE", "0.9"))
+
+# Arzt-Nr. OCR fallback (Tesseract), used when GPT returns no 9-digit number.
+# SPECULATIVE starts it alongside the GPT call on a pool of OCR_WORKERS threads
+# per process; the result is dropped when GPT's number is valid.
+DOCUMENTS_ARZT_OCR_SPECULATIVE = os.environ.get("DOCUMENTS_ARZT_OCR_SPECULATIVE", "1") == "1"
+DOCUMENTS_OCR_WORKERS = int(os.environ.get("DOCUMENTS_OCR_WORKERS", "4"))
+# OCR results per crop hash (services/ocr_engine.py), in-process LRU; 0 = off
+DOCUMENTS_OCR_CACHE_SIZE = int(os.environ.get("DOCUMENTS_OCR_CACHE_SIZE", "2000"))
+# Cross-check of the printed numbers (services/numeric_ocr.py): read on the same
+# pool during the GPT call; disagreements are flagged for review.
+DOCUMENTS_NUMERIC_OCR = os.environ.get("DOCUMENTS_NUMERIC_OCR", "1") == "1"
+
+# Image sent to GPT (services/image_payload.py). By default the page is resized to
+# what OpenAI keeps (768 px short side); MAX_TILES (512 px tiles) lowers it further.
+# FORMAT "" keeps the source format (PNG renders, JPEG photos).
+DOCUMENTS_GPT_IMAGE_RESIZE = os.environ.get("DOCUMENTS_GPT_IMAGE_RESIZE", "1") == "1"
+DOCUMENTS_GPT_IMAGE_MAX_TILES = int(os.environ.get("DOCUMENTS_GPT_IMAGE_MAX_TILES", "0")) or None
+DOCUMENTS_GPT_IMAGE_GRAYSCALE = os.environ.get("DOCUMENTS_GPT_IMAGE_GRAYSCALE", "0") == "1"
+DOCUMENTS_GPT_IMAGE_FORMAT = os.environ.get("DOCUMENTS_GPT_IMAGE_FORMAT", "")
+DOCUMENTS_GPT_IMAGE_JPEG_QUALITY = int(os.environ.get("DOCUMENTS_GPT_IMAGE_JPEG_QUALITY", "85"))
+DOCUMENTS_GPT_IMAGE_DETAIL = os.environ.get("DOCUMENTS_GPT_IMAGE_DETAIL", "high")
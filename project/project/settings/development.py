@@ -8,3 +8,5 @@ STATICFILES_DIRS = [
     os.path.join(BASE_DIR, 'project', 'static')
 ]
 
+# No background worker in the dev setup: parse inside the upload request
+DOCUMENTS_PROCESSING_MODE = os.environ.get("DOCUMENTS_PROCESSING_MODE", "sync")
@@ -3,3 +3,5 @@ from .base import *
 
 STATIC_ROOT = os.path.join(BASE_DIR, 'staticroot')
 
+# Parsing and Dispolive delivery run in the process_tasks worker (README.md)
+DOCUMENTS_PROCESSING_MODE = "queued"
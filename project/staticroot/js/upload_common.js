@@ -5,6 +5,8 @@
  */
 
 const UPLOAD_TIMEOUT_MS = 180000; // 3 minutes
+const STATUS_POLL_INTERVAL_MS = 2000;
+const STATUS_POLL_TIMEOUT_MS = 600000; // 10 minutes (queue wait + parsing)
 let uploadTimeoutId = null;
 
 document.addEventListener('DOMContentLoaded', function() {
@@ -15,6 +17,8 @@ document.addEventListener('DOMContentLoaded', function() {
     
     initHistoryToggle();
     initLogModal();
+    initStatusPolling();
+    initBulkSubmit();
     
     function getStorageKey() {
         const path = window.location.pathname;
@@ -60,9 +64,70 @@ document.addEventListener('DOMContentLoaded', function() {
         });
     }
     
+    function initStatusPolling() {
+        // Queued/processing uploads in the history list: reload once any of them finishes
+        const pending = document.querySelectorAll('[data-status-url]');
+        pending.forEach(function(item) {
+            window.pollUploadStatus(item.getAttribute('data-status-url'), function() {
+                window.location.reload();
+            });
+        });
+    }
+    
+    function initBulkSubmit() {
+        // "Submit selected": enabled while at least one pending_review upload is ticked
+        const form = document.getElementById('bulkSubmitForm');
+        const btn = document.getElementById('bulkSubmitBtn');
+        if (!form || !btn) return;
+        const boxes = document.querySelectorAll('.upload-select');
+        const label = btn.innerHTML;
+        function update() {
+            const count = document.querySelectorAll('.upload-select:checked').length;
+            btn.disabled = count === 0;
+            btn.innerHTML = count ? label.replace('Submit selected', 'Submit selected (' + count + ')') : label;
+        }
+        boxes.forEach(function(box) { box.addEventListener('change', update); });
+        form.addEventListener('submit', function() {
+            btn.disabled = true;
+            btn.innerHTML = '<span class="spinner-border spinner-border-sm me-1" role="status"></span>Sending...';
+        });
+    }
+    
     window.getStorageKey = getStorageKey;
 });
 
+/**
+ * Poll the upload status endpoint until processing has finished.
+ * onFinish(data) is called with the final status payload, onError(message) on failure/timeout.
+ */
+window.pollUploadStatus = function(statusUrl, onFinish, onError) {
+    const startedAt = Date.now();
+    
+    function poll() {
+        fetch(statusUrl, { headers: { 'X-Requested-With': 'XMLHttpRequest' } })
+            .then(response => {
+                if (!response.ok) {
+                    throw new Error('Status check failed: ' + response.status);
+                }
+                return response.json();
+            })
+            .then(data => {
+                if (data.finished) {
+                    onFinish(data);
+                } else if (Date.now() - startedAt > STATUS_POLL_TIMEOUT_MS) {
+                    if (onError) onError('Processing is taking too long. Check the upload history later.');
+                } else {
+                    setTimeout(poll, STATUS_POLL_INTERVAL_MS);
+                }
+            })
+            .catch(error => {
+                if (onError) onError(error.message);
+            });
+    }
+    
+    setTimeout(poll, STATUS_POLL_INTERVAL_MS);
+};
+
 window.setUploadButtonState = function(buttonId, loading) {
     var btn = document.getElementById(buttonId);
     var btnText = document.getElementById(buttonId + 'Text');